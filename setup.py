@@ -42,6 +42,10 @@ setup(
     classifiers=classifiers,
     packages=['visio2img'],
     tests_require=test_requires,
+    extras_require={
+        'native': ['cairosvg', 'Pillow'],
+        'variants': ['Pillow'],
+    },
     entry_points="""
        [console_scripts]
        visio2img = visio2img.visio2img:main
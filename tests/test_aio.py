@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img.testing import FakeDispatcher
+
+try:
+    import asyncio
+    from visio2img.aio import AsyncExporter
+except (ImportError, SyntaxError):  # python 2
+    asyncio = None
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+@unittest.skipIf(asyncio is None, 'asyncio API requires python 3.5')
+class TestAsyncExporter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.dispatcher = FakeDispatcher(export_latency=0.05)
+        self.exporter = AsyncExporter(2, dispatch=self.dispatcher)
+
+    def tearDown(self):
+        self.exporter.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        rmtree(self.tmpdir)
+
+    def run_loop(self, *coroutines):
+        return self.loop.run_until_complete(
+            asyncio.gather(*coroutines, return_exceptions=True))
+
+    def test_export_img(self):
+        ticks = []
+
+        def tick():
+            ticks.append(time.time())
+            self.loop.call_later(0.01, tick)
+
+        self.loop.call_soon(tick)
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+        results = self.run_loop(*[
+            self.exporter.export_img(filename,
+                                     os.path.join(self.tmpdir, '%d.png' % i))
+            for i in range(20)])
+
+        self.assertEqual([[None]] * 20,
+                         [[r.error for r in result] for result in results])
+        self.assertEqual(20, len(os.listdir(self.tmpdir)))
+
+        # 20 exports by 2 Visio; the event loop is not blocked
+        self.assertEqual(2, len(self.dispatcher.apps))
+        self.assertGreater(len(ticks), 20)
+
+    def test_errors(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        self.dispatcher.broken_pages = [u'ページ - 2']
+        results = self.run_loop(
+            self.exporter.export_img(os.path.join(EXAMPLE_DIR, 'notexist.vsd'),
+                                     os.path.join(self.tmpdir, 'a.png')),
+            self.exporter.export_img(filename,
+                                     os.path.join(self.tmpdir, 'b.png'), 3),
+            self.exporter.export_img(filename,
+                                     os.path.join(self.tmpdir, 'c.png')),
+            self.exporter.export_pages(filename,
+                                       os.path.join(self.tmpdir, 'd.png')))
+
+        self.assertIsInstance(results[0], IOError)
+        self.assertIsInstance(results[1], IndexError)
+        self.assertIsInstance(results[2], IOError)
+        self.assertEqual([None, Exception], [r.error and type(r.error)
+                                             for r in results[3]])
+
+    def test_timeout(self):
+        self.dispatcher.export_latency = 0.1
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        results = self.run_loop(
+            self.exporter.export_img(filename,
+                                     os.path.join(self.tmpdir, 'a.png'),
+                                     timeout=0.25))
+        self.assertIsInstance(results[0], asyncio.TimeoutError)
+
+        # export stops at the next page, and the document is closed
+        self.exporter.close()
+        self.assertLess(len(os.listdir(self.tmpdir)), 10)
+        self.assertEqual([], self.dispatcher.apps[0].Documents.documents)
+        self.assertEqual(1, len(self.dispatcher.apps))
+
+    def test_cancel(self):
+        self.dispatcher.export_latency = 0.1
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        tasks = [self.loop.create_task(self.exporter.export_img(
+            filename, os.path.join(self.tmpdir, '%d.png' % i)))
+            for i in range(3)]
+        self.loop.call_later(0.15, tasks[0].cancel)
+        self.loop.call_later(0.15, tasks[2].cancel)  # not started yet
+        self.run_loop(*tasks)
+
+        self.assertEqual([True, False, True], [t.cancelled() for t in tasks])
+        self.exporter.close()
+        exported = [f[0] for f in os.listdir(self.tmpdir)]
+        self.assertEqual(10, exported.count('1'))
+        self.assertLess(exported.count('0'), 10)
+        self.assertEqual(0, exported.count('2'))
+        for app in self.dispatcher.apps:
+            self.assertEqual([], app.Documents.documents)
+
+    def test_concurrency(self):
+        exporter = AsyncExporter(2, concurrency=1, dispatch=self.dispatcher)
+        self.addCleanup(exporter.close)
+
+        running = []
+        peak = []
+        export = exporter.export
+
+        def count_export(*args):
+            running.append(args)
+            peak.append(len(running))
+            try:
+                return export(*args)
+            finally:
+                running.remove(args)
+
+        exporter.export = count_export
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+        self.run_loop(*[
+            exporter.export_img(filename, os.path.join(self.tmpdir, 'a.png'))
+            for i in range(4)])
+        self.assertEqual([1, 1, 1, 1], peak)
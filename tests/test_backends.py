@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img import backends
+from visio2img.backends import (
+    NativeBackend, VisioBackend, get_backend, get_backend_names,
+    get_default_backend_name, register_backend, select_backend
+)
+from visio2img.testing import FakeBackend
+from visio2img.visio2img import list_pages, main
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestBackends(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        # isolate the registry from other tests
+        self.patches = [patch.object(backends, '_registry',
+                                     list(backends._registry)),
+                        patch.object(backends, '_backends', {}),
+                        patch.object(backends, '_entry_points_loaded', False),
+                        patch.object(backends, 'iter_entry_points',
+                                     return_value=[])]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in reversed(self.patches):
+            patcher.stop()
+        rmtree(self.tmpdir)
+
+    def test_get_backend(self):
+        self.assertIsInstance(get_backend('visio'), VisioBackend)
+        self.assertIsInstance(get_backend('native'), NativeBackend)
+        self.assertIs(get_backend('visio'), get_backend())
+        with self.assertRaises(OSError):
+            get_backend('unknown')
+
+    def test_register_backend_lazily(self):
+        register_backend('fake', 'visio2img.testing:FakeBackend')
+        self.assertNotIn('fake', backends._backends)
+        self.assertEqual(['visio', 'native', 'fake'], get_backend_names())
+
+        backend = get_backend('fake')
+        self.assertIsInstance(backend, FakeBackend)
+        self.assertIs(backend, get_backend('fake'))
+        backend.close()
+
+    def test_entry_points(self):
+        backends.iter_entry_points.return_value = [
+            ('fake', 'visio2img.testing:FakeBackend'),
+            ('native', 'visio2img.testing:FakeBackend'),  # not overridden
+        ]
+        self.assertIsInstance(get_backend('native'), NativeBackend)
+        backend = get_backend('fake')  # entry points are loaded on demand
+        self.assertIsInstance(backend, FakeBackend)
+        self.assertEqual(['visio', 'native', 'fake'], get_backend_names())
+        self.assertEqual(1, backends.iter_entry_points.call_count)
+        backend.close()
+
+    @patch("visio2img.visio2img.is_pywin32_available")
+    def test_select_backend(self, is_pywin32_available):
+        is_pywin32_available.return_value = True
+        self.assertEqual('visio', select_backend('diagram.vsd'))
+        self.assertEqual('visio', select_backend('diagram.vsdx'))
+        self.assertEqual('visio', select_backend())
+
+        # without Visio, .vsdx files are rendered natively
+        is_pywin32_available.return_value = False
+        self.assertEqual('native', select_backend('diagram.vsdx'))
+        with self.assertRaises(OSError):
+            select_backend('diagram.vsd')
+        with self.assertRaises(OSError):
+            select_backend()  # no backend converts .vsd files
+
+        # backends of entry points are tried at last
+        backends._entry_points_loaded = False
+        backends.iter_entry_points.return_value = [
+            ('fake', 'visio2img.testing:FakeBackend')]
+        self.assertEqual('fake', select_backend('diagram.vsd'))
+        get_backend('fake').close()
+
+    def test_backend_option(self):
+        register_backend('fake', FakeBackend)
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsd')
+        output = os.path.join(self.tmpdir, 'output.png')
+        self.assertEqual(0, main(['--backend', 'fake', filename, output]))
+        self.assertEqual(['output1.png', 'output2.png'],
+                         sorted(os.listdir(self.tmpdir)))
+        self.assertEqual(2, len(get_backend('fake').pool.dispatch.exported))
+        self.assertIsNone(get_default_backend_name())
+
+        with patch('sys.stderr', new_callable=StringIO):
+            for args in (['--backend', 'unknown', filename, output],
+                         ['--backend', 'fake', '--native', filename, output]):
+                with self.assertRaises(SystemExit):
+                    main(args)
+        get_backend('fake').close()
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_list_pages_by_default_backend(self, _):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsd')
+
+        # no backend for .vsd files without Visio
+        with patch('sys.stderr', new_callable=StringIO) as stderr:
+            self.assertEqual(-1, main([filename,
+                                       os.path.join(self.tmpdir, 'a.png')]))
+            self.assertIn('No backend available', stderr.getvalue())
+
+        register_backend('fake', FakeBackend)
+        backends.configure_default_backend('fake')
+        try:
+            pages = list_pages(filename)
+            self.assertEqual([1, 2], [page.index for page in pages])
+        finally:
+            backends.configure_default_backend(None)
+            get_backend('fake').close()
+
+    def test_lazy_loading(self):
+        code = ('import sys; import visio2img.visio2img; '
+                'print([name for name in ("visio2img.render", "win32com", '
+                '"multiprocessing.pool") if name in sys.modules])')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=root)
+        self.assertEqual(b'[]', output.strip())
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import unittest
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
+
+from visio2img.batch import (
+    BatchJob,
+    collect_jobs,
+    read_manifest,
+    run_batch,
+    print_summary,
+)
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher
+from visio2img.visio2img import main, parse_options
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        os.makedirs(os.path.join(self.srcdir, 'sub'))
+        for filename in ('singlepage.vsdx', 'multipages.vsd'):
+            copyfile(os.path.join(EXAMPLE_DIR, filename),
+                     os.path.join(self.srcdir, filename))
+        copyfile(os.path.join(EXAMPLE_DIR, 'multipages2.vsdx'),
+                 os.path.join(self.srcdir, 'sub', 'multipages2.vsdx'))
+        open(os.path.join(self.srcdir, 'README.txt'), 'w').close()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_collect_jobs_from_directory(self):
+        jobs = collect_jobs([self.srcdir], 'out', '.gif')
+        expected = [
+            BatchJob(os.path.join(self.srcdir, 'multipages.vsd'),
+                     os.path.join('out', 'multipages.gif')),
+            BatchJob(os.path.join(self.srcdir, 'singlepage.vsdx'),
+                     os.path.join('out', 'singlepage.gif')),
+            BatchJob(os.path.join(self.srcdir, 'sub', 'multipages2.vsdx'),
+                     os.path.join('out', 'sub', 'multipages2.gif')),
+        ]
+        self.assertEqual(expected, jobs)
+
+    def test_collect_jobs_from_glob_and_file(self):
+        pattern = os.path.join(self.srcdir, '*.vsd*')
+        filename = os.path.join(self.srcdir, 'sub', 'multipages2.vsdx')
+        jobs = collect_jobs([pattern, filename], 'out')
+        self.assertEqual([os.path.join('out', 'multipages.png'),
+                          os.path.join('out', 'singlepage.png'),
+                          os.path.join('out', 'multipages2.png')],
+                         [job.image_filename for job in jobs])
+
+        with self.assertRaises(IOError):
+            collect_jobs([os.path.join(self.srcdir, '*.vdx')], 'out')
+
+    def test_read_manifest(self):
+        manifest = os.path.join(self.tmpdir, 'manifest.txt')
+        with io.open(manifest, 'w', encoding='utf-8') as fd:
+            fd.write(u'# comment\n'
+                     u'\n'
+                     u'src/singlepage.vsdx  out/{name}.jpg\n'
+                     u'"src/sub/multipages2.vsdx" "out/with space.png"\n')
+
+        jobs = read_manifest(manifest)
+        self.assertEqual(
+            [BatchJob(os.path.join(self.tmpdir, 'src/singlepage.vsdx'),
+                      os.path.join(self.tmpdir, 'out/singlepage.jpg')),
+             BatchJob(os.path.join(self.tmpdir, 'src/sub/multipages2.vsdx'),
+                      os.path.join(self.tmpdir, 'out/with space.png'))],
+            jobs)
+
+        for entry in (u'src/singlepage.vsdx',
+                      u'src/singlepage.vsdx out/{stem}.png',
+                      u'src/singlepage.vsdx out/{0}.png',
+                      u'src/singlepage.vsdx out/{name.png'):
+            with io.open(manifest, 'w', encoding='utf-8') as fd:
+                fd.write(u'# comment\n' + entry + u'\n')
+            with self.assertRaises(IOError) as cm:
+                read_manifest(manifest)
+            self.assertIn('line 2', str(cm.exception))
+
+    def test_run_batch(self):
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(dispatch=dispatcher)
+        outdir = os.path.join(self.tmpdir, 'out')
+        jobs = collect_jobs([self.srcdir], outdir)
+        jobs.insert(1, BatchJob('notexist.vsdx', 'notexist.png'))
+
+        results = list(run_batch(jobs, pool=pool))
+        self.assertEqual([None, IOError, None, None],
+                         [r.error and type(r.error) for r in results])
+        self.assertTrue(os.path.exists(os.path.join(outdir, 'sub',
+                                                    'multipages210.png')))
+        self.assertEqual(1, len(dispatcher.apps))
+
+        stream = io.StringIO() if sys.version_info > (3, 0) else io.BytesIO()
+        self.assertEqual(1, print_summary(results, stream))
+        self.assertIn('3 converted, 1 failed', stream.getvalue())
+
+    @patch("sys.stdout")
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=True)
+    def test_main_batch(self, *_):
+        outdir = os.path.join(self.tmpdir, 'out')
+        pool = VisioAppPool(dispatch=FakeDispatcher())
+        with patch('visio2img.pool._default_pool', pool):
+            ret = main(['--batch', '-f', 'jpg', '-d', outdir, self.srcdir])
+            self.assertEqual(0, ret)
+            self.assertEqual(['multipages1.jpg', 'multipages2.jpg',
+                              'singlepage.jpg', 'sub'],
+                             sorted(os.listdir(outdir)))
+
+            # failure of a file makes exit status non-zero
+            broken = os.path.join(self.srcdir, 'broken.vsdx')
+            open(broken, 'w').close()
+            pool.dispatch.page_names = (
+                lambda filename: [] if filename.endswith('broken.vsdx')
+                else [u'Page-1'])
+            ret = main(['--batch', '-d', outdir, self.srcdir])
+            self.assertEqual(-1, ret)
+            self.assertTrue(os.path.exists(os.path.join(outdir,
+                                                        'singlepage.png')))
+
+    @patch("sys.stdout")
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_main_batch_without_visio(self, *_):
+        outdir = os.path.join(self.tmpdir, 'out')
+        args = ['--batch', '-f', 'svg', '-d', outdir, self.srcdir]
+
+        # a backend for any visio files is required for .vsd files
+        with patch('sys.stderr', new_callable=StringIO) as stderr:
+            with self.assertRaises(SystemExit):
+                parse_options(args)
+            self.assertIn('Unsupported image format: svg', stderr.getvalue())
+
+        # .vsdx files are converted by the native renderer
+        os.remove(os.path.join(self.srcdir, 'multipages.vsd'))
+        options, _ = parse_options(args)
+        self.assertEqual('native', options.backend)
+        options, _ = parse_options(['--watch', '-f', 'svg', '-d', outdir,
+                                    self.srcdir])
+        self.assertEqual('native', options.backend)
+
+        self.assertEqual(0, main(args))
+        self.assertEqual(['singlepage.svg', 'sub'],
+                         sorted(os.listdir(outdir)))
+        self.assertEqual(10, len(os.listdir(os.path.join(outdir, 'sub'))))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+import unittest
+
+from visio2img.benchmark import MODES, Benchmark, percentile, run, summarize
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(100, 0, -1))
+        self.assertEqual(50, percentile(values, 0.5))
+        self.assertEqual(95, percentile(values, 0.95))
+        self.assertEqual(100, percentile(values, 1))
+        self.assertEqual(3, percentile([3], 0.95))
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_run(self):
+        with Benchmark(documents=3, pages=2, startup_latency=0.05,
+                       open_latency=0, export_latency=0.01,
+                       quit_latency=0) as benchmark:
+            results = dict((mode, summarize(benchmark.run(mode)))
+                           for mode in MODES)
+
+        for mode in ['cold', 'serial', 'batch', 'parallel', 'cli']:
+            self.assertEqual(3, results[mode]['documents'])
+            self.assertEqual(6, results[mode]['pages'])
+            self.assertGreater(results[mode]['pages_per_sec'], 0)
+            self.assertLessEqual(results[mode]['p50'], results[mode]['p95'])
+        self.assertEqual(300, results['filter']['documents'])
+
+        # warm pool does not pay for launching Visio for each document
+        self.assertGreater(results['serial']['docs_per_sec'],
+                           results['cold']['docs_per_sec'])
+
+    def test_command(self):
+        args = ['-m', 'serial', '-m', 'batch', '-n', '2', '-p', '1',
+                '--startup', '0', '--open', '0', '--export', '0',
+                '--quit', '0']
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.assertEqual(0, run(args))
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].startswith('serial '))
+
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.assertEqual(0, run(args + ['--json']))
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(['serial', 'batch'], [r['mode'] for r in results])
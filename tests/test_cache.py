@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import unittest
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
+
+from visio2img.cache import ImageCache
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher
+from visio2img.visio2img import export_img, main
+
+if sys.version_info > (3, 0):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.outdir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(self.outdir)
+        self.visio_filename = os.path.join(self.tmpdir, 'multipages.vsdx')
+        copyfile(os.path.join(EXAMPLE_DIR, 'multipages.vsdx'),
+                 self.visio_filename)
+        self.dispatcher = FakeDispatcher([u'Page-1', u'Page-2'])
+        self.pool = VisioAppPool(dispatch=self.dispatcher)
+        self.cache = ImageCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def export_img(self, image_filename, pagenum=None, pagename=None):
+        export_img(self.visio_filename,
+                   os.path.join(self.outdir, image_filename),
+                   pagenum, pagename, pool=self.pool, cache=self.cache)
+
+    def test_make_key(self):
+        key = self.cache.make_key(self.visio_filename, None, None, 'a.png')
+        self.assertEqual(key, self.cache.make_key(self.visio_filename,
+                                                  None, None, 'b.PNG'))
+        self.assertNotEqual(key, self.cache.make_key(self.visio_filename,
+                                                     None, None, 'a.gif'))
+        self.assertNotEqual(key, self.cache.make_key(self.visio_filename,
+                                                     1, None, 'a.png'))
+        self.assertNotEqual(key, self.cache.make_key(self.visio_filename,
+                                                     None, u'Page-1',
+                                                     'a.png'))
+
+        with open(self.visio_filename, 'ab') as fd:
+            fd.write(b'modified')
+        self.assertNotEqual(key, self.cache.make_key(self.visio_filename,
+                                                     None, None, 'a.png'))
+
+        with self.assertRaises(IOError):
+            self.cache.make_key('/path/to/notexist.vsdx', None, None, 'a.png')
+
+    def test_export_img_with_cache(self):
+        self.export_img('a.png')
+        self.assertEqual(1, len(self.dispatcher.apps))
+        self.assertEqual(2, len(self.dispatcher.exported))
+
+        # cache hit: Visio is not used at all
+        self.pool.close()
+        self.export_img('b.png')
+        self.assertEqual(['a1.png', 'a2.png', 'b1.png', 'b2.png'],
+                         sorted(os.listdir(self.outdir)))
+        for name in ('1.png', '2.png'):
+            with open(os.path.join(self.outdir, 'a' + name), 'rb') as a:
+                with open(os.path.join(self.outdir, 'b' + name), 'rb') as b:
+                    self.assertEqual(a.read(), b.read())
+
+        # other page selection is not cached yet
+        with self.assertRaises(OSError):
+            self.export_img('c.png', 2)
+
+    def test_link(self):
+        self.cache.link = True
+        self.export_img('a.png', 1)
+        self.export_img('b.png', 1)
+        self.export_img('c.png', 1)
+        self.assertEqual(os.stat(os.path.join(self.outdir, 'b.png')).st_ino,
+                         os.stat(os.path.join(self.outdir, 'c.png')).st_ino)
+
+    def test_evict(self):
+        self.export_img('a.png', 1)
+        self.export_img('b.png', 2)
+        self.assertEqual(2, len(os.listdir(self.cache.directory)))
+
+        # touch the first entry; the second one is least recently used
+        past = time.time() - 60
+        for key in os.listdir(self.cache.directory):
+            os.utime(os.path.join(self.cache.directory, key), (past, past))
+        self.export_img('c.png', 1)
+
+        size = os.path.getsize(os.path.join(self.outdir, 'a.png'))
+        self.cache.max_bytes = size
+        self.cache.evict()
+        self.pool.close()
+        self.export_img('d.png', 1)
+        with self.assertRaises(OSError):
+            self.export_img('e.png', 2)
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=True)
+    @patch("visio2img.visio2img.export_img")
+    def test_cache_options(self, export_img, _):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        main(['--cache-dir', cache_dir, 'input.vsd', 'output.png'])
+        cache = export_img.call_args[1]['cache']
+        self.assertEqual(cache_dir, cache.directory)
+        self.assertEqual(1024 * 1024 * 1024, cache.max_bytes)
+
+        main(['--cache-dir', cache_dir, '--cache-size', '10',
+              'input.vsd', 'output.png'])
+        self.assertEqual(10 * 1024 * 1024,
+                         export_img.call_args[1]['cache'].max_bytes)
+
+        main(['--cache-dir', cache_dir, '--no-cache',
+              'input.vsd', 'output.png'])
+        export_img.assert_called_with('input.vsd', 'output.png', None, None)
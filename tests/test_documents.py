@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import time
+import unittest
+from tempfile import mkdtemp
+
+from visio2img.documents import DocumentCache
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher
+from visio2img.visio2img import export_img, export_outputs, iter_export
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestDocumentCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.dispatcher = FakeDispatcher()
+        self.pool = VisioAppPool(dispatch=self.dispatcher)
+        self.documents = DocumentCache(self.pool, max_documents=2)
+
+    def tearDown(self):
+        self.documents.flush()
+        self.pool.close()
+        shutil.rmtree(self.tmpdir)
+
+    def copy_example(self, name):
+        filename = os.path.join(self.tmpdir, name)
+        shutil.copy(os.path.join(EXAMPLE_DIR, name), filename)
+        return filename
+
+    def test_export_img(self):
+        filename = self.copy_example('multipages2.vsdx')
+        for pagenum in range(1, 11):
+            output = os.path.join(self.tmpdir, 'page%d.png' % pagenum)
+            export_img(filename, output, pagenum, pool=self.pool,
+                       documents=self.documents)
+        export_img(filename, os.path.join(self.tmpdir, 'named.png'),
+                   pagename=u'ページ - 3', documents=self.documents)
+
+        # opened only once
+        self.assertEqual(1, len(self.dispatcher.apps))
+        app = self.dispatcher.apps[0]
+        self.assertEqual(1, app.opened)
+        self.assertEqual(1, len(app.Documents))
+        self.assertEqual(11, len(self.dispatcher.exported))
+
+        with self.assertRaises(IndexError):
+            export_img(filename, os.path.join(self.tmpdir, 'a.png'), 11,
+                       documents=self.documents)
+
+        results = list(iter_export(filename,
+                                   os.path.join(self.tmpdir, 'all.png'),
+                                   documents=self.documents))
+        self.assertEqual(10, len(results))
+        results = export_outputs(filename,
+                                 [(2, os.path.join(self.tmpdir, 'b.png'))],
+                                 documents=self.documents)
+        self.assertEqual([2], [r.index for r in results])
+        self.assertEqual(1, app.opened)
+
+        # flush closes documents and gives the application back
+        self.documents.flush()
+        self.assertEqual(0, len(app.Documents))
+        self.assertEqual(1, len(self.pool.idle))
+
+    def test_changed_file(self):
+        filename = self.copy_example('multipages.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        export_img(filename, output, 1, documents=self.documents)
+        export_img(filename, output, 1, documents=self.documents)
+        self.assertEqual(1, self.dispatcher.apps[0].opened)
+
+        shutil.copy(os.path.join(EXAMPLE_DIR, 'multipages2.vsdx'), filename)
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, time.time() + 10))
+        export_img(filename, output, 10, documents=self.documents)
+
+        app = self.dispatcher.apps[0]
+        self.assertEqual(2, app.opened)
+        self.assertEqual(1, len(app.Documents))  # old one is closed
+
+    def test_max_documents(self):
+        filenames = [self.copy_example(name) for name in
+                     ['singlepage.vsdx', 'multipages.vsdx',
+                      'multipages2.vsdx']]
+        output = os.path.join(self.tmpdir, 'output.png')
+        for filename in filenames + filenames[2:]:
+            export_img(filename, output, 1, documents=self.documents)
+
+        # least recently used one is closed
+        app = self.dispatcher.apps[0]
+        self.assertEqual(2, len(self.documents))
+        self.assertEqual(3, app.opened)
+        self.assertEqual(sorted(os.path.abspath(f) for f in filenames[1:]),
+                         sorted(d.FullName for d in app.Documents.documents))
+
+        self.documents.invalidate(filenames[1])
+        self.assertEqual(1, len(self.documents))
+        self.assertEqual(1, len(app.Documents))
+
+    def test_broken_document(self):
+        filename = self.copy_example('multipages.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        with self.assertRaises(RuntimeError):
+            with self.documents.open(filename):
+                raise RuntimeError
+
+        # opened again after errors
+        export_img(filename, output, 1, documents=self.documents)
+        self.assertEqual(2, self.dispatcher.apps[0].opened)
+        self.assertEqual(1, len(self.dispatcher.apps[0].Documents))
+
+        with self.assertRaises(IOError):
+            self.documents.open(os.path.join(self.tmpdir, 'notexist.vsd'))
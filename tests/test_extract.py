@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import unittest
+import zipfile
+from io import BytesIO
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img.extract import iter_records, iter_shapes
+from visio2img.visio2img import main
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+PAGE = u'''<?xml version='1.0' encoding='utf-8' ?>
+<PageContents xmlns='http://schemas.microsoft.com/office/visio/2012/main'
+              xml:space='preserve'>
+<Shapes>
+<Shape ID='1' NameU='Circle' Name='円' Type='Shape' Master='2'>
+  <Section N='Property'>
+    <Row N='Owner'><Cell N='Label' V='担当'/><Cell N='Value' V='tk0miya'/></Row>
+    <Row N='Cost'><Cell N='Value' V='100'/></Row>
+  </Section>
+  <Section N='Hyperlink'>
+    <Row N='Row_1'>
+      <Cell N='Description' V='docs'/>
+      <Cell N='Address' V='http://example.com/'/>
+    </Row>
+  </Section>
+  <Text><cp IX='0'/>Hello <fld IX='0'>world</fld>
+</Text>
+</Shape>
+<Shape ID='2' NameU='Group' Type='Group'>
+  <Shapes>
+    <Shape ID='3' NameU='Member' Type='Shape'><Text>member</Text></Shape>
+  </Shapes>
+</Shape>
+</Shapes>
+</PageContents>
+'''
+
+
+INSTANCES = u'''<?xml version='1.0' encoding='utf-8' ?>
+<PageContents xmlns='http://schemas.microsoft.com/office/visio/2012/main'
+              xml:space='preserve'>
+<Shapes>
+<Shape ID='1' NameU='Circle' Type='Group' Master='2'>
+  <Shapes><Shape ID='2' Type='Shape' MasterShape='6'/></Shapes>
+</Shape>
+<Shape ID='3' NameU='Circle.3' Type='Shape' Master='2'><Text>own</Text></Shape>
+</Shapes>
+<Connects><Connect FromSheet='3' ToSheet='1'/></Connects>
+</PageContents>
+'''
+
+MASTER = u'''<?xml version='1.0' encoding='utf-8' ?>
+<MasterContents xmlns='http://schemas.microsoft.com/office/visio/2012/main'
+                xml:space='preserve'>
+<Shapes>
+<Shape ID='5' Type='Group'>
+  <Text>circle</Text>
+  <Shapes><Shape ID='6' Type='Shape'><Text>label</Text></Shape></Shapes>
+</Shape>
+</Shapes>
+</MasterContents>
+'''
+
+
+def make_vsdx(source, filename, page, parts=None):
+    """ Copies .vsdx file replacing the first page (and parts) """
+    parts = dict(parts or {}, **{'visio/pages/page1.xml': page})
+    with zipfile.ZipFile(source) as src:
+        with zipfile.ZipFile(filename, 'w') as dest:
+            for name in src.namelist():
+                content = src.read(name)
+                if name in parts:
+                    content = parts[name].encode('utf-8')
+                dest.writestr(name, content)
+
+
+class TestExtract(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'shapes.vsdx')
+        make_vsdx(os.path.join(EXAMPLE_DIR, 'multipages.vsdx'),
+                  self.filename, PAGE)
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_iter_records(self):
+        records = list(iter_records(self.filename))
+        self.assertEqual([1, 2], [record['index'] for record in records])
+        self.assertEqual(u'ページ - 1', records[0]['name'])
+        self.assertAlmostEqual(297, records[0]['width'] * 25.4)
+        self.assertEqual([u'Square'],
+                         [shape['master'] for shape in records[1]['shapes']])
+
+        shapes = records[0]['shapes']
+        self.assertEqual([1, 3, 2], [shape['id'] for shape in shapes])
+
+        circle = shapes[0]
+        self.assertEqual(u'円', circle['name'])
+        self.assertEqual(u'Circle', circle['master'])
+        self.assertEqual(u'Hello world', circle['text'])
+        self.assertEqual({u'担当': u'tk0miya', u'Cost': u'100'},
+                         circle['properties'])
+        self.assertEqual([{'address': u'http://example.com/',
+                           'sub_address': None, 'description': u'docs'}],
+                         circle['hyperlinks'])
+
+        member = shapes[1]
+        self.assertEqual(u'Member', member['name'])
+        self.assertIsNone(member['master'])
+        self.assertEqual(u'member', member['text'])
+
+    def test_iter_shapes_in_instance(self):
+        page = PAGE.replace(u"Type='Group'", u"Type='Group' Master='2'")
+        masters = {'2': u'Circle'}
+        shapes = list(iter_shapes(BytesIO(page.encode('utf-8')), masters))
+        self.assertEqual([u'Circle'] * 3,
+                         [shape['master'] for shape in shapes])
+
+    def test_text_of_masters(self):
+        filename = os.path.join(self.tmpdir, 'instances.vsdx')
+        make_vsdx(self.filename, filename, INSTANCES,
+                  {'visio/masters/master1.xml': MASTER})
+        shapes = list(iter_records(filename))[0]['shapes']
+        self.assertEqual([(2, u'label'), (1, u'circle'), (3, u'own')],
+                         [(shape['id'], shape['text']) for shape in shapes])
+
+        # shapes are parsed lazily
+        records = iter_records(filename, lazy=True)
+        record = next(records)
+        self.assertEqual([2, 1, 3],
+                         [shape['id'] for shape in record['shapes']])
+
+    def test_iter_records_from_invalid_file(self):
+        with self.assertRaises(IOError):
+            list(iter_records(os.path.join(EXAMPLE_DIR, 'multipages.vsd')))
+        with self.assertRaises(IOError):
+            list(iter_records('/path/to/notexist.vsdx'))
+
+        broken = os.path.join(self.tmpdir, 'broken.vsdx')
+        make_vsdx(self.filename, broken, u'<PageContents>')
+        with self.assertRaises(IOError):
+            list(iter_records(broken))
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_extract_option(self, _):
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.assertEqual(0, main(['--extract', self.tmpdir]))
+            records = [json.loads(line)
+                       for line in stdout.getvalue().splitlines()]
+            self.assertEqual([(self.filename, 1), (self.filename, 2)],
+                             [(r['filename'], r['index']) for r in records])
+            self.assertEqual(u'Hello world',
+                             records[0]['shapes'][0]['text'])
+
+        # failed files are reported, and the rest are extracted
+        filenames = [os.path.join(EXAMPLE_DIR, 'multipages.vsd'),
+                     os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')]
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            with patch('sys.stderr', new_callable=StringIO) as stderr:
+                self.assertEqual(1, main(['-x'] + filenames))
+                self.assertEqual(1, len(stdout.getvalue().splitlines()))
+                self.assertIn('multipages.vsd', stderr.getvalue())
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+import zipfile
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img.incremental import (
+    export_incremental, get_index_filename, read_page_digests
+)
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher
+from visio2img.visio2img import main
+from visio2img.vsdx import read_pages
+
+if sys.version_info > (3, 0):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+def rewrite_vsdx(source, filename, **parts):
+    """ Copies .vsdx file replacing content of parts by functions """
+    with zipfile.ZipFile(source) as src:
+        with zipfile.ZipFile(filename, 'w') as dest:
+            for name in src.namelist():
+                content = src.read(name)
+                func = parts.get(name.replace('/', '_').replace('.', '_'))
+                if func:
+                    content = func(content)
+                dest.writestr(name, content)
+
+
+def append_comment(content):
+    return content + b'<!-- edited -->'
+
+
+class TestIncrementalExport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'input.vsdx')
+        self.output = os.path.join(self.tmpdir, 'output', 'a.png')
+        os.mkdir(os.path.dirname(self.output))
+        rewrite_vsdx(os.path.join(EXAMPLE_DIR, 'multipages2.vsdx'),
+                     self.filename)
+
+        self.dispatcher = FakeDispatcher()
+        self.pool = VisioAppPool(dispatch=self.dispatcher)
+
+    def tearDown(self):
+        self.pool.close()
+        rmtree(self.tmpdir)
+
+    def export(self):
+        del self.dispatcher.exported[:]
+        return export_incremental(self.filename, self.output, pool=self.pool)
+
+    def exported(self):
+        return sorted(os.path.basename(f) for f in self.dispatcher.exported)
+
+    def test_read_page_digests(self):
+        digests = read_page_digests(self.filename)
+        self.assertEqual(10, len(digests))
+        self.assertEqual(10, len(set(digests)))
+        self.assertEqual(digests, read_page_digests(self.filename))
+
+        with self.assertRaises(IOError):
+            read_page_digests(os.path.join(EXAMPLE_DIR, 'multipages.vsd'))
+
+    def test_export_incremental(self):
+        result = self.export()
+        self.assertEqual(10, len(result.exported))
+        self.assertEqual([], result.unchanged)
+        self.assertTrue(os.path.exists(get_index_filename(self.output)))
+
+        # nothing changed; Visio is not used
+        result = self.export()
+        self.assertEqual([], result.exported)
+        self.assertEqual(10, len(result.unchanged))
+        self.assertEqual(1, self.dispatcher.apps[0].opened)
+
+        # a page is edited
+        rewrite_vsdx(os.path.join(EXAMPLE_DIR, 'multipages2.vsdx'),
+                     self.filename, visio_pages_page3_xml=append_comment)
+        index = [p.index for p in read_pages(self.filename)
+                 if p.part == 'visio/pages/page3.xml'][0]
+        self.export()
+        self.assertEqual(['a%02d.png' % index], self.exported())
+
+        # a master used by pages is edited
+        rewrite_vsdx(os.path.join(EXAMPLE_DIR, 'multipages2.vsdx'),
+                     self.filename, visio_masters_master1_xml=append_comment)
+        indexes = [p.index for p in read_pages(self.filename)
+                   if p.part == 'visio/pages/page1.xml']
+        self.export()
+        self.assertEqual(sorted('a%02d.png' % i for i in [index] + indexes),
+                         self.exported())
+
+        # output is removed by hand
+        os.remove(os.path.join(self.tmpdir, 'output', 'a05.png'))
+        self.export()
+        self.assertEqual(['a05.png'], self.exported())
+
+        # the theme affects all pages
+        rewrite_vsdx(os.path.join(EXAMPLE_DIR, 'multipages2.vsdx'),
+                     self.filename, visio_theme_theme1_xml=append_comment)
+        self.assertEqual(10, len(self.export().exported))
+
+    def test_removed_pages(self):
+        self.export()
+
+        def remove_last_page(content):
+            return content[:content.rindex(b'<Page ')] + b'</Pages>'
+
+        rewrite_vsdx(os.path.join(EXAMPLE_DIR, 'multipages2.vsdx'),
+                     self.filename, visio_pages_pages_xml=remove_last_page)
+        result = self.export()
+        self.assertEqual(9, len(result.exported))
+        self.assertEqual(10, len(result.removed))
+        images = ['a%d.png' % i for i in range(1, 10)]
+        self.assertEqual(['.a.png.visio2img'] + images,
+                         sorted(os.listdir(os.path.dirname(self.output))))
+
+    def test_broken_page(self):
+        self.dispatcher.broken_pages = [u'ページ - 2']
+        with self.assertRaises(IOError):
+            self.export()
+
+        # the broken page is retried
+        self.dispatcher.broken_pages = []
+        result = self.export()
+        self.assertEqual(['a02.png'], self.exported())
+        self.assertEqual(9, len(result.unchanged))
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=True)
+    def test_incremental_option(self, _):
+        with patch('visio2img.pool.dispatch_visio', self.dispatcher):
+            self.assertEqual(0, main(['--incremental', self.filename,
+                                      self.output]))
+        self.assertEqual(11, len(os.listdir(os.path.dirname(self.output))))
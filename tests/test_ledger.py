@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import subprocess
+import sys
+import unittest
+from functools import partial
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
+
+from visio2img.batch import BatchJob, collect_jobs, run_batch
+from visio2img.ledger import JobLedger, find_outputs, run_ledger
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher, fake_visio
+from visio2img.visio2img import main
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+def get_dead_worker():
+    """ Returns name of a worker of this host whose process has exited """
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return '%s:%d' % (socket.gethostname(), process.pid)
+
+
+class TestJobLedger(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'ledger.db')
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        self.outdir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(self.srcdir)
+        self.jobs = []
+        for i, name in enumerate(['singlepage.vsdx', 'multipages.vsdx',
+                                  'multipages.vsd']):
+            source = os.path.join(self.srcdir, '%d-%s' % (i, name))
+            copyfile(os.path.join(EXAMPLE_DIR, name), source)
+            self.jobs.append(BatchJob(source, os.path.join(
+                self.outdir, '%d.png' % i)))
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_lease(self):
+        with JobLedger(self.filename, worker='a') as ledger:
+            ledger.add(self.jobs)
+            ledger.add(self.jobs[:1])  # not added twice
+            self.assertEqual(3, ledger.counts()['pending'])
+
+            # other workers can not lease the same jobs
+            other = JobLedger(self.filename, worker='b')
+            self.addCleanup(other.close)
+            leased = ledger.lease(2)
+            self.assertEqual(self.jobs[:2], [entry.job for entry in leased])
+            self.assertEqual(self.jobs[2:],
+                             [entry.job for entry in other.lease(2)])
+            self.assertEqual([], other.lease())
+
+            ledger.done(leased[0].id, [__file__])
+            ledger.fail(leased[1].id, IOError('broken'))
+            self.assertEqual({'pending': 0, 'leased': 1, 'done': 1,
+                              'failed': 1}, ledger.counts())
+            self.assertEqual(os.path.abspath(__file__),
+                             ledger.outputs(leased[0].id)[0][0])
+
+            ledger.retry_failed()
+            self.assertEqual([leased[1].id],
+                             [entry.id for entry in ledger.lease(5)])
+
+    def test_expired_lease(self):
+        with JobLedger(self.filename, lease_timeout=-1) as ledger:
+            ledger.add(self.jobs)
+            first = ledger.lease(3)
+
+            # leased by a crashed worker
+            self.assertEqual([entry.id for entry in first],
+                             [entry.id for entry in ledger.lease(3)])
+
+    def test_run_ledger(self):
+        dispatcher = FakeDispatcher(broken_pages=[u'ページ - 2'])
+        os.makedirs(self.outdir)
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            with JobLedger(self.filename) as ledger:
+                ledger.add(self.jobs)
+                convert = partial(run_batch, pool=pool)
+                results = list(run_ledger(ledger, convert, 2))
+                self.assertEqual([None, IOError, None],
+                                 [r.error and type(r.error) for r in results])
+                self.assertEqual({'pending': 0, 'leased': 0, 'done': 2,
+                                  'failed': 1}, ledger.counts())
+
+                # nothing is left
+                self.assertEqual([], list(run_ledger(ledger, convert)))
+
+        output = os.path.join(self.outdir, '0.png')
+        self.assertEqual([output], find_outputs(output))
+        self.assertEqual([os.path.join(self.outdir, '11.png')],
+                         find_outputs(os.path.join(self.outdir, '1.png')))
+        self.assertEqual([], find_outputs(os.path.join(self.outdir, 'a.png')))
+
+    def test_release_on_stop(self):
+        def convert(jobs):
+            raise KeyboardInterrupt
+
+        with JobLedger(self.filename) as ledger:
+            ledger.add(self.jobs)
+            with self.assertRaises(KeyboardInterrupt):
+                list(run_ledger(ledger, convert, 2))
+            self.assertEqual(3, ledger.counts()['pending'])
+
+            # closing the generator in the middle also gives the leases back
+            convert = partial(run_batch,
+                              pool=VisioAppPool(dispatch=FakeDispatcher()))
+            results = run_ledger(ledger, convert, 2)
+            os.makedirs(self.outdir)
+            next(results)
+            self.assertEqual(1, ledger.counts()['leased'])
+            results.close()
+            self.assertEqual({'pending': 2, 'leased': 0, 'done': 1,
+                              'failed': 0}, ledger.counts())
+
+    def test_reclaim(self):
+        dead = get_dead_worker()
+        alive = '%s:%d' % (socket.gethostname(), os.getpid())
+        with JobLedger(self.filename) as ledger:
+            ledger.add(self.jobs)
+            for worker in (dead, alive, 'elsewhere:1'):
+                JobLedger(self.filename, worker=worker).lease()
+
+            self.assertEqual([dead], ledger.reclaim())
+            self.assertEqual({'pending': 1, 'leased': 2, 'done': 0,
+                              'failed': 0}, ledger.counts())
+            self.assertEqual([], ledger.reclaim())
+
+    def test_options(self):
+        with JobLedger(self.filename, options='page=1') as ledger:
+            ledger.add(self.jobs)
+            ledger.done(ledger.lease()[0].id, [])
+
+        # the same files with other options are other jobs
+        with JobLedger(self.filename, options='page=2') as ledger:
+            self.assertEqual(0, ledger.counts()['pending'])
+            ledger.add(ledger.jobs())
+            self.assertEqual(self.jobs, [entry.job
+                                         for entry in ledger.lease(5)])
+
+    def test_verify(self):
+        outputs = [os.path.join(self.tmpdir, name) for name in 'ab']
+        for filename in outputs:
+            with open(filename, 'wb') as fd:
+                fd.write(b'image')
+
+        with JobLedger(self.filename) as ledger:
+            ledger.add(self.jobs)
+            leased = ledger.lease(3)
+            for entry, filename in zip(leased, outputs):
+                ledger.done(entry.id, [filename])
+            self.assertEqual([], ledger.verify())
+
+            with open(outputs[0], 'ab') as fd:
+                fd.write(b'changed')
+            os.remove(outputs[1])
+            self.assertEqual([leased[0].id, leased[1].id], ledger.verify())
+            self.assertEqual({'pending': 2, 'leased': 1, 'done': 0,
+                              'failed': 0}, ledger.counts())
+
+    @patch('sys.stdout')
+    def test_ledger_option(self, _):
+        args = ['--batch', '--ledger', self.filename, '-d', self.outdir,
+                self.srcdir]
+        options = 'backend=visio page= name='
+        with JobLedger(self.filename, options=options) as ledger:
+            # the last run died after the first job
+            ledger.add(collect_jobs([self.srcdir], self.outdir))
+            ledger.done(ledger.lease()[0].id, [])
+
+        with fake_visio(FakeDispatcher()) as dispatcher:
+            self.assertEqual(0, main(args))
+            self.assertEqual(2, dispatcher.apps[0].opened)
+
+            # resumed with the ledger only
+            self.assertEqual(0, main(['--batch', '--ledger', self.filename]))
+            self.assertEqual(2, dispatcher.apps[0].opened)
+
+            # images removed are converted again
+            os.remove(os.path.join(self.outdir, '2-multipages1.png'))
+            self.assertEqual(0, main(['--batch', '--ledger', self.filename]))
+            self.assertEqual(3, dispatcher.apps[0].opened)
+
+            # all jobs are converted with other options
+            self.assertEqual(0, main(['--batch', '--ledger', self.filename,
+                                      '-p', '1']))
+            self.assertEqual(6, dispatcher.apps[0].opened)
+
+        with JobLedger(self.filename, options=options) as ledger:
+            self.assertEqual(3, ledger.counts()['done'])
+
+    def test_ledger_option_after_crash(self):
+        args = ['--batch', '--ledger', self.filename, '-d', self.outdir,
+                self.srcdir]
+        options = 'backend=visio page= name='
+        with JobLedger(self.filename, options=options,
+                       worker=get_dead_worker()) as ledger:
+            # the last run was killed while converting the first job
+            ledger.add(collect_jobs([self.srcdir], self.outdir))
+            ledger.lease()
+
+        with fake_visio(FakeDispatcher()) as dispatcher:
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(0, main(args))
+            self.assertEqual(3, dispatcher.apps[0].opened)
+            self.assertIn('3 converted, 0 failed', stdout.getvalue())
+
+            # a job leased by a worker of another host is not finished
+            with JobLedger(self.filename, options=options,
+                           worker='elsewhere:1') as ledger:
+                os.remove(os.path.join(self.outdir, '0-singlepage.png'))
+                ledger.verify()
+                ledger.lease()
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(-1, main(args + ['--lease-timeout', '60']))
+            self.assertIn('1 unfinished', stdout.getvalue())
+            self.assertEqual(3, dispatcher.apps[0].opened)
+
+            # and leased again after the lease timeout
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(0, main(args + ['--lease-timeout', '1e-9']))
+            self.assertEqual(4, dispatcher.apps[0].opened)
+
+        with patch('sys.stderr', new_callable=StringIO):
+            for extra in (args + ['--lease-timeout', '0'],
+                          ['--batch', '--lease-timeout', '60', self.srcdir]):
+                with self.assertRaises(SystemExit):
+                    main(extra)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import sys
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img import metrics
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher
+from visio2img.visio2img import export_img, main
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_span(self):
+        with metrics.span('open', filename='a.vsdx') as attrs:
+            attrs['size'] = 1  # no hooks; not recorded
+
+        with metrics.Metrics() as collected:
+            with metrics.span('open', filename='a.vsdx') as attrs:
+                attrs['size'] = 1
+            metrics.record('export', 0.5, index=1)
+
+        with metrics.span('close'):
+            pass  # not recorded after the exit
+
+        spans = collected.to_dict()['spans']
+        self.assertEqual(2, len(spans))
+        self.assertEqual({'phase': 'open', 'filename': 'a.vsdx', 'size': 1},
+                         dict((k, v) for k, v in spans[0].items()
+                              if k != 'elapsed'))
+        self.assertEqual({'phase': 'export', 'index': 1, 'elapsed': 0.5},
+                         spans[1])
+
+    def test_export_img(self):
+        pool = VisioAppPool(dispatch=FakeDispatcher(export_latency=0.01))
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        with metrics.Metrics() as collected:
+            export_img(filename, output, pool=pool)
+            export_img(filename, output, pool=pool)
+            pool.close()
+
+        result = collected.to_dict()
+        self.assertEqual(['launch', 'open', 'export', 'export', 'close',
+                          'open', 'export', 'export', 'close', 'quit'],
+                         [entry['phase'] for entry in result['spans']])
+        self.assertEqual(4, result['pages'])
+        self.assertEqual(4, result['phases']['export']['count'])
+        self.assertGreaterEqual(result['phases']['export']['total'], 0.04)
+        self.assertEqual(sum(os.path.getsize(os.path.join(self.tmpdir, f))
+                             for f in os.listdir(self.tmpdir)) * 2,
+                         result['bytes'])
+
+        page = result['spans'][2]
+        self.assertEqual((1, u'ページ - 1', None),
+                         (page['index'], page['name'], page['error']))
+        self.assertEqual(os.path.join(self.tmpdir, 'output1.png'),
+                         page['filename'])
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=True)
+    def test_metrics_option(self, _):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        metrics_file = os.path.join(self.tmpdir, 'metrics.json')
+        with patch('visio2img.pool.dispatch_visio', FakeDispatcher()):
+            with patch('visio2img.pool._default_pool', None):
+                self.assertEqual(0, main(['--metrics', 'json',
+                                          '--metrics-output', metrics_file,
+                                          filename, output]))
+
+        with io.open(metrics_file, encoding='utf-8') as fd:
+            result = json.load(fd)
+        self.assertEqual(2, result['pages'])
+        self.assertEqual(['close', 'export', 'launch', 'open', 'quit'],
+                         sorted(result['phases']))
+
+        # written to stderr (even if failed)
+        with patch('sys.stderr', new_callable=StringIO) as stderr:
+            self.assertEqual(-1, main(['--metrics', 'json', filename,
+                                       '/path/to/output.png']))
+        lines = stderr.getvalue().splitlines()
+        self.assertEqual(0, json.loads(lines[0])['pages'])
+        self.assertTrue(lines[1].startswith('error: '))
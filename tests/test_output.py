@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
+
+from visio2img.output import (
+    OutputStage, atomic_output, find_jpegtran, recompress
+)
+from visio2img.testing import FakeDispatcher, draw_page, fake_visio
+from visio2img.variants import is_pillow_available
+from visio2img.visio2img import main
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+def write_file(filename, content):
+    with open(filename, 'wb') as fd:
+        fd.write(content)
+
+
+def read_file(filename):
+    with open(filename, 'rb') as fd:
+        return fd.read()
+
+
+class TestOutput(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_atomic_output(self):
+        filename = os.path.join(self.tmpdir, 'output.png')
+        with atomic_output(filename) as temporary:
+            self.assertEqual('output.png', os.path.basename(temporary))
+            self.assertNotEqual(self.tmpdir, os.path.dirname(temporary))
+            write_file(temporary, b'new')
+            self.assertFalse(os.path.exists(filename))
+        self.assertEqual(b'new', read_file(filename))
+
+        # the output is untouched on failure
+        with self.assertRaises(IOError):
+            with atomic_output(filename) as temporary:
+                write_file(temporary, b'broken')
+                raise IOError('Export failed')
+        self.assertEqual(b'new', read_file(filename))
+        self.assertEqual(['output.png'], os.listdir(self.tmpdir))
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    def test_recompress_png(self):
+        from PIL import Image
+
+        filename = os.path.join(self.tmpdir, 'output.png')
+        draw_page(3, 2, 50).save(filename, compress_level=0, dpi=(50, 50))
+        size = os.path.getsize(filename)
+
+        saved = recompress(filename)
+        self.assertTrue(saved > 0)
+        self.assertEqual(size - saved, os.path.getsize(filename))
+        with Image.open(filename) as image:
+            self.assertEqual(draw_page(3, 2, 50).tobytes(),
+                             image.convert('RGB').tobytes())
+            self.assertAlmostEqual(50, image.info['dpi'][0], places=0)
+
+        # not replaced unless it gets smaller
+        self.assertEqual(0, recompress(filename))
+        self.assertEqual(size - saved, os.path.getsize(filename))
+
+        other = os.path.join(self.tmpdir, 'output.gif')
+        write_file(other, b'GIF89a')
+        self.assertEqual(0, recompress(other))
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    @unittest.skipIf(find_jpegtran() is None, "jpegtran not found")
+    def test_recompress_jpeg(self):
+        filename = os.path.join(self.tmpdir, 'output.jpg')
+        draw_page(3, 2, 50).save(filename, quality=90)
+        content = read_file(filename)
+
+        recompress(filename)
+        self.assertTrue(os.path.getsize(filename) <= len(content))
+
+    @unittest.skipIf(not hasattr(os, 'link'), "hard links not supported")
+    def test_output_stage_dedup(self):
+        filenames = [os.path.join(self.tmpdir, name)
+                     for name in ('a.png', 'b.png', 'c.png')]
+        write_file(filenames[0], b'same')
+        write_file(filenames[1], b'other')
+        write_file(filenames[2], b'same')
+
+        with OutputStage(dedup=True) as stage:
+            stage.add(filenames)
+        self.assertEqual(3, stage.files)
+        self.assertEqual(4, stage.deduplicated)
+        self.assertEqual(4, stage.saved)
+        self.assertTrue(os.path.samefile(filenames[0], filenames[2]))
+        self.assertFalse(os.path.samefile(filenames[0], filenames[1]))
+
+        # rewriting an output breaks the link
+        with atomic_output(filenames[2]) as temporary:
+            write_file(temporary, b'changed')
+        self.assertEqual(b'same', read_file(filenames[0]))
+
+    def test_output_stage_ignores_failures(self):
+        filenames = [os.path.join(self.tmpdir, name)
+                     for name in ('a.png', 'missing.png')]
+        write_file(filenames[0], b'image')
+
+        with patch('visio2img.output.recompress',
+                   side_effect=IOError('broken image')):
+            with OutputStage(recompress=True, dedup=True) as stage:
+                stage.add(filenames)
+        self.assertEqual(2, stage.files)
+        self.assertEqual(0, stage.saved)
+        self.assertEqual(b'image', read_file(filenames[0]))
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    @unittest.skipIf(not hasattr(os, 'link'), "hard links not supported")
+    def test_recompress_and_dedup_options(self):
+        srcdir = os.path.join(self.tmpdir, 'src')
+        outdir = os.path.join(self.tmpdir, 'out')
+        os.mkdir(srcdir)
+        for name in ('a.vsdx', 'b.vsdx'):
+            copyfile(os.path.join(EXAMPLE_DIR, 'singlepage.vsdx'),
+                     os.path.join(srcdir, name))
+
+        with fake_visio(FakeDispatcher(images=True)):
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                self.assertEqual(0, main(['--batch', '--recompress',
+                                          '--dedup', '-d', outdir, srcdir]))
+
+        self.assertIn('2 converted, 0 failed', stdout.getvalue())
+        self.assertIn('bytes saved', stdout.getvalue())
+        self.assertTrue(os.path.samefile(os.path.join(outdir, 'a.png'),
+                                         os.path.join(outdir, 'b.png')))
+
+        with patch('sys.stderr', new_callable=StringIO):
+            with self.assertRaises(SystemExit):
+                main(['--dedup', '--variants', 'variants.json',
+                      srcdir, outdir])
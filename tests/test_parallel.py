@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import time
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img.batch import BatchJob
+from visio2img.parallel import ParallelExporter
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+PAGE_NAMES = [u'ページ - %d' % i for i in range(1, 11)]
+
+
+def read_page_name(filename):
+    with io.open(filename, encoding='utf-8') as fd:
+        return fd.read().splitlines()[1]
+
+
+class TestParallelExporter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.dispatcher = FakeDispatcher(export_latency=0.1)
+        self.pool = VisioAppPool(dispatch=FakeDispatcher())
+
+    def tearDown(self):
+        self.pool.close()
+        rmtree(self.tmpdir)
+
+    def test_export_img(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        with ParallelExporter(4, self.dispatcher) as exporter:
+            started = time.time()
+            exporter.export_img(filename, os.path.join(self.tmpdir, 'a.png'),
+                                pool=self.pool)
+            elapsed = time.time() - started
+
+        expected = ['a%02d.png' % i for i in range(1, 11)]
+        self.assertEqual(expected, sorted(os.listdir(self.tmpdir)))
+        for i, name in enumerate(expected):
+            self.assertEqual(PAGE_NAMES[i],
+                             read_page_name(os.path.join(self.tmpdir, name)))
+
+        # 10 pages * 0.1 sec in serial
+        self.assertLess(elapsed, 0.8)
+
+    def test_export_img_with_pagename(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        output = os.path.join(self.tmpdir, 'a.png')
+        with ParallelExporter(2, self.dispatcher) as exporter:
+            exporter.export_img(filename, output, None, u'ページ - 7',
+                                pool=self.pool)
+
+            with self.assertRaises(IndexError):
+                exporter.export_img(filename, output, 11, pool=self.pool)
+
+        self.assertEqual(['a.png'], os.listdir(self.tmpdir))
+        self.assertEqual(u'ページ - 7', read_page_name(output))
+
+        # pages were selected without Visio
+        self.assertEqual(0, len(self.pool))
+
+    def test_iter_export(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        dispatcher = FakeDispatcher(broken_pages=[PAGE_NAMES[3]])
+        with ParallelExporter(2, dispatcher) as exporter:
+            results = list(exporter.iter_export(
+                filename, os.path.join(self.tmpdir, 'a.png'), pool=self.pool))
+
+        results.sort(key=lambda result: result.index)
+        self.assertEqual(PAGE_NAMES, [result.name for result in results])
+        self.assertEqual([3], [i for i, r in enumerate(results) if r.error])
+        self.assertIsInstance(results[3].error, IOError)
+        self.assertEqual(9, len(os.listdir(self.tmpdir)))
+
+    def test_export_img_output_dir_not_found(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        with ParallelExporter(2, self.dispatcher) as exporter:
+            with self.assertRaises(IOError):
+                exporter.export_img(filename, '/path/to/output.png',
+                                    pool=self.pool)
+
+    def test_run_batch(self):
+        jobs = [BatchJob(os.path.join(EXAMPLE_DIR, name),
+                         os.path.join(self.tmpdir, '%d.png' % i))
+                for i, name in enumerate(['singlepage.vsdx', 'notexist.vsd',
+                                          'multipages.vsd'])]
+        with ParallelExporter(2, self.dispatcher) as exporter:
+            results = list(exporter.run_batch(jobs, pagenum=1))
+
+        self.assertEqual(jobs, [result.job for result in results])
+        self.assertEqual([None, IOError, None],
+                         [r.error and type(r.error) for r in results])
+        self.assertEqual(['0.png', '2.png'], sorted(os.listdir(self.tmpdir)))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img import metrics
+from visio2img.pool import VisioAppPool, VisioTimeout, Watchdog
+from visio2img.testing import FakeDispatcher, fake_visio
+from visio2img.visio2img import VisioFile, export_img, main
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestVisioAppPool(unittest.TestCase):
+    def test_reuse_application(self):
+        dispatcher = FakeDispatcher()
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            app1 = pool.acquire()
+            pool.release(app1)
+            app2 = pool.acquire()
+            pool.release(app2)
+
+            self.assertIs(app1, app2)
+            self.assertEqual(1, len(dispatcher.apps))
+            self.assertFalse(app1.quitted)
+        self.assertTrue(app1.quitted)
+
+    def test_pool_size(self):
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(size=2, dispatch=dispatcher)
+        app1 = pool.acquire()
+        app2 = pool.acquire()
+        self.assertIsNot(app1, app2)
+        self.assertEqual(2, len(pool))
+
+        # all applications are busy
+        with self.assertRaises(OSError):
+            pool.acquire(timeout=0.01)
+
+        # blocks until an application is released
+        threading.Timer(0.05, pool.release, (app1,)).start()
+        self.assertIs(app1, pool.acquire(timeout=5))
+        self.assertEqual(2, len(dispatcher.apps))
+
+    def test_recycle_after_max_documents(self):
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(max_documents=2, dispatch=dispatcher)
+        for _ in range(5):
+            pool.release(pool.acquire())
+
+        self.assertEqual(3, len(dispatcher.apps))
+        self.assertEqual([True, True, False],
+                         [app.quitted for app in dispatcher.apps])
+
+    def test_idle_timeout(self):
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(idle_timeout=0, dispatch=dispatcher)
+        app = pool.acquire()
+        pool.release(app)
+        self.assertTrue(app.quitted)
+        self.assertEqual(0, len(pool))
+
+    def test_idle_timeout_without_use(self):
+        # idle applications are quit even if the pool is not used again
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(size=2, idle_timeout=0.1, dispatch=dispatcher)
+        app1 = pool.acquire()
+        app2 = pool.acquire()
+        app2.Quit = lambda: 1 / 0  # COM refuses calls from other threads
+        pool.release(app1)
+        pool.release(app2)
+
+        deadline = time.time() + 5
+        while len(pool) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(0, len(pool))
+        self.assertTrue(app1.quitted)
+        self.assertTrue(app2.terminated.is_set())  # killed instead
+
+        # an application borrowed again is not quit
+        app3 = pool.acquire()
+        pool.release(app3)
+        self.assertIs(app3, pool.acquire())
+        time.sleep(0.2)
+        self.assertFalse(app3.quitted)
+        self.assertEqual([], pool.expired)
+        pool.release(app3)
+        pool.close()
+
+    def test_release_with_discard(self):
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(dispatch=dispatcher)
+        app = pool.acquire()
+        pool.release(app, discard=True)
+        self.assertTrue(app.quitted)
+        self.assertIsNot(app, pool.acquire())
+
+        with self.assertRaises(ValueError):
+            pool.release(app)
+
+    def test_dispatch_failure_frees_slot(self):
+        def dispatch():
+            raise OSError('Visio not found')
+
+        pool = VisioAppPool(dispatch=dispatch)
+        with self.assertRaises(OSError):
+            pool.acquire()
+        self.assertEqual(0, len(pool))
+
+    def test_closed_pool(self):
+        pool = VisioAppPool(dispatch=FakeDispatcher())
+        app = pool.acquire()
+        pool.close()
+        with self.assertRaises(OSError):
+            pool.acquire()
+
+        # busy application is quit on release
+        pool.release(app)
+        self.assertTrue(app.quitted)
+
+
+class TestVisioFileWithPool(unittest.TestCase):
+    def test_close_document_only(self):
+        dispatcher = FakeDispatcher([u'Page-1', u'Page-2'])
+        pool = VisioAppPool(dispatch=dispatcher)
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        with VisioFile.Open(filename, pool) as visio:
+            self.assertEqual([u'Page-1', u'Page-2'],
+                             [page.Name for page in visio.pages])
+            app = visio.app
+
+        self.assertFalse(app.quitted)
+        self.assertEqual(0, len(app.Documents))
+        self.assertEqual([], visio.pages)
+
+    def test_open_failure_returns_app(self):
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(dispatch=dispatcher)
+        with self.assertRaises(IOError):
+            VisioFile.Open(__file__ + '.notexist', pool)
+        self.assertEqual(0, len(dispatcher.apps))
+
+        with self.assertRaises(IOError):
+            dispatcher.page_names = lambda filename: 1 / 0
+            VisioFile.Open(__file__, pool)
+        self.assertEqual(1, len(dispatcher.apps))
+        self.assertFalse(dispatcher.apps[0].quitted)
+
+    def test_export_img_reuses_application(self):
+        dispatcher = FakeDispatcher([u'Page-1', u'Page-2'])
+        pool = VisioAppPool(dispatch=dispatcher)
+        try:
+            tmpdir = mkdtemp()
+            filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+            export_img(filename, os.path.join(tmpdir, 'a.png'), pool=pool)
+            export_img(filename, os.path.join(tmpdir, 'b.png'), 2, pool=pool)
+
+            self.assertEqual(['a1.png', 'a2.png', 'b.png'],
+                             sorted(os.listdir(tmpdir)))
+            self.assertEqual(1, len(dispatcher.apps))
+            self.assertEqual(2, dispatcher.apps[0].opened)
+        finally:
+            rmtree(tmpdir)
+
+
+class TestWatchdog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        self.output = os.path.join(self.tmpdir, 'output.png')
+        self.dispatcher = FakeDispatcher()
+        self.pool = VisioAppPool(dispatch=self.dispatcher, timeout=0.1)
+
+    def tearDown(self):
+        self.pool.close()
+        rmtree(self.tmpdir)
+
+    def test_schedule(self):
+        watchdog = Watchdog()
+        called = []
+        watchdog.schedule(0.05, called.append, 2)
+        token = watchdog.schedule(0.01, called.append, 1)
+        watchdog.cancel(token)
+        watchdog.schedule(0.02, called.append, 3)
+        time.sleep(0.2)
+        self.assertEqual([3, 2], called)
+
+    def test_export_timeout(self):
+        self.dispatcher.hang('export')
+        with metrics.Metrics() as collected:
+            started = time.time()
+            export_img(self.filename, self.output, pool=self.pool)
+        self.assertLess(time.time() - started, 5)
+
+        # hung Visio is killed, and the export is retried with a fresh one
+        apps = self.dispatcher.apps
+        self.assertEqual(2, len(apps))
+        self.assertTrue(apps[0].terminated.is_set())
+        self.assertEqual(['output1.png', 'output2.png'],
+                         sorted(os.listdir(self.tmpdir)))
+
+        spans = collected.to_dict()['spans']
+        self.assertEqual([('timeout', 'export'), ('quit', 'timeout'),
+                          ('retry', None)],
+                         [(e['phase'], e.get('operation', e.get('reason')))
+                          for e in spans
+                          if e['phase'] in ('timeout', 'quit', 'retry')])
+
+    def test_open_timeout(self):
+        self.dispatcher.hang('open', 2)
+        with self.assertRaises(VisioTimeout):
+            export_img(self.filename, self.output, pool=self.pool)
+        self.assertEqual(2, len(self.dispatcher.apps))
+
+        # the pool works after that
+        export_img(self.filename, self.output, pool=self.pool)
+        self.assertEqual(3, len(self.dispatcher.apps))
+
+    def test_recycle_by_memory(self):
+        self.dispatcher.memory_leak = 100 * 1024 * 1024
+        pool = VisioAppPool(dispatch=self.dispatcher,
+                            max_memory=256 * 1024 * 1024)
+        with metrics.Metrics() as collected:
+            for i in range(4):
+                export_img(self.filename, self.output, pool=pool)
+        pool.close()
+
+        # recycled after every 2 documents
+        self.assertEqual(2, len(self.dispatcher.apps))
+        self.assertEqual(['memory', 'memory'],
+                         [e['reason'] for e in collected.spans
+                          if e['phase'] == 'quit'])
+
+    def test_timeout_option(self):
+        self.dispatcher.hang('export')
+        with fake_visio(self.dispatcher):
+            self.assertEqual(0, main(['--timeout', '0.1', '--max-memory',
+                                      '1024', self.filename, self.output]))
+        self.assertEqual(2, len(self.dispatcher.apps))
+        self.assertTrue(self.dispatcher.apps[0].terminated.is_set())
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+import zipfile
+from shutil import rmtree
+from tempfile import mkdtemp
+from xml.etree import ElementTree
+
+from visio2img.render import NativeFile, is_cairosvg_available
+from visio2img.visio2img import export_img, main
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+SVG_NS = '{http://www.w3.org/2000/svg}'
+VISIO_NS = 'http://schemas.microsoft.com/office/visio/2012/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_REL_NS = ('http://schemas.openxmlformats.org/package/2006/'
+                  'relationships')
+
+DOCUMENT = u'''<VisioDocument xmlns="%s">
+<Colors><ColorEntry IX="24" RGB="#123456"/></Colors>
+<StyleSheets>
+<StyleSheet ID="0"><Cell N="LineWeight" V="0.01"/>
+<Cell N="LineColor" V="0"/><Cell N="FillForegnd" V="1"/></StyleSheet>
+<StyleSheet ID="3" LineStyle="0" FillStyle="0" TextStyle="0">
+<Cell N="FillForegnd" V="24"/></StyleSheet>
+</StyleSheets>
+</VisioDocument>''' % VISIO_NS
+
+PAGES = u'''<Pages xmlns="%s" xmlns:r="%s">
+<Page ID="0" NameU="Page-1" Name="Page-1" BackPage="4">
+<PageSheet><Cell N="PageWidth" V="8"/><Cell N="PageHeight" V="6"/></PageSheet>
+<Rel r:id="rId1"/></Page>
+<Page ID="4" NameU="Background-1" Name="Background-1" Background="1">
+<PageSheet><Cell N="PageWidth" V="8"/><Cell N="PageHeight" V="6"/></PageSheet>
+<Rel r:id="rId2"/></Page>
+<Page ID="5" NameU="Page-2" Name="Page-2">
+<PageSheet><Cell N="PageWidth" V="8"/><Cell N="PageHeight" V="6"/></PageSheet>
+<Rel r:id="rId3"/></Page>
+</Pages>''' % (VISIO_NS, REL_NS)
+
+PAGES_RELS = u'''<Relationships xmlns="%s">
+<Relationship Id="rId1" Target="page1.xml"/>
+<Relationship Id="rId2" Target="page2.xml"/>
+<Relationship Id="rId3" Target="page3.xml"/>
+</Relationships>''' % PACKAGE_REL_NS
+
+SHAPE = u'''<Shape ID="%(id)s" Type="Shape" LineStyle="3" FillStyle="3"
+ TextStyle="3">
+<Cell N="PinX" V="%(x)s"/><Cell N="PinY" V="%(y)s"/>
+<Cell N="Width" V="2"/><Cell N="Height" V="1"/>
+<Cell N="LocPinX" V="1"/><Cell N="LocPinY" V="0.5"/>
+<Cell N="Angle" V="%(angle)s"/>
+<Section N="Geometry" IX="0">
+<Row T="RelMoveTo" IX="1"><Cell N="X" V="0"/><Cell N="Y" V="0"/></Row>
+<Row T="RelLineTo" IX="2"><Cell N="X" V="1"/><Cell N="Y" V="0"/></Row>
+<Row T="ArcTo" IX="3"><Cell N="X" V="2"/><Cell N="Y" V="1"/>
+<Cell N="A" V="0.2"/></Row>
+<Row T="RelLineTo" IX="4"><Cell N="X" V="0"/><Cell N="Y" V="1"/></Row>
+<Row T="RelLineTo" IX="5"><Cell N="X" V="0"/><Cell N="Y" V="0"/></Row>
+</Section>
+%(extra)s
+</Shape>'''
+
+
+def make_page(*shapes):
+    return (u'<PageContents xmlns="%s"><Shapes>%s</Shapes></PageContents>' %
+            (VISIO_NS, u''.join(shapes)))
+
+
+def make_shape(id, x, y, angle=0, extra=u''):
+    return SHAPE % dict(id=id, x=x, y=y, angle=angle, extra=extra)
+
+
+def make_vsdx(filename):
+    group = (u'<Shape ID="10" Type="Group">'
+             u'<Cell N="PinX" V="6"/><Cell N="PinY" V="4"/>'
+             u'<Cell N="Width" V="2"/><Cell N="Height" V="2"/>'
+             u'<Cell N="LocPinX" V="1"/><Cell N="LocPinY" V="1"/>'
+             u'<Shapes>%s</Shapes></Shape>' %
+             make_shape(11, 1, 1, extra=u'<Text>Hello &amp; world</Text>'))
+    ellipse = (u'<Shape ID="20" Type="Shape">'
+               u'<Cell N="PinX" V="1"/><Cell N="PinY" V="1"/>'
+               u'<Cell N="Width" V="1"/><Cell N="Height" V="1"/>'
+               u'<Cell N="LocPinX" V="0.5"/><Cell N="LocPinY" V="0.5"/>'
+               u'<Cell N="FillForegnd" V="#FF0000"/>'
+               u'<Section N="Geometry" IX="0">'
+               u'<Row T="Ellipse" IX="1"><Cell N="X" V="0.5"/>'
+               u'<Cell N="Y" V="0.5"/><Cell N="A" V="1"/>'
+               u'<Cell N="B" V="0.5"/><Cell N="C" V="0.5"/>'
+               u'<Cell N="D" V="1"/></Row></Section></Shape>')
+
+    with zipfile.ZipFile(filename, 'w') as package:
+        package.writestr('visio/document.xml', DOCUMENT.encode('utf-8'))
+        package.writestr('visio/pages/pages.xml', PAGES.encode('utf-8'))
+        package.writestr('visio/pages/_rels/pages.xml.rels',
+                         PAGES_RELS.encode('utf-8'))
+        package.writestr('visio/pages/page1.xml',
+                         make_page(make_shape(1, 3, 3, 1.5707963),
+                                   group).encode('utf-8'))
+        package.writestr('visio/pages/page2.xml',
+                         make_page(ellipse).encode('utf-8'))
+        package.writestr('visio/pages/page3.xml', make_page().encode('utf-8'))
+
+
+def parse_svg(filename):
+    root = ElementTree.parse(filename).getroot()
+    viewbox = [float(v) for v in root.get('viewBox').split()]
+    return root, viewbox
+
+
+class TestNativeFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_export_examples(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        output = os.path.join(self.tmpdir, 'output.svg')
+        export_img(filename, output, native=True)
+        self.assertEqual(['output1.svg', 'output2.svg'],
+                         sorted(os.listdir(self.tmpdir)))
+
+        # page 1: circle, page 2: square (40mm; cropped to the drawing)
+        root, viewbox = parse_svg(os.path.join(self.tmpdir, 'output1.svg'))
+        path = root.find('%sg/%spath' % (SVG_NS, SVG_NS))
+        self.assertIn(' A ', path.get('d'))
+        self.assertAlmostEqual(40 / 25.4, viewbox[2], 1)
+        self.assertAlmostEqual(40 / 25.4, viewbox[3], 1)
+        self.assertEqual('152px', root.get('width'))
+
+        root, viewbox = parse_svg(os.path.join(self.tmpdir, 'output2.svg'))
+        path = root.find('%sg/%spath' % (SVG_NS, SVG_NS))
+        self.assertEqual(4, path.get('d').count(' L '))
+        self.assertAlmostEqual(40 / 25.4, viewbox[2], 1)
+
+    def test_render_shapes(self):
+        filename = os.path.join(self.tmpdir, 'shapes.vsdx')
+        make_vsdx(filename)
+        with NativeFile.Open(filename) as visio:
+            self.assertEqual(['Page-1', 'Background-1', 'Page-2'],
+                             [page.name for page in visio.pages])
+            svg = [page.render_svg() for page in visio.pages]
+
+        # Page-1: rotated shape, group and its text on top of background
+        root = ElementTree.fromstring(svg[0].encode('utf-8'))
+        paths = root.findall('%sg/%spath' % (SVG_NS, SVG_NS))
+        self.assertEqual(3, len(paths))
+        self.assertEqual('#FF0000', paths[0].get('fill'))  # background
+        self.assertEqual('#123456', paths[1].get('fill'))  # indexed color
+        self.assertEqual('#000000', paths[1].get('stroke'))
+        self.assertIn(' A ', paths[1].get('d'))
+        self.assertIn('matrix(0 1 -1 0 ', paths[1].get('transform'))
+        self.assertIn('matrix(1 0 0 1 5 3.5)', paths[2].get('transform'))
+
+        text = root.find('%stext' % SVG_NS)
+        self.assertEqual(u'Hello & world', ''.join(text.itertext()))
+        self.assertEqual('#FFFFFF', text.get('fill'))  # on filled shape
+
+        # Page-2: empty page is rendered as whole of the page
+        root = ElementTree.fromstring(svg[2].encode('utf-8'))
+        self.assertEqual([0, -6, 8, 6],
+                         [float(v) for v in root.get('viewBox').split()])
+        self.assertEqual('768px', root.get('width'))
+
+    def test_open_unsupported_file(self):
+        with self.assertRaises(IOError):
+            NativeFile.Open(os.path.join(EXAMPLE_DIR, 'multipages.vsd'))
+        with self.assertRaises(IOError):
+            NativeFile.Open(os.path.join(EXAMPLE_DIR, 'notexist.vsdx'))
+
+    @unittest.skipIf(is_cairosvg_available(), 'cairosvg is installed')
+    def test_export_png_without_cairosvg(self):
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+        with self.assertRaises(OSError) as cm:
+            export_img(filename, os.path.join(self.tmpdir, 'output.png'),
+                       native=True)
+        self.assertIn('cairosvg', str(cm.exception))
+
+    @unittest.skipUnless(is_cairosvg_available(), 'cairosvg not found')
+    def test_export_png(self):
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        export_img(filename, output, native=True)
+        with open(output, 'rb') as fd:
+            self.assertEqual(b'\x89PNG', fd.read(4))
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_native_option(self, is_pywin32_available):
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+        output = os.path.join(self.tmpdir, 'output.svg')
+        self.assertEqual(0, main(['--native', filename, output]))
+        self.assertEqual(['output.svg'], os.listdir(self.tmpdir))
+
+        # without Visio, the native renderer is chosen for .vsdx files
+        other = os.path.join(self.tmpdir, 'other.svg')
+        self.assertEqual(0, main([filename, other]))
+        self.assertTrue(os.path.exists(other))
+
+        is_pywin32_available.return_value = True
+        with patch('sys.stderr', new_callable=StringIO):
+            with self.assertRaises(SystemExit):
+                main([filename, output])  # Visio does not write .svg
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
+
+from visio2img.server import (
+    ConversionClient, ConversionServer, ServerBusy, parse_address
+)
+from visio2img.testing import FakeDispatcher
+from visio2img.visio2img import main
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestConversionServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.dispatcher = FakeDispatcher(broken_pages=[u'ページ - 2'])
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def start(self, **kwargs):
+        kwargs.setdefault('roots', [self.tmpdir, EXAMPLE_DIR])
+        server = ConversionServer('127.0.0.1:0', dispatch=self.dispatcher,
+                                  **kwargs)
+        server.start()
+        self.addCleanup(server.close)
+        return server, ConversionClient(server.url, timeout=5)
+
+    def test_parse_address(self):
+        self.assertEqual(('127.0.0.1', 8077), parse_address('8077'))
+        self.assertEqual(('0.0.0.0', 80), parse_address('0.0.0.0:80'))
+        with self.assertRaises(ValueError):
+            parse_address('localhost')
+
+    def test_convert(self):
+        server, client = self.start(workers=2)
+        output = os.path.join(self.tmpdir, 'output.png')
+        for _ in range(3):
+            job = client.convert(os.path.join(EXAMPLE_DIR, 'singlepage.vsdx'),
+                                 output)
+            self.assertEqual('done', job['status'])
+            self.assertEqual([output], [p['filename'] for p in job['pages']])
+            self.assertEqual(os.path.getsize(output), job['pages'][0]['size'])
+
+        # Visio applications are kept warm
+        self.assertLessEqual(len(self.dispatcher.apps), 2)
+        self.assertEqual({'queued': 0, 'running': 0, 'workers': 2,
+                          'queue_size': 16}, client.status())
+
+    def test_failed_jobs(self):
+        server, client = self.start()
+        with self.assertRaises(IOError):
+            client.convert(os.path.join(EXAMPLE_DIR, 'notexist.vsdx'),
+                           os.path.join(self.tmpdir, 'output.png'))
+
+        # broken page does not stop the other pages
+        job = client.submit(os.path.join(EXAMPLE_DIR, 'multipages.vsdx'),
+                            os.path.join(self.tmpdir, 'output.png'))
+        job = client.get(job['id'], wait=5)
+        self.assertEqual('failed', job['status'])
+        self.assertEqual([None, u'Export failed: ページ - 2'],
+                         [page['error'] for page in job['pages']])
+        self.assertEqual(['output1.png'], os.listdir(self.tmpdir))
+
+        with self.assertRaises(IndexError):
+            client.get('unknown')
+
+    def test_roots(self):
+        server, client = self.start(roots=[self.tmpdir])
+        filename = os.path.join(self.tmpdir, 'singlepage.vsdx')
+        copyfile(os.path.join(EXAMPLE_DIR, 'singlepage.vsdx'), filename)
+        client.convert(filename, os.path.join(self.tmpdir, 'output.png'))
+
+        # files out of the roots are neither read nor written
+        outside = mkdtemp()
+        self.addCleanup(rmtree, outside)
+        for visio_filename, image_filename in (
+                (os.path.join(EXAMPLE_DIR, 'singlepage.vsdx'),
+                 os.path.join(self.tmpdir, 'a.png')),
+                (filename, os.path.join(outside, 'a.png')),
+                (filename, os.path.join(self.tmpdir, '..',
+                                        os.path.basename(outside), 'a.png'))):
+            with self.assertRaises(IOError) as cm:
+                client.convert(visio_filename, image_filename)
+            self.assertIn('Path not allowed', str(cm.exception))
+        self.assertEqual([], os.listdir(outside))
+
+        if hasattr(os, 'symlink'):
+            os.symlink(outside, os.path.join(self.tmpdir, 'link'))
+            with self.assertRaises(IOError):
+                client.convert(filename,
+                               os.path.join(self.tmpdir, 'link', 'a.png'))
+
+    def test_backpressure(self):
+        self.dispatcher.export_latency = 0.2
+        server, client = self.start(queue_size=1)
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+
+        jobs = []
+        with self.assertRaises(ServerBusy):
+            for i in range(3):
+                output = os.path.join(self.tmpdir, '%d.png' % i)
+                jobs.append(client.submit(filename, output, retries=0))
+
+        # one is running, one is queued
+        self.assertEqual(2, len(jobs))
+        self.assertEqual(1, client.status()['queued'])
+
+        # retried until the queue has a room
+        job = client.submit(filename, os.path.join(self.tmpdir, 'a.png'))
+        self.assertEqual('done', client.get(job['id'], wait=5)['status'])
+        for job in jobs:
+            self.assertEqual('done', client.get(job['id'], wait=5)['status'])
+
+    def test_history(self):
+        server, client = self.start(history=2)
+        output = os.path.join(self.tmpdir, 'output.png')
+        jobs = [client.convert(os.path.join(EXAMPLE_DIR, 'singlepage.vsdx'),
+                               output) for _ in range(4)]
+        self.assertEqual([jobs[2]['id'], jobs[3]['id']], list(server.jobs))
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_server_option(self, _):
+        server, client = self.start()
+        output = os.path.join(self.tmpdir, 'output.png')
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+        self.assertEqual(0, main(['--server', server.url, filename, output]))
+        self.assertTrue(os.path.exists(output))
+
+        # the server address can be omitted the scheme
+        self.assertEqual(0, main(['--server', server.address, '-p', '1',
+                                  filename, output]))
+
+        with patch('sys.stderr', new_callable=StringIO) as stderr:
+            self.assertEqual(-1, main(['--server', server.url, filename,
+                                       os.path.join(self.tmpdir, 'notexist',
+                                                    'output.png')]))
+            self.assertIn('Could not write image', stderr.getvalue())
+
+        # options of the local Visio are not taken by the server
+        with patch('sys.stderr', new_callable=StringIO):
+            for args in (['--batch', self.tmpdir],
+                         ['--watch', self.tmpdir],
+                         ['--jobs', '2', filename, output],
+                         ['--cache-dir', self.tmpdir, filename, output],
+                         ['--timeout', '10', filename, output]):
+                with self.assertRaises(SystemExit):
+                    main(['--server', server.url] + args)
+
+            with patch.dict('os.environ', {'VISIO2IMG_SERVER': server.url}):
+                with self.assertRaises(SystemExit):
+                    main(['--batch', self.tmpdir])
+
+            with self.assertRaises(SystemExit):
+                main(['--root', self.tmpdir, filename, output])
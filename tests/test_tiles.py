@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher, draw_page, fake_visio
+from visio2img.tiles import PNGWriter, PageTiler, export_tiled, plan_tiles
+from visio2img.variants import ExportResolution, is_pillow_available
+from visio2img.visio2img import VisioFile, main
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestTiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        # 11.69 x 8.27 inches (A4)
+        self.filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_plan_tiles(self):
+        rows = plan_tiles(250, 120, 100)
+        self.assertEqual(2, len(rows))
+        self.assertEqual([(0, 100), (100, 100), (200, 50)],
+                         [(tile.left, tile.width) for tile in rows[0]])
+        self.assertEqual([(1, 100, 20)] * 3,
+                         [(tile.row, tile.top, tile.height)
+                          for tile in rows[1]])
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    def test_png_writer(self):
+        from PIL import Image
+
+        image = draw_page(3, 2, 10)
+        stream = io.BytesIO()
+        writer = PNGWriter(stream, 30, 20)
+        data = image.tobytes()
+        writer.write_rows(data[:30 * 3 * 5])
+        writer.write_rows(data[30 * 3 * 5:])
+        writer.close()
+
+        stream.seek(0)
+        written = Image.open(stream)
+        self.assertEqual(image.tobytes(), written.convert('RGB').tobytes())
+
+        writer = PNGWriter(io.BytesIO(), 30, 20)
+        writer.write_rows(data[:30 * 3])
+        with self.assertRaises(IOError):
+            writer.close()
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    def test_export_tiled(self):
+        from PIL import Image
+
+        dispatcher = FakeDispatcher(images=True)
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            output = os.path.join(self.tmpdir, 'output.png')
+            filenames = export_tiled(self.filename, output, 1, dpi=20,
+                                     tile_size=64, pool=pool)
+            self.assertEqual([output], filenames)
+
+            # 234 x 165 pixels as 4 x 3 tiles
+            self.assertEqual(12, len(dispatcher.exported))
+            self.assertFalse(os.path.exists(dispatcher.exported[0]))
+
+            # stitched as the whole page (the fake truncates its size)
+            image = Image.open(output)
+            self.assertEqual((234, 165), image.size)
+            expected = draw_page(11.69291338582677, 8.26771653543307, 20)
+            self.assertEqual(expected.tobytes(),
+                             image.convert('RGB').crop((0, 0) + expected.size)
+                             .tobytes())
+
+            # Visio is restored
+            settings = dispatcher.apps[0].Settings
+            self.assertEqual(96, settings.dpi)
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    def test_page_tiler(self):
+        dispatcher = FakeDispatcher(images=True, broken_pages=[u'ページ - 2'])
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            with VisioFile.Open(self.filename, pool) as visio:
+                page = list(visio.pages)[1]
+                shapes = page.Shapes
+                with self.assertRaises(IOError):
+                    with PageTiler(page, 20) as tiler:
+                        self.assertEqual((234, 165), tiler.size)
+                        tile = plan_tiles(234, 165, 100)[1][1]
+                        tiler.export(tile, os.path.join(self.tmpdir, 'a.png'))
+
+                # the frame of the tile is removed
+                self.assertEqual(shapes, page.Shapes)
+                self.assertAlmostEqual(11.69291338582677,
+                                       page.PageSheet.cells['PageWidth'])
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    def test_page_tiler_with_background(self):
+        from visio2img.testing import FakeShape
+
+        dispatcher = FakeDispatcher(images=True)
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            with VisioFile.Open(self.filename, pool) as visio:
+                page, background = list(visio.pages)
+                # a band on the right margin, and under the drawing
+                background.shapes = [FakeShape(background,
+                                               (10.5, 0, 11.5, 8.2),
+                                               (255, 0, 0))]
+                page.BackPage = background
+                with ExportResolution(visio.app, 20):
+                    with PageTiler(page, 20) as tiler:
+                        tile = plan_tiles(234, 165, 256)[0][0]
+                        image = tiler.export(tile, os.path.join(self.tmpdir,
+                                                                'a.png'))
+
+        self.assertEqual((255, 0, 0), image.getpixel((225, 80)))
+        self.assertEqual((255, 0, 0), image.getpixel((215, 2)))
+        self.assertEqual(draw_page(11.69291338582677, 8.26771653543307, 20)
+                         .getpixel((205, 80)), image.getpixel((205, 80)))
+        self.assertEqual((255, 255, 255), image.getpixel((232, 80)))
+        self.assertEqual(2, len(dispatcher.exported))
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    def test_page_tiler_with_page_spanning_shape(self):
+        from visio2img import testing
+        from visio2img.testing import FakeShape, draw_shapes
+
+        sizes = []
+
+        def draw(*args, **kwargs):
+            image = draw_shapes(*args, **kwargs)
+            sizes.append(image.size)
+            return image
+
+        dispatcher = FakeDispatcher(images=True)
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            with VisioFile.Open(self.filename, pool) as visio:
+                page = list(visio.pages)[0]
+                # a bar of 3 tiles, and a border of the page
+                bar = FakeShape(page, (0.5, 4.2, 5.3, 4.6), (0, 0, 255))
+                border = FakeShape(page, (0.1, 0.1, 11.6, 8.2), (0, 0, 0))
+                page.shapes.append(bar)
+                with ExportResolution(visio.app, 20), \
+                        patch.object(testing, 'draw_shapes', draw):
+                    with PageTiler(page, 20, 32 * 32 * 9) as tiler:
+                        for tiles in plan_tiles(234, 165, 32):
+                            for tile in tiles:
+                                tiler.export(tile, os.path.join(self.tmpdir,
+                                                                'a.png'))
+                    exported = len(dispatcher.exported)
+                    self.assertEqual(exported, len(sizes))
+                    for width, height in sizes:
+                        self.assertLessEqual(width * height, 32 * 32 * 9)
+
+                    page.shapes.append(border)
+                    with PageTiler(page, 20, 32 * 32 * 9) as tiler:
+                        tile = plan_tiles(234, 165, 32)[2][3]
+                        with self.assertRaises(IOError) as error:
+                            tiler.export(tile, os.path.join(self.tmpdir,
+                                                            'a.png'))
+                    self.assertIn('tile 3,2', str(error.exception))
+                    self.assertIn(border.Name, str(error.exception))
+                    self.assertIn('230x162 pixels', str(error.exception))
+
+        # the page is never exported whole
+        self.assertEqual(exported, len(dispatcher.exported))
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    def test_export_pyramid(self):
+        from PIL import Image
+
+        dispatcher = FakeDispatcher(images=True)
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            output = os.path.join(self.tmpdir, 'output.dzi')
+            export_tiled(self.filename, output, 1, dpi=20, tile_size=64,
+                         pool=pool, pyramid=True)
+
+        with open(output) as fd:
+            self.assertIn('TileSize="64"><Size Width="234" Height="165"/>',
+                          fd.read())
+
+        # 234 x 165, 117 x 83, ..., 1 x 1
+        files_dir = os.path.join(self.tmpdir, 'output_files')
+        self.assertEqual([str(level) for level in range(9)],
+                         sorted(os.listdir(files_dir), key=int))
+        self.assertEqual(12, len(os.listdir(os.path.join(files_dir, '8'))))
+        self.assertEqual(['0_0.png', '0_1.png', '1_0.png', '1_1.png'],
+                         sorted(os.listdir(os.path.join(files_dir, '7'))))
+        self.assertEqual((53, 19),
+                         Image.open(os.path.join(files_dir, '7',
+                                                 '1_1.png')).size)
+        self.assertEqual((1, 1), Image.open(os.path.join(files_dir, '0',
+                                                         '0_0.png')).size)
+
+    @unittest.skipIf(not is_pillow_available(), "Pillow not found")
+    def test_tile_size_option(self):
+        output = os.path.join(self.tmpdir, 'output.png')
+        with fake_visio(FakeDispatcher(images=True)) as dispatcher:
+            self.assertEqual(0, main(['--tile-size', '100', '--dpi', '20',
+                                      self.filename, output]))
+            self.assertEqual(['output1.png', 'output2.png'],
+                             sorted(os.listdir(self.tmpdir)))
+            self.assertEqual(12, len(dispatcher.exported))
+
+        with patch('sys.stderr', new_callable=StringIO):
+            for args in (['--tile-size', '0', self.filename, output],
+                         ['--dpi', '20', self.filename, output],
+                         ['--pyramid', self.filename, output],
+                         ['--tile-size', '100', '--batch', self.filename]):
+                with self.assertRaises(SystemExit):
+                    main(args)
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_tile_size_option_without_visio(self, _):
+        # the native renderer is chosen for .vsdx files, but does not tile
+        output = os.path.join(self.tmpdir, 'output')
+        with patch('sys.stderr', new_callable=StringIO) as stderr:
+            for args in (['--tile-size', '100', self.filename,
+                          output + '.png'],
+                         ['--pyramid', self.filename, output + '.dzi'],
+                         ['--native', '--tile-size', '100', self.filename,
+                          output + '.png']):
+                with self.assertRaises(SystemExit):
+                    main(args)
+            self.assertIn('require the Visio backend', stderr.getvalue())
+        self.assertEqual([], os.listdir(self.tmpdir))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import sys
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher, fake_visio
+from visio2img.variants import (
+    export_variants, is_pillow_available, make_variant, read_variants
+)
+from visio2img.visio2img import main
+from visio2img.vsdx import read_pages
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+VARIANTS = [make_variant(''),
+            make_variant('-web', 'jpg', width=1024, quality=85),
+            make_variant('-thumb', 'gif', width=200, height=200)]
+
+
+class TestVariants(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def write_config(self, config):
+        filename = os.path.join(self.tmpdir, 'variants.json')
+        with io.open(filename, 'w', encoding='utf-8') as fd:
+            fd.write(u'%s' % json.dumps(config))
+        return filename
+
+    def test_read_variants(self):
+        filename = self.write_config({'variants': [
+            {'suffix': '-thumb', 'format': 'GIF', 'width': 200}]})
+        variants, resolution = read_variants(filename)
+        self.assertEqual([('-thumb', 'gif', 200, None, None)], variants)
+        self.assertEqual(300, resolution)
+
+        for config in ({'variants': [{'format': 'bmp'}]},
+                       {'variants': [{'width': 0}]},
+                       {'variants': [{'size': 100}]},
+                       {'variants': []},
+                       {'resolution': 300},
+                       []):
+            with self.assertRaises(IOError):
+                read_variants(self.write_config(config))
+
+    @unittest.skipIf(not is_pillow_available(), 'Pillow is not installed')
+    def test_export_variants(self):
+        from PIL import Image
+
+        dispatcher = FakeDispatcher(images=True)
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            written = export_variants(filename,
+                                      os.path.join(self.tmpdir, 'output.png'),
+                                      VARIANTS, pool=pool, resolution=150)
+
+        self.assertEqual(['output1-thumb.gif', 'output1-web.jpg',
+                          'output1.png', 'output2-thumb.gif',
+                          'output2-web.jpg', 'output2.png'],
+                         sorted(os.listdir(self.tmpdir)))
+        self.assertEqual(6, len(written))
+
+        # exported once for each page, at the resolution
+        self.assertEqual(2, len(dispatcher.exported))
+        master = Image.open(os.path.join(self.tmpdir, 'output1.png'))
+        web = Image.open(os.path.join(self.tmpdir, 'output1-web.jpg'))
+        self.assertEqual(('JPEG', 1024), (web.format, web.size[0]))
+        thumb = Image.open(os.path.join(self.tmpdir, 'output1-thumb.gif'))
+        self.assertEqual('GIF', thumb.format)
+        self.assertEqual(200, max(thumb.size))
+
+        # Visio crops images to the drawing (whole inches of the fake)
+        page = read_pages(filename)[0]
+        self.assertEqual((int(page.width) * 150, int(page.height) * 150),
+                         master.size)
+
+        # resolution of the application is restored
+        self.assertEqual(96, dispatcher.apps[0].Settings.dpi)
+
+    @unittest.skipIf(not is_pillow_available(), 'Pillow is not installed')
+    def test_variants_option(self):
+        config = self.write_config({'resolution': 100, 'variants': [
+            {'suffix': '', 'format': 'png'},
+            {'suffix': '-small', 'format': 'jpg', 'width': 50}]})
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        with fake_visio(FakeDispatcher(images=True)) as dispatcher:
+            self.assertEqual(0, main(['--variants', config, filename,
+                                      output]))
+        self.assertEqual(1, len(dispatcher.exported))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir,
+                                                    'output-small.jpg')))
+
+        with patch('sys.stderr', new_callable=StringIO):
+            with self.assertRaises(SystemExit):
+                main(['--variants', config, '--batch', filename])
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_variants_option_without_visio(self, _):
+        # the native renderer does not take the resolution of the variants
+        config = self.write_config({'resolution': 100, 'variants': [
+            {'suffix': '', 'format': 'png'}]})
+        filename = os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        with patch('sys.stderr', new_callable=StringIO) as stderr:
+            for args in (['--variants', config, filename, output],
+                         ['--variants', config, '--native', filename,
+                          output]):
+                with self.assertRaises(SystemExit):
+                    main(args)
+            self.assertIn('requires the Visio backend', stderr.getvalue())
+        self.assertFalse(os.path.exists(output))
@@ -7,11 +7,16 @@ from shutil import rmtree
 from tempfile import mkdtemp
 from collections import namedtuple
 
+from visio2img.pool import VisioAppPool, configure_default_pool
+from visio2img.testing import FakeDispatcher
 from visio2img.visio2img import (
     is_pywin32_available,
     filter_pages,
     export_img,
+    export_outputs,
+    iter_export,
     main,
+    parse_output_spec,
 )
 
 if sys.version_info > (3, 0):
@@ -332,6 +337,7 @@ class TestVisio2img(unittest.TestCase):
     def test_export_img_if_visio_not_found(self, win32com_client):
         from pywintypes import com_error
         win32com_client.Dispatch.side_effect = com_error
+        configure_default_pool()  # drop Visio kept warm by other tests
 
         try:
             tmpdir = mkdtemp()
@@ -350,3 +356,147 @@ class TestVisio2img(unittest.TestCase):
                            os.path.join(tmpdir, 'output.png'), None, None)
         finally:
             rmtree(tmpdir)
+
+
+class TestIterExport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.dispatcher = FakeDispatcher(broken_pages=[u'ページ - 3'])
+        self.pool = VisioAppPool(dispatch=self.dispatcher)
+
+    def tearDown(self):
+        self.pool.close()
+        rmtree(self.tmpdir)
+
+    def test_iter_export(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        results = iter_export(filename, output, pool=self.pool)
+
+        # the first page is available before the others are exported
+        result = next(results)
+        self.assertEqual(1, result.index)
+        self.assertEqual(u'ページ - 1', result.name)
+        self.assertEqual(os.path.join(self.tmpdir, 'output01.png'),
+                         result.filename)
+        self.assertEqual(os.path.getsize(result.filename), result.size)
+        self.assertGreaterEqual(result.elapsed, 0)
+        self.assertIsNone(result.error)
+        self.assertEqual(1, len(self.dispatcher.exported))
+
+        # a broken page does not stop the rest
+        results = [result] + list(results)
+        self.assertEqual(list(range(1, 11)), [r.index for r in results])
+        self.assertEqual([2], [i for i, r in enumerate(results) if r.error])
+        self.assertIsNone(results[2].size)
+        self.assertEqual(9, len(os.listdir(self.tmpdir)))
+
+        # document is closed and the application goes back to the pool
+        self.assertEqual([], self.dispatcher.apps[0].Documents.documents)
+
+    def test_iter_export_with_template(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        output = os.path.join(self.tmpdir, '{index}-{name}.png')
+        results = list(iter_export(filename, output, pool=self.pool))
+        self.assertEqual([None, None], [r.error for r in results])
+        self.assertEqual([u'1-ページ - 1.png', u'2-ページ - 2.png'],
+                         [os.path.basename(r.filename) for r in results])
+        self.assertEqual(2, len(os.listdir(self.tmpdir)))
+        self.assertTrue(all(os.path.exists(r.filename) for r in results))
+
+    def test_iter_export_with_pagenum(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        results = list(iter_export(filename, output, 5, pool=self.pool))
+        self.assertEqual([(5, output)],
+                         [(r.index, r.filename) for r in results])
+
+        with self.assertRaises(IndexError):
+            list(iter_export(filename, output, 11, pool=self.pool))
+        with self.assertRaises(IOError):
+            list(iter_export(filename, '/path/to/output.png',
+                             pool=self.pool))
+
+    def test_export_img_with_broken_page(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        with self.assertRaises(IOError):
+            export_img(filename, os.path.join(self.tmpdir, 'output.png'),
+                       pool=self.pool)
+
+
+class TestExportOutputs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.dispatcher = FakeDispatcher()
+        self.pool = VisioAppPool(dispatch=self.dispatcher)
+
+    def tearDown(self):
+        self.pool.close()
+        rmtree(self.tmpdir)
+
+    def test_parse_output_spec(self):
+        self.assertEqual((2, 'a.png'), parse_output_spec('2:a.png'))
+        self.assertEqual((u'ページ - 1', 'C:\\a.png'),
+                         parse_output_spec(u'ページ - 1:C:\\a.png'))
+        self.assertEqual((None, 'a.png'), parse_output_spec('*:a.png'))
+        for spec in ['a.png', ':a.png', '2:']:
+            with self.assertRaises(ValueError):
+                parse_output_spec(spec)
+
+    def test_export_outputs(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        outputs = [(2, os.path.join(self.tmpdir, 'page2.png')),
+                   (5, os.path.join(self.tmpdir, 'page5.jpg')),
+                   (u'ページ - 1', os.path.join(self.tmpdir, 'thumb.gif'))]
+        results = export_outputs(filename, outputs, pool=self.pool)
+        self.assertEqual([(2, outputs[0][1]), (5, outputs[1][1]),
+                          (1, outputs[2][1])],
+                         [(r.index, r.filename) for r in results])
+        self.assertEqual([None] * 3, [r.error for r in results])
+        self.assertEqual(['page2.png', 'page5.jpg', 'thumb.gif'],
+                         sorted(os.listdir(self.tmpdir)))
+
+        # all outputs are exported in one session
+        self.assertEqual(1, len(self.dispatcher.apps))
+        self.assertEqual(1, self.dispatcher.apps[0].opened)
+
+    def test_export_outputs_with_mapping(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        output = os.path.join(self.tmpdir, 'all.png')
+        results = export_outputs(filename, {None: output}, pool=self.pool)
+        self.assertEqual([1, 2], [r.index for r in results])
+        self.assertEqual(['all1.png', 'all2.png'],
+                         sorted(os.listdir(self.tmpdir)))
+
+    def test_export_outputs_with_invalid_page(self):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        output = os.path.join(self.tmpdir, 'output.png')
+        with self.assertRaises(IndexError):
+            export_outputs(filename, [(1, output), (3, output)],
+                           pool=self.pool)
+        with self.assertRaises(IndexError):
+            export_outputs(filename, [('unknown', output)], pool=self.pool)
+
+        # detected without Visio
+        self.assertEqual([], self.dispatcher.apps)
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=True)
+    def test_output_option(self, _):
+        filename = os.path.join(EXAMPLE_DIR, 'multipages2.vsdx')
+        args = ['-o', '2:' + os.path.join(self.tmpdir, 'page2.png'),
+                '-o', '5:' + os.path.join(self.tmpdir, 'page5.jpg'),
+                filename]
+        with patch('visio2img.pool.dispatch_visio', self.dispatcher):
+            with patch('visio2img.pool._default_pool', None):
+                self.assertEqual(0, main(args))
+        self.assertEqual(['page2.png', 'page5.jpg'],
+                         sorted(os.listdir(self.tmpdir)))
+        self.assertEqual(1, self.dispatcher.apps[0].opened)
+
+        with patch('sys.stderr'):
+            for args in (['-o', '2:a.bmp', filename],
+                         ['-o', 'a.png', filename],
+                         ['-o', '2:a.png', '-p', '1', filename],
+                         ['-o', '2:a.png', filename, 'b.png']):
+                with self.assertRaises(SystemExit):
+                    main(args)
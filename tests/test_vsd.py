@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher
+from visio2img.visio2img import (
+    export_img, list_pages, main, select_pages_from_catalog
+)
+from visio2img.vsd import (
+    CompoundFile, decompress, is_ole_file, read_pages, read_properties
+)
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestVsd(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(EXAMPLE_DIR, 'multipages.vsd')
+
+    def test_is_ole_file(self):
+        self.assertTrue(is_ole_file(self.filename))
+        self.assertFalse(is_ole_file(os.path.join(EXAMPLE_DIR,
+                                                  'multipages.vsdx')))
+        self.assertFalse(is_ole_file('/path/to/notexist.vsd'))
+
+    def test_compound_file(self):
+        document = CompoundFile.open(self.filename)
+        self.assertIn('VisioDocument', document.listdir())
+        self.assertTrue(document.read_stream('VisioDocument')
+                        .startswith(b'Visio (TM) Drawing\r\n'))
+        with self.assertRaises(IOError):
+            document.read_stream('notexist')
+
+    def test_decompress(self):
+        # 'ab' as literals, and then 'ababab' as a reference to them
+        self.assertEqual(b'abababab', decompress(b'\x03ab\xee\xf3'))
+
+    def test_read_pages(self):
+        pages = read_pages(self.filename)
+        self.assertEqual([1, 2], [page.index for page in pages])
+        self.assertEqual([0, 4], [page.id for page in pages])
+
+        page = pages[1]
+        self.assertIsNone(page.name)
+        self.assertAlmostEqual(297, page.width * 25.4)
+        self.assertAlmostEqual(210, page.height * 25.4)
+        self.assertFalse(page.background)
+
+    def test_read_pages_renamed(self):
+        # the second page is renamed to "ネットワーク" ("Network")
+        pages = read_pages(os.path.join(EXAMPLE_DIR, 'renamed.vsd'))
+        self.assertEqual([None, u'ネットワーク'],
+                         [page.name for page in pages])
+        self.assertEqual([None, u'Network'],
+                         [page.name_u for page in pages])
+
+    def test_read_pages_from_invalid_file(self):
+        with self.assertRaises(IOError):
+            read_pages(os.path.join(EXAMPLE_DIR, 'multipages.vsdx'))
+        with self.assertRaises(IOError):
+            read_pages('/path/to/notexist.vsd')
+
+    def test_read_properties(self):
+        properties = read_properties(self.filename)
+        self.assertEqual(u'tk0miya', properties['author'])
+        self.assertEqual(u'Microsoft Visio', properties['application'])
+        self.assertNotIn('title', properties)  # empty
+
+    def test_select_pages_from_catalog(self):
+        self.assertEqual([2], [page.index for page in
+                               select_pages_from_catalog(self.filename, 2)])
+        with self.assertRaises(IndexError):
+            select_pages_from_catalog(self.filename, 3)
+
+        # default names are left to Visio
+        self.assertIsNone(select_pages_from_catalog(self.filename, None,
+                                                    u'ページ - 1'))
+
+        # names of renamed pages are found without Visio
+        filename = os.path.join(EXAMPLE_DIR, 'renamed.vsd')
+        self.assertEqual([2], [page.index for page in
+                               select_pages_from_catalog(filename, None,
+                                                         u'ネットワーク')])
+        self.assertIsNone(select_pages_from_catalog(filename, None,
+                                                    u'ページ - 1'))
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_list_option(self, _):
+        # pages are listed without Visio
+        filename = os.path.join(EXAMPLE_DIR, 'renamed.vsd')
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.assertEqual(0, main(['--list', filename]))
+        self.assertEqual(u'1: (default name) (11.69 x 8.27 in)\n'
+                         u'2: ネットワーク (11.69 x 8.27 in)\n',
+                         stdout.getvalue())
+
+    def test_list_pages_by_visio(self):
+        # default names are taken from Visio if available
+        dispatcher = FakeDispatcher([u'ページ-1', u'ページ-2'])
+        with VisioAppPool(dispatch=dispatcher) as pool:
+            with patch("visio2img.visio2img.is_pywin32_available",
+                       return_value=True):
+                pages = list_pages(self.filename, pool)
+            self.assertEqual([u'ページ-1', u'ページ-2'],
+                             [page.name for page in pages])
+            self.assertEqual(1, len(dispatcher.apps))
+
+            # without Visio, pages having default names have no names
+            with patch("visio2img.visio2img.is_pywin32_available",
+                       return_value=False):
+                pages = list_pages(self.filename, pool)
+            self.assertEqual([None, None], [page.name for page in pages])
+            self.assertEqual(1, len(dispatcher.apps))
+
+    def test_export_img_checks_pages_before_visio(self):
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(dispatch=dispatcher)
+        try:
+            tmpdir = mkdtemp()
+            output = os.path.join(tmpdir, 'output.png')
+            with self.assertRaises(IndexError):
+                export_img(self.filename, output, 3, None, pool=pool)
+            self.assertEqual(0, len(dispatcher.apps))
+
+            export_img(self.filename, output, 2, None, pool=pool)
+            self.assertEqual(['output.png'], os.listdir(tmpdir))
+        finally:
+            pool.close()
+            rmtree(tmpdir)
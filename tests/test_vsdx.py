@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher
+from visio2img.visio2img import export_img, main
+from visio2img.vsdx import is_vsdx, read_pages
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestVsdx(unittest.TestCase):
+    def test_is_vsdx(self):
+        self.assertTrue(is_vsdx(os.path.join(EXAMPLE_DIR, 'singlepage.vsdx')))
+        self.assertFalse(is_vsdx(os.path.join(EXAMPLE_DIR, 'multipages.vsd')))
+        self.assertFalse(is_vsdx('/path/to/notexist.vsdx'))
+
+    def test_read_pages(self):
+        pages = read_pages(os.path.join(EXAMPLE_DIR, 'multipages2.vsdx'))
+        self.assertEqual(10, len(pages))
+
+        page = pages[1]
+        self.assertEqual(2, page.index)
+        self.assertEqual(4, page.id)
+        self.assertEqual(u'ページ - 2', page.name)
+        self.assertEqual(u'Page-2', page.name_u)
+        self.assertAlmostEqual(297, page.width * 25.4)
+        self.assertAlmostEqual(210, page.height * 25.4)
+        self.assertFalse(page.background)
+        self.assertEqual('visio/pages/page2.xml', page.part)
+
+    def test_read_pages_from_invalid_file(self):
+        with self.assertRaises(IOError):
+            read_pages(os.path.join(EXAMPLE_DIR, 'multipages.vsd'))
+
+    def test_export_img_checks_pages_before_visio(self):
+        dispatcher = FakeDispatcher()
+        pool = VisioAppPool(dispatch=dispatcher)
+        filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+        try:
+            tmpdir = mkdtemp()
+            output = os.path.join(tmpdir, 'output.png')
+            with self.assertRaises(IndexError):
+                export_img(filename, output, 3, None, pool=pool)
+            with self.assertRaises(IndexError):
+                export_img(filename, output, None, u'unknown', pool=pool)
+            self.assertEqual(0, len(dispatcher.apps))
+
+            export_img(filename, output, None, u'ページ - 2', pool=pool)
+            self.assertEqual(['output.png'], os.listdir(tmpdir))
+        finally:
+            rmtree(tmpdir)
+
+    @patch("visio2img.visio2img.is_pywin32_available", return_value=False)
+    def test_list_option(self, _):
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            filename = os.path.join(EXAMPLE_DIR, 'multipages.vsdx')
+            self.assertEqual(0, main(['--list', filename]))
+            self.assertEqual(u'1: ページ - 1 (11.69 x 8.27 in)\n'
+                             u'2: ページ - 2 (11.69 x 8.27 in)\n',
+                             stdout.getvalue())
+
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            filenames = [os.path.join(EXAMPLE_DIR, 'singlepage.vsdx'),
+                         os.path.join(EXAMPLE_DIR, 'multipages.vsdx')]
+            self.assertEqual(0, main(['-l'] + filenames))
+            self.assertEqual(5, len(stdout.getvalue().splitlines()))
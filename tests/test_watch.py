@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import threading
+import time
+import unittest
+from tempfile import mkdtemp
+
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher, fake_visio
+from visio2img.visio2img import main
+from visio2img.watch import Watcher
+
+if sys.version_info > (3, 0):
+    from io import StringIO
+    from unittest.mock import patch
+else:
+    from StringIO import StringIO
+    from mock import patch
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), 'examples')
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.input_dir = os.path.join(self.tmpdir, 'input')
+        self.output_dir = os.path.join(self.tmpdir, 'output')
+        os.makedirs(os.path.join(self.input_dir, 'sub'))
+        self.dispatcher = FakeDispatcher()
+        self.pool = VisioAppPool(dispatch=self.dispatcher)
+        self.watcher = Watcher([self.input_dir], self.output_dir,
+                               pool=self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tmpdir)
+
+    def copy_example(self, name, path):
+        filename = os.path.join(self.input_dir, path)
+        shutil.copy(os.path.join(EXAMPLE_DIR, name), filename)
+        return filename
+
+    def touch(self, filename, offset):
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + offset))
+
+    def test_poll(self):
+        self.copy_example('singlepage.vsdx', 'a.vsdx')
+        self.copy_example('multipages.vsdx', 'sub/b.vsdx')
+
+        # exported after files stay unchanged for a poll
+        self.assertEqual([], self.watcher.poll())
+        results = self.watcher.poll()
+        self.assertEqual([('exported', 1, None), ('exported', 2, None)],
+                         [(r.action, len(r.filenames), r.error)
+                          for r in results])
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir,
+                                                    'sub', 'b1.png')))
+        self.assertEqual([], self.watcher.poll())
+
+        # touched but not changed
+        filename = os.path.join(self.input_dir, 'a.vsdx')
+        self.touch(filename, 10)
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual(3, len(self.dispatcher.exported))
+
+        # a burst of saves is exported once
+        self.copy_example('multipages.vsdx', 'a.vsdx')
+        self.touch(filename, 20)
+        self.assertEqual([], self.watcher.poll())
+        self.touch(filename, 1)
+        self.assertEqual([], self.watcher.poll())
+        results = self.watcher.poll()
+        self.assertEqual([(filename, 2)],
+                         [(r.job.visio_filename, len(r.filenames))
+                          for r in results])
+        self.assertEqual([], self.watcher.poll())
+
+        # removed
+        os.remove(filename)
+        results = self.watcher.poll()
+        self.assertEqual(['removed'], [r.action for r in results])
+        self.assertEqual(['sub'], os.listdir(self.output_dir))
+
+        # one warm Visio for all
+        self.assertEqual(1, len(self.dispatcher.apps))
+
+    def test_changed_page(self):
+        filename = self.copy_example('multipages.vsdx', 'a.vsdx')
+        self.watcher.poll()
+        self.watcher.poll()
+        self.assertEqual(2, len(self.dispatcher.exported))
+
+        # the content is changed, but the pages are not
+        with open(filename, 'ab') as fd:
+            fd.write(b'\0')
+        self.watcher.poll()
+        results = self.watcher.poll()
+        self.assertEqual([[]], [r.filenames for r in results])
+        self.assertEqual(2, len(self.dispatcher.exported))
+
+    def test_retry_failed_export(self):
+        filename = self.copy_example('singlepage.vsdx', 'a.vsdx')
+        self.watcher.poll()
+        with patch('visio2img.watch.export_incremental',
+                   side_effect=IOError('Visio is busy')):
+            results = self.watcher.poll()
+        self.assertEqual([filename], [r.job.visio_filename for r in results])
+        self.assertIsInstance(results[0].error, IOError)
+
+        # retried after the file stays unchanged for another poll
+        self.assertEqual([], self.watcher.poll())
+        results = self.watcher.poll()
+        self.assertEqual([(1, None)],
+                         [(len(r.filenames), r.error) for r in results])
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual(1, len(self.dispatcher.exported))
+
+    def test_run(self):
+        self.watcher.interval = 0.01
+        self.copy_example('singlepage.vsdx', 'a.vsdx')
+        stop = threading.Event()
+        stream = StringIO()
+        thread = threading.Thread(target=self.watcher.run,
+                                  args=(stream, stop))
+        thread.start()
+        try:
+            deadline = time.time() + 5
+            while not stream.getvalue() and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            stop.set()
+            thread.join()
+
+        self.assertTrue(stream.getvalue().startswith('ok: '))
+
+    def test_watch_option(self):
+        self.copy_example('singlepage.vsdx', 'a.vsdx')
+        with fake_visio(FakeDispatcher()) as dispatcher:
+            with patch('visio2img.watch.Watcher.run',
+                       side_effect=KeyboardInterrupt):
+                self.assertEqual(0, main(['--watch', '-d', self.output_dir,
+                                          self.input_dir]))
+        self.assertEqual([], dispatcher.apps)
+
+        with patch('sys.stderr', new_callable=StringIO):
+            for args in (['--watch'],
+                         ['--watch', '--batch', self.input_dir],
+                         ['--watch', '--interval', '0', self.input_dir]):
+                with self.assertRaises(SystemExit):
+                    main(args)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+asyncio API of visio2img (Python 3.5 or later)
+
+COM objects are used only from dedicated worker threads (single threaded
+apartments); coroutines wait for them without blocking the event loop::
+
+   results = await export_img_async('diagram.vsdx', 'output.png')
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import atexit
+import threading
+import weakref
+from concurrent.futures import Future
+from queue import Queue
+
+from visio2img.pool import VisioAppPool, initialize_com, uninitialize_com
+from visio2img.visio2img import iter_export, raise_page_error
+
+
+class AsyncExporter(object):
+    """ Exports visio files on worker threads for asyncio
+
+    Each of ``workers`` threads initializes COM and owns a VisioAppPool, so
+    at most ``workers`` Visio applications are used.  Up to
+    ``concurrency`` exports (default: ``workers``) are queued to the
+    threads at once; the others wait in the event loop.
+    """
+    def __init__(self, workers=2, concurrency=None, dispatch=None):
+        self.concurrency = concurrency or workers
+        self.dispatch = dispatch
+        self.semaphores = weakref.WeakKeyDictionary()  # loop => semaphore
+        self.tasks = Queue()
+        self.closed = False
+        self.threads = [threading.Thread(target=self.work)
+                        for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self):
+        """ Stops worker threads after finishing queued exports """
+        if not self.closed:
+            self.closed = True
+            for _ in self.threads:
+                self.tasks.put(None)
+            for thread in self.threads:
+                thread.join()
+
+    def work(self):
+        initialize_com()  # COM objects belong to the thread
+        pool = VisioAppPool(dispatch=self.dispatch)
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    break
+
+                future, cancelled, args = task
+                if not future.set_running_or_notify_cancel():
+                    continue  # cancelled before starting
+
+                try:
+                    future.set_result(self.export(pool, cancelled, *args))
+                except Exception as exc:
+                    future.set_exception(exc)
+        finally:
+            pool.close()
+            uninitialize_com()
+
+    def export(self, pool, cancelled, visio_filename, image_filename,
+               pagenum, pagename, native):
+        """ Exports pages until cancelled (in a worker thread) """
+        results = []
+        pages = iter_export(visio_filename, image_filename, pagenum,
+                            pagename, pool, native)
+        try:
+            for result in pages:
+                results.append(result)
+                if cancelled.is_set():
+                    break
+        finally:
+            pages.close()  # closes the document
+
+        return results
+
+    def get_semaphore(self):
+        loop = asyncio.get_event_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[loop]
+
+    async def export_pages(self, visio_filename, image_filename,
+                           pagenum=None, pagename=None, native=False,
+                           timeout=None):
+        """ Exports images and returns the list of PageResult
+
+        A failure of a page is stored in its result like iter_export().  On
+        cancellation or timeout, the page being exported is finished and
+        then the document is closed.
+        """
+        if self.closed:
+            raise OSError('AsyncExporter is closed')
+
+        async with self.get_semaphore():
+            future = Future()
+            cancelled = threading.Event()
+            self.tasks.put((future, cancelled,
+                            (visio_filename, image_filename, pagenum,
+                             pagename, native)))
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future),
+                                              timeout)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                cancelled.set()
+                future.cancel()
+                raise
+
+    async def export_img(self, visio_filename, image_filename, pagenum=None,
+                         pagename=None, native=False, timeout=None):
+        """ Exports images from visio file like export_img()
+
+        Raises IOError if any page could not be exported; otherwise returns
+        the list of PageResult.
+        """
+        results = await self.export_pages(visio_filename, image_filename,
+                                          pagenum, pagename, native, timeout)
+        for result in results:
+            raise_page_error(result,
+                             'Could not write image: %s' % image_filename)
+
+        return results
+
+
+_default_exporter = None
+
+
+def get_default_exporter():
+    """ Returns the process wide exporter used by export_img_async() """
+    global _default_exporter
+    if _default_exporter is None or _default_exporter.closed:
+        _default_exporter = AsyncExporter()
+        atexit.register(_default_exporter.close)
+    return _default_exporter
+
+
+async def export_img_async(visio_filename, image_filename, pagenum=None,
+                           pagename=None, native=False, timeout=None):
+    """ Exports images from visio file without blocking the event loop """
+    exporter = get_default_exporter()
+    return await exporter.export_img(visio_filename, image_filename,
+                                     pagenum, pagename, native, timeout)
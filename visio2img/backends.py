@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Registry of conversion backends
+
+A backend opens visio files as documents (objects having ``pages`` which
+``Export()`` images, and ``close()``) and lists their pages.  Backends are
+registered by name as classes or ``"module:attribute"`` strings, and are
+instantiated on first use; Visio (pywin32) and the native renderer are
+imported only when a document is opened by them.  Backends of other
+packages are discovered through the ``visio2img.backends`` entry points.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+import os
+import sys
+
+ENTRY_POINT_GROUP = 'visio2img.backends'
+
+
+def is_module_available(name):
+    """ Tests the module can be imported (without importing it) """
+    if name in sys.modules:
+        return sys.modules[name] is not None
+
+    try:
+        from importlib.util import find_spec
+    except ImportError:  # Python 2
+        import imp
+        try:
+            imp.find_module(name)
+            return True
+        except ImportError:
+            return False
+
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class Backend(object):
+    """ Base class of backends """
+    #: name of the backend
+    name = None
+    #: extensions of visio files supported
+    extensions = ('.vsd', '.vsdx')
+
+    def is_available(self):
+        """ Tests the backend runs on this platform """
+        return True
+
+    def accepts(self, filename):
+        """ Tests the backend converts filename """
+        ext = os.path.splitext(filename)[1].lower()
+        return ext in self.extensions
+
+    def open(self, filename, pool=None, documents=None):
+        """ Opens visio file and returns the document """
+        raise NotImplementedError
+
+    def list_pages(self, filename, pool=None):
+        """ Lists pages of visio file as PageInfo """
+        from visio2img.vsdx import PageInfo
+
+        document = self.open(filename, pool)
+        try:
+            return [PageInfo(i + 1, None, page.Name, page.Name, None, None,
+                             False, None)
+                    for i, page in enumerate(document.pages)]
+        finally:
+            document.close()
+
+
+class VisioBackend(Backend):
+    """ Backend converting with Visio through pywin32 (Windows) """
+    name = 'visio'
+
+    def is_available(self):
+        from visio2img import visio2img
+        return visio2img.is_pywin32_available()
+
+    def open(self, filename, pool=None, documents=None):
+        from visio2img.visio2img import VisioFile
+
+        if documents is not None:
+            return documents.open(filename)
+        else:
+            return VisioFile.Open(filename, pool)
+
+    def list_pages(self, filename, pool=None):
+        from visio2img.vsdx import PageInfo
+
+        with self.open(filename, pool) as visio:
+            pages = []
+            for page in visio.pages:
+                sheet = page.PageSheet
+                pages.append(PageInfo(index=page.Index,
+                                      id=page.ID,
+                                      name=page.Name,
+                                      name_u=page.NameU,
+                                      width=sheet.CellsU('PageWidth').ResultIU,
+                                      height=sheet.CellsU('PageHeight')
+                                      .ResultIU,
+                                      background=bool(page.Background),
+                                      part=None))
+            return pages
+
+
+class NativeBackend(Backend):
+    """ Backend rendering .vsdx files without Visio (experimental) """
+    name = 'native'
+    extensions = ('.vsdx',)
+
+    def open(self, filename, pool=None, documents=None):
+        from visio2img.render import NativeFile
+        return NativeFile.Open(filename)
+
+    def list_pages(self, filename, pool=None):
+        from visio2img.vsdx import read_pages
+        return read_pages(filename)
+
+
+# name -> class or "module:attribute" (in the order of automatic selection)
+_registry = [('visio', VisioBackend), ('native', NativeBackend)]
+_backends = {}  # name -> instance
+_entry_points_loaded = False
+_default_backend = None
+
+
+def register_backend(name, factory):
+    """ Registers a backend class (or "module:attribute") as name
+
+    A backend registered already under the name is replaced.
+    """
+    global _registry
+    _registry = [entry for entry in _registry if entry[0] != name]
+    _registry.append((name, factory))
+    _backends.pop(name, None)
+
+
+def iter_entry_points():
+    """ Yields pairs of name and "module:attribute" of entry points """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+
+        for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            yield (entry_point.name, '%s:%s' % (entry_point.module_name,
+                                                '.'.join(entry_point.attrs)))
+        return
+
+    found = entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group=ENTRY_POINT_GROUP)
+    else:  # Python 3.8 and 3.9
+        found = found.get(ENTRY_POINT_GROUP, [])
+    for entry_point in found:
+        yield (entry_point.name, entry_point.value)
+
+
+def load_entry_points():
+    """ Registers backends of entry points (only once)
+
+    Backends registered explicitly take precedence over entry points.
+    """
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+
+    _entry_points_loaded = True
+    names = set(name for name, _ in _registry)
+    for name, factory in iter_entry_points():
+        if name not in names:
+            names.add(name)
+            _registry.append((name, factory))
+
+
+def get_backend_names():
+    """ Returns names of registered backends (including entry points) """
+    load_entry_points()
+    return [name for name, _ in _registry]
+
+
+def get_backend(name=None):
+    """ Returns the backend registered as name (instantiated on first use)
+
+    If name is not given, the default backend is returned (see
+    configure_default_backend(); Visio if not configured).
+    """
+    name = name or _default_backend or VisioBackend.name
+    if name not in _backends:
+        factories = dict(_registry)
+        if name not in factories:
+            load_entry_points()
+            factories = dict(_registry)
+        if name not in factories:
+            raise OSError('Unknown backend: %s' % name)
+
+        factory = factories[name]
+        if not callable(factory):
+            module, _, attr = factory.partition(':')
+            factory = importlib.import_module(module)
+            for part in attr.split('.'):
+                factory = getattr(factory, part)
+        _backends[name] = factory()
+
+    return _backends[name]
+
+
+def select_backend(filename=None):
+    """ Returns the name of an available backend converting filename
+
+    Backends are tried in the order of registration (Visio first, then
+    the native renderer and entry points).  If filename is not given, the
+    backend should convert both .vsd and .vsdx files.
+    """
+    for load in (False, True):
+        if load:
+            if _entry_points_loaded:
+                break
+            load_entry_points()
+
+        for name, _ in list(_registry):
+            backend = get_backend(name)
+            if filename is None:
+                accepts = all(backend.accepts('_' + ext)
+                              for ext in Backend.extensions)
+            else:
+                accepts = backend.accepts(filename)
+            if accepts and backend.is_available():
+                return name
+
+    if filename is None:
+        raise OSError('No backend available (win32com module not found)')
+    else:
+        raise OSError('No backend available for %s '
+                      '(win32com module not found)' % filename)
+
+
+def configure_default_backend(name):
+    """ Sets the backend used when no backend is given (ex. by the CLI) """
+    global _default_backend
+    if name is not None:
+        get_backend(name)  # validate the name
+    _default_backend = name
+
+
+def get_default_backend_name():
+    """ Returns the name of the default backend (or None if not configured) """
+    return _default_backend
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import absolute_import
+
+import io
+import os
+import re
+import shlex
+import time
+from collections import namedtuple
+from glob import glob
+
+from visio2img.visio2img import export_img
+
+VISIO_EXTENSIONS = ('.vsd', '.vsdx')
+
+BatchJob = namedtuple('BatchJob', 'visio_filename image_filename')
+BatchResult = namedtuple('BatchResult', 'job error elapsed')
+
+
+def is_visio_file(filename):
+    """ Tests filename looks like a visio file """
+    return os.path.splitext(filename)[1].lower() in VISIO_EXTENSIONS
+
+
+def find_visio_files(path):
+    """ Yields (root, filename) pairs for a file, a directory or a glob """
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if is_visio_file(filename):
+                    yield path, os.path.join(dirpath, filename)
+    elif os.path.exists(path):
+        yield os.path.dirname(path), path
+    else:
+        filenames = sorted(glob(path))
+        if not filenames:
+            raise IOError('No such visio file: %s' % path)
+
+        for filename in filenames:
+            for entry in find_visio_files(filename):
+                yield entry
+
+
+def collect_jobs(paths, output_dir, image_format='.png'):
+    """ Makes jobs converting visio files under paths into output_dir
+
+    Files found in a directory keep their relative path in output_dir.
+    """
+    jobs = []
+    for path in paths:
+        for root, filename in find_visio_files(path):
+            relpath = os.path.relpath(filename, root or os.curdir)
+            basename = os.path.splitext(relpath)[0]
+            output = os.path.join(output_dir, basename + image_format)
+            jobs.append(BatchJob(filename, output))
+
+    return jobs
+
+
+def read_manifest(filename):
+    """ Reads jobs from a manifest file
+
+    Each line of manifest has an input filename and an output filename.
+    The output may contain ``{name}`` which is replaced by the basename of
+    input (without extension).  Relative paths are resolved from the
+    directory of the manifest.  Blank lines and lines starting with ``#``
+    are ignored.
+    """
+    basedir = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    with io.open(filename, encoding='utf-8') as fd:
+        for lineno, line in enumerate(fd, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            try:
+                visio_filename, template = shlex.split(line)
+            except ValueError:
+                msg = 'Invalid manifest entry at %s line %d: %s'
+                raise IOError(msg % (filename, lineno, line))
+
+            name = os.path.splitext(os.path.basename(visio_filename))[0]
+            try:
+                image_filename = template.format(name=name)
+            except (KeyError, IndexError, ValueError):
+                msg = 'Invalid output template at %s line %d: %s'
+                raise IOError(msg % (filename, lineno, template))
+            jobs.append(BatchJob(os.path.join(basedir, visio_filename),
+                                 os.path.join(basedir, image_filename)))
+
+    return jobs
+
+
+def run_batch(jobs, pagenum=None, pagename=None, pool=None, cache=None,
+              native=False):
+    """ Converts all jobs and yields BatchResult for each job
+
+    A failure of a job is recorded to its result and does not stop others.
+    """
+    for job in jobs:
+        started = time.time()
+        try:
+            output_dir = os.path.dirname(os.path.abspath(job.image_filename))
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+
+            export_img(job.visio_filename, job.image_filename,
+                       pagenum, pagename, pool=pool, cache=cache,
+                       native=native)
+            yield BatchResult(job, None, time.time() - started)
+        except Exception as err:
+            yield BatchResult(job, err, time.time() - started)
+
+
+def find_outputs(image_filename):
+    """ Returns the images written for image_filename
+
+    A document having multiple pages is written to numbered filenames
+    (see make_image_filenames()).
+    """
+    if os.path.exists(image_filename):
+        return [image_filename]
+
+    dirname, basename = os.path.split(image_filename)
+    stem, ext = os.path.splitext(basename)
+    pattern = re.compile(re.escape(stem) + r'\d+' + re.escape(ext) + '$')
+    try:
+        names = sorted(name for name in os.listdir(dirname or os.curdir)
+                       if pattern.match(name))
+    except OSError:
+        return []
+
+    return [os.path.join(dirname, name) for name in names]
+
+
+def print_summary(results, stream):
+    """ Prints result of each job and returns the number of failures """
+    succeeded = failed = 0
+    for result in results:
+        if result.error is None:
+            succeeded += 1
+            stream.write('ok: %s -> %s\n' % result.job)
+        else:
+            failed += 1
+            stream.write('failed: %s: %s\n' %
+                         (result.job.visio_filename, result.error))
+        stream.flush()
+
+    stream.write('%d converted, %d failed\n' % (succeeded, failed))
+    return failed
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Benchmark of visio2img with a simulated Visio
+
+Runs conversions against ``FakeDispatcher`` (latencies of launching Visio,
+opening documents, exporting pages and quitting are configurable), so the
+throughput can be measured on any platform::
+
+   python -m visio2img.benchmark --documents 20 --pages 3 --jobs 2
+
+Modes:
+
+   cold      export_img() launching Visio for each document
+   serial    export_img() with a warm VisioAppPool
+   batch     run_batch()
+   parallel  ParallelExporter.run_batch() by --jobs processes
+   cli       visio2img --batch command (in process)
+   filter    filter_pages() by page name over 1000 pages; a call is
+             counted as a document
+"""
+
+from __future__ import absolute_import
+
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from optparse import OptionParser
+
+from visio2img.batch import BatchJob, run_batch
+from visio2img.parallel import ParallelExporter
+from visio2img.pool import VisioAppPool
+from visio2img.testing import FakeDispatcher, fake_visio
+from visio2img.visio2img import export_img, filter_pages, main
+from visio2img.vsdx import PageInfo
+
+MODES = ['cold', 'serial', 'batch', 'parallel', 'cli', 'filter']
+
+BenchmarkResult = namedtuple('BenchmarkResult',
+                             'mode documents pages elapsed latencies')
+
+
+def percentile(values, ratio):
+    """ Returns the value at ratio (0 to 1) of values (nearest rank) """
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = int(math.ceil(ratio * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(result):
+    """ Makes a dict of throughput and latency from BenchmarkResult """
+    elapsed = max(result.elapsed, 1e-9)
+    return {'mode': result.mode,
+            'documents': result.documents,
+            'pages': result.pages,
+            'elapsed': result.elapsed,
+            'docs_per_sec': result.documents / elapsed,
+            'pages_per_sec': result.pages / elapsed,
+            'p50': percentile(result.latencies, 0.5),
+            'p95': percentile(result.latencies, 0.95)}
+
+
+class Benchmark(object):
+    """ Runs benchmarks on dummy documents in a temporary directory """
+    def __init__(self, documents=20, pages=3, startup_latency=0.5,
+                 open_latency=0.1, export_latency=0.05, quit_latency=0.2,
+                 jobs=2):
+        self.documents = documents
+        self.pages = pages
+        self.jobs = jobs
+        self.dispatcher = FakeDispatcher(
+            page_names=[u'Page-%d' % (i + 1) for i in range(pages)],
+            startup_latency=startup_latency, open_latency=open_latency,
+            export_latency=export_latency, quit_latency=quit_latency)
+        self.tmpdir = None
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, *args):
+        self.teardown()
+        return False
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmpdir, 'input')
+        os.mkdir(self.input_dir)
+        for i in range(self.documents):
+            # contents are not read by FakeDispatcher
+            filename = os.path.join(self.input_dir, 'doc%04d.vsd' % i)
+            open(filename, 'wb').close()
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def make_jobs(self, mode):
+        output_dir = os.path.join(self.tmpdir, mode)
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.mkdir(output_dir)
+
+        return [BatchJob(os.path.join(self.input_dir, name),
+                         os.path.join(output_dir,
+                                      os.path.splitext(name)[0] + '.png'))
+                for name in sorted(os.listdir(self.input_dir))]
+
+    def run(self, mode):
+        """ Runs a benchmark and returns BenchmarkResult """
+        if mode not in MODES:
+            raise ValueError('Unknown mode: %s' % mode)
+
+        jobs = self.make_jobs(mode)
+        started = time.time()
+        latencies, pages = getattr(self, 'run_' + mode)(jobs)
+        elapsed = time.time() - started
+        return BenchmarkResult(mode, len(latencies), len(latencies) * pages,
+                               elapsed, latencies)
+
+    def run_cold(self, jobs):
+        latencies = []
+        for job in jobs:
+            started = time.time()
+            with VisioAppPool(dispatch=self.dispatcher) as pool:
+                export_img(job.visio_filename, job.image_filename, pool=pool)
+            latencies.append(time.time() - started)
+        return latencies, self.pages
+
+    def run_serial(self, jobs):
+        latencies = []
+        with VisioAppPool(dispatch=self.dispatcher) as pool:
+            for job in jobs:
+                started = time.time()
+                export_img(job.visio_filename, job.image_filename, pool=pool)
+                latencies.append(time.time() - started)
+        return latencies, self.pages
+
+    def run_batch(self, jobs):
+        with VisioAppPool(dispatch=self.dispatcher) as pool:
+            return self.check(run_batch(jobs, pool=pool))
+
+    def run_parallel(self, jobs):
+        with ParallelExporter(self.jobs, self.dispatcher) as exporter:
+            return self.check(exporter.run_batch(jobs))
+
+    def run_cli(self, jobs):
+        output_dir = os.path.dirname(jobs[0].image_filename)
+        args = ['--batch', '--output-dir', output_dir, self.input_dir]
+        if self.jobs > 1:
+            args += ['--jobs', str(self.jobs)]
+
+        started = time.time()
+        with fake_visio(self.dispatcher):
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            try:
+                ret = main(args)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+        if ret != 0:
+            raise IOError('visio2img command failed: %d' % ret)
+
+        # per-document latency is not visible; use the average
+        return [(time.time() - started) / len(jobs)] * len(jobs), self.pages
+
+    def run_filter(self, jobs):
+        pages = [PageInfo(i + 1, i, u'Page-%d' % (i + 1), None, 8.5, 11,
+                          False, None) for i in range(1000)]
+        latencies = []
+        for i in range(len(jobs) * 100):
+            started = time.time()
+            filter_pages(pages, None, pages[i % len(pages)].name)
+            latencies.append(time.time() - started)
+        return latencies, len(pages)
+
+    def check(self, results):
+        latencies = []
+        for result in results:
+            if result.error:
+                raise IOError('Could not convert %s: %s' %
+                              (result.job.visio_filename, result.error))
+            latencies.append(result.elapsed)
+        return latencies, self.pages
+
+
+def print_results(results, stream):
+    """ Prints summaries of results as a table """
+    stream.write(u'%-10s %8s %10s %10s %10s %10s\n' %
+                 ('mode', 'docs', 'docs/sec', 'pages/sec', 'p50 (ms)',
+                  'p95 (ms)'))
+    for result in results:
+        stream.write(u'%-10s %8d %10.2f %10.2f %10.2f %10.2f\n' %
+                     (result['mode'], result['documents'],
+                      result['docs_per_sec'], result['pages_per_sec'],
+                      result['p50'] * 1000, result['p95'] * 1000))
+
+
+def parse_options(args):
+    """ Parses command line options """
+    parser = OptionParser(usage='usage: python -m visio2img.benchmark '
+                                '[options]')
+    parser.add_option('-m', '--mode', action='append',
+                      type='choice', dest='modes', choices=MODES,
+                      help='benchmark to run (default: all of %s)' %
+                           ', '.join(MODES))
+    parser.add_option('-n', '--documents', action='store',
+                      type='int', dest='documents', default=20,
+                      help='number of documents (default: 20)')
+    parser.add_option('-p', '--pages', action='store',
+                      type='int', dest='pages', default=3,
+                      help='pages in each document (default: 3)')
+    parser.add_option('-j', '--jobs', action='store',
+                      type='int', dest='jobs', default=2,
+                      help='processes of parallel mode (default: 2)')
+    parser.add_option('--startup', action='store',
+                      type='float', dest='startup_latency', default=0.5,
+                      help='latency of launching Visio (default: 0.5 sec)')
+    parser.add_option('--open', action='store',
+                      type='float', dest='open_latency', default=0.1,
+                      help='latency of opening document (default: 0.1 sec)')
+    parser.add_option('--export', action='store',
+                      type='float', dest='export_latency', default=0.05,
+                      help='latency of exporting page (default: 0.05 sec)')
+    parser.add_option('--quit', action='store',
+                      type='float', dest='quit_latency', default=0.2,
+                      help='latency of quitting Visio (default: 0.2 sec)')
+    parser.add_option('--json', action='store_true',
+                      dest='json', default=False,
+                      help='print results as JSON')
+    options, argv = parser.parse_args(args)
+
+    if argv:
+        parser.print_usage(sys.stderr)
+        parser.exit()
+
+    if options.documents < 1 or options.pages < 1 or options.jobs < 1:
+        parser.error('--documents, --pages and --jobs must be positive')
+
+    return options
+
+
+def run(args=sys.argv[1:]):
+    """ main function of the benchmark """
+    options = parse_options(args)
+    benchmark = Benchmark(options.documents, options.pages,
+                          options.startup_latency, options.open_latency,
+                          options.export_latency, options.quit_latency,
+                          options.jobs)
+    results = []
+    with benchmark:
+        for mode in options.modes or MODES:
+            results.append(summarize(benchmark.run(mode)))
+
+    if options.json:
+        sys.stdout.write(u'%s\n' % json.dumps(results, sort_keys=True))
+    else:
+        print_results(results, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from visio2img.backends import get_default_backend_name
+from visio2img.output import atomic_output, link_file
+from visio2img.visio2img import make_image_filenames
+
+CACHE_VERSION = '1'
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024  # 1GB
+
+
+def file_digest(filename, chunk_size=64 * 1024):
+    """ Calculates SHA-1 digest of file content """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        while True:
+            chunk = fd.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class ImageCache(object):
+    """ Persistent cache of exported images
+
+    Entries are keyed on the content of visio file, selected page and
+    image format.  Each entry is a directory holding images of the
+    selected pages.  Least recently used entries are evicted when the
+    total size exceeds ``max_bytes``.  Cached images are copied to the
+    output; set ``link`` to hardlink them instead (the output must not be
+    modified in place then).
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE, link=False):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.link = link
+
+    def make_key(self, visio_filename, pagenum, pagename, image_filename,
+                 native=False):
+        """ Makes a cache key for the export """
+        if not os.path.exists(visio_filename):
+            raise IOError('No such visio file: %s' % visio_filename)
+
+        ext = os.path.splitext(image_filename)[1].lower()
+        renderer = get_default_backend_name() or 'visio'
+        if native:
+            renderer = 'native'
+        params = u'%s:%s:%s:%s:%s' % (CACHE_VERSION, pagenum, pagename, ext,
+                                      renderer)
+        digest = hashlib.sha1(params.encode('utf-8'))
+        digest.update(file_digest(visio_filename).encode('ascii'))
+        return digest.hexdigest()
+
+    def get(self, key, image_filename):
+        """ Puts cached images to image_filename; returns True on hit """
+        entry = os.path.join(self.directory, key)
+        try:
+            cached = sorted(os.listdir(entry))
+        except OSError:
+            return False
+
+        filenames = make_image_filenames(image_filename, len(cached))
+        for name, filename in zip(cached, filenames):
+            self._install(os.path.join(entry, name), filename)
+
+        try:
+            os.utime(entry, None)  # mark as recently used
+        except OSError:
+            pass  # evicted by another process
+        return True
+
+    def put(self, key, filenames):
+        """ Stores exported images as an entry """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        workdir = tempfile.mkdtemp(prefix='.%s.' % key, dir=self.directory)
+        try:
+            for i, filename in enumerate(filenames):
+                ext = os.path.splitext(filename)[1]
+                shutil.copyfile(filename,
+                                os.path.join(workdir, '%06d%s' % (i, ext)))
+            os.rename(workdir, os.path.join(self.directory, key))
+        except OSError:
+            # stored by another process concurrently
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        """ Removes least recently used entries over max_bytes """
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            if key.startswith('.'):
+                continue  # entry in progress
+
+            try:
+                entry = os.path.join(self.directory, key)
+                size = sum(os.path.getsize(os.path.join(entry, name))
+                           for name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+                total += size
+            except OSError:
+                pass  # removed by another process
+
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """ Removes all entries """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _install(self, source, filename):
+        if self.link and link_file(source, filename):
+            return
+
+        with atomic_output(filename) as temporary:
+            shutil.copyfile(source, temporary)
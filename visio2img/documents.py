@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import absolute_import
+
+import os
+import threading
+from collections import OrderedDict
+
+from visio2img.pool import get_default_pool
+from visio2img.visio2img import PageIndex, VisioFile
+
+DEFAULT_MAX_DOCUMENTS = 8
+
+
+class CachedDocument(object):
+    """ Visio document kept open by DocumentCache
+
+    It is used like VisioFile, but leaving the ``with`` block does not
+    close the document.  Pages are enumerated only once.
+    """
+    def __init__(self, visio, stamp):
+        self.visio = visio
+        self.stamp = stamp
+        self.pages = list(visio.pages)
+        self.page_index = PageIndex(self.pages,
+                                    [page.Name for page in self.pages])
+        self.broken = False
+
+    @property
+    def app(self):
+        return self.visio.app
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self.broken = True  # reopen it next time
+        return False
+
+    def close(self):
+        self.visio.close()
+
+
+class DocumentCache(object):
+    """ LRU cache of open visio documents
+
+    Documents are keyed on absolute path, mtime and size of the file; a
+    changed file is opened again.  At most ``max_documents`` documents are
+    kept open in an application borrowed from ``pool`` (or the default
+    pool) until ``flush()`` is called.  COM objects can not be shared
+    between threads; use the cache from the thread which made it.
+    """
+    def __init__(self, pool=None, max_documents=DEFAULT_MAX_DOCUMENTS):
+        if max_documents < 1:
+            raise ValueError('max_documents must be positive: %d' %
+                             max_documents)
+
+        self.pool = pool if pool is not None else get_default_pool()
+        self.max_documents = max_documents
+        self.documents = OrderedDict()
+        self.app = None
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+        return False
+
+    def __len__(self):
+        return len(self.documents)
+
+    def open(self, visio_filename):
+        """ Returns CachedDocument of visio file (opens it if needed) """
+        pathname = os.path.abspath(visio_filename)
+        try:
+            stat = os.stat(pathname)
+            stamp = (stat.st_mtime, stat.st_size)
+        except OSError:
+            stamp = None  # VisioFile reports it
+
+        with self.lock:
+            document = self.documents.pop(pathname, None)
+            if document is not None:
+                if document.stamp == stamp and not document.broken:
+                    self.documents[pathname] = document  # most recently used
+                    return document
+                document.close()
+
+            while len(self.documents) >= self.max_documents:
+                self.documents.popitem(last=False)[1].close()
+
+            # documents are opened in the application lent by acquire()
+            document = CachedDocument(VisioFile.Open(pathname, self), stamp)
+            self.documents[pathname] = document
+            return document
+
+    def invalidate(self, visio_filename):
+        """ Closes the document of visio file if it is cached """
+        with self.lock:
+            document = self.documents.pop(os.path.abspath(visio_filename),
+                                          None)
+            if document is not None:
+                document.close()
+
+    def flush(self):
+        """ Closes all documents and gives the application back to the pool """
+        with self.lock:
+            while self.documents:
+                self.documents.popitem(last=False)[1].close()
+            if self.app is not None:
+                app, self.app = self.app, None
+                self.pool.release(app)
+
+    @property
+    def timeout(self):
+        return self.pool.timeout
+
+    def guard(self, app, operation, **attrs):
+        return self.pool.guard(app, operation, **attrs)
+
+    def acquire(self):
+        """ Lends the application to VisioFile (as a pool) """
+        with self.lock:
+            if self.app is None:
+                self.app = self.pool.acquire()
+            return self.app
+
+    def release(self, app, discard=False):
+        """ Takes the application back from VisioFile (as a pool) """
+        with self.lock:
+            if discard and app is self.app:
+                # the application looks broken; drop documents opened in it
+                self.app = None
+                for document in self.documents.values():
+                    document.visio.app = None
+                self.documents.clear()
+                self.pool.release(app, discard=True)
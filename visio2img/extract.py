@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Extraction of text and metadata from .vsdx files (for search indexing)
+
+Each page is described by a record (dict) having the page information and
+the shapes on it: their names, masters, text, hyperlinks and custom
+properties.  Page parts are parsed incrementally, so large drawings can be
+read in flat memory.  Shapes without their own text inherit the text of
+their master shapes.  Visio is not used.
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import zipfile
+from xml.etree import ElementTree
+
+from visio2img.vsdx import REL_NS, is_vsdx, qname, read_pages, read_rels
+
+MASTERS_PART = 'visio/masters/masters.xml'
+SHAPE = qname('Shape')
+TEXT = qname('Text')
+SECTION = qname('Section')
+ROW = qname('Row')
+CELL = qname('Cell')
+
+HYPERLINK_CELLS = {'Address': 'address', 'SubAddress': 'sub_address',
+                   'Description': 'description'}
+
+
+def read_masters(package):
+    """ Returns a dict of master ids to their names """
+    try:
+        masters = ElementTree.fromstring(package.read(MASTERS_PART))
+    except KeyError:
+        return {}  # no masters
+
+    return dict((master.get('ID'), master.get('NameU', master.get('Name')))
+                for master in masters.findall(qname('Master')))
+
+
+class MasterTexts(object):
+    """ Texts of shapes in masters (master parts are read on first use) """
+    def __init__(self, package):
+        self.package = package
+        self.parts = {}  # master id -> part
+        self.texts = {}  # master id -> (text of top-level shape, texts)
+        rels = read_rels(package, MASTERS_PART)
+        try:
+            masters = ElementTree.fromstring(package.read(MASTERS_PART))
+        except KeyError:
+            return  # no masters
+
+        for master in masters.findall(qname('Master')):
+            rel = master.find(qname('Rel'))
+            if rel is not None:
+                self.parts[master.get('ID')] = rels.get(
+                    rel.get(qname('id', REL_NS)))
+
+    def get(self, master_id, shape_id=None):
+        """ Returns the text of master shape (top-level one if not given) """
+        if master_id not in self.texts:
+            top, texts = u'', {}
+            part = self.parts.get(master_id)
+            if part is not None:
+                root = ElementTree.fromstring(self.package.read(part))
+                shapes = root.find(qname('Shapes'))
+                if shapes is not None and shapes.find(SHAPE) is not None:
+                    top = get_text(shapes.find(SHAPE))
+                texts = dict((shape.get('ID'), get_text(shape))
+                             for shape in root.iter(SHAPE))
+            self.texts[master_id] = (top, texts)
+
+        top, texts = self.texts[master_id]
+        if shape_id is None:
+            return top
+        else:
+            return texts.get(shape_id, u'')
+
+
+def get_text(shape):
+    """ Returns the text of shape (fields are included) """
+    text = shape.find(TEXT)
+    if text is None:
+        return u''
+    else:
+        return u''.join(text.itertext()).strip()
+
+
+def read_rows(shape, name):
+    """ Returns rows of the named section as list of (row name, cells) """
+    rows = []
+    for section in shape.findall(SECTION):
+        if section.get('N') != name:
+            continue
+        for row in section.findall(ROW):
+            cells = dict((cell.get('N'), cell.get('V'))
+                         for cell in row.findall(CELL))
+            rows.append((row.get('N'), cells))
+
+    return rows
+
+
+def make_shape_record(shape, master, inherited_text=u''):
+    """ Makes the record of shape element
+
+    ``inherited_text`` is used if the shape does not have its own text.
+    """
+    hyperlinks = []
+    for _, cells in read_rows(shape, 'Hyperlink'):
+        hyperlinks.append(dict((key, cells.get(cell))
+                               for cell, key in HYPERLINK_CELLS.items()))
+
+    properties = {}
+    for row, cells in read_rows(shape, 'Property'):
+        properties[cells.get('Label') or row] = cells.get('Value')
+
+    name_u = shape.get('NameU')
+    return {'id': int(shape.get('ID')),
+            'name': shape.get('Name', name_u),
+            'name_u': name_u,
+            'master': master,
+            'text': (get_text(shape) if shape.find(TEXT) is not None
+                     else inherited_text),
+            'hyperlinks': hyperlinks,
+            'properties': properties}
+
+
+def iter_shapes(stream, masters, master_texts=None):
+    """ Yields records of shapes in a page part (file object)
+
+    Shapes are yielded as soon as they are parsed, so members of a group
+    come before the group.  Parsed elements are discarded, except the
+    children of shapes being parsed.  Texts are inherited from master
+    shapes if ``master_texts`` (MasterTexts) is given.
+    """
+    elements = []  # elements being parsed
+    shape_masters = []  # master ids of shapes being parsed
+    for event, element in ElementTree.iterparse(stream, ('start', 'end')):
+        if event == 'start':
+            elements.append(element)
+            if element.tag == SHAPE:
+                master = element.get('Master')
+                if master is None and shape_masters:
+                    master = shape_masters[-1]  # a shape in an instance
+                shape_masters.append(master)
+            continue
+
+        elements.pop()
+        if element.tag == SHAPE:
+            master_id = shape_masters.pop()
+            text = u''
+            if master_texts is not None and master_id is not None:
+                if element.get('Master') is not None:
+                    text = master_texts.get(master_id)
+                elif element.get('MasterShape') is not None:
+                    text = master_texts.get(master_id,
+                                            element.get('MasterShape'))
+            yield make_shape_record(element, masters.get(master_id), text)
+        elif shape_masters:
+            continue  # a part of the shape being parsed
+
+        element.clear()
+        if elements and len(elements[-1]) and elements[-1][-1] is element:
+            del elements[-1][-1]
+
+
+def iter_records(filename, lazy=False):
+    """ Yields records of pages of .vsdx file
+
+    A record is a dict having ``filename``, ``index``, ``id``, ``name``,
+    ``name_u``, ``width``, ``height`` (in inches), ``background`` and
+    ``shapes``.  Each shape is a dict having ``id``, ``name``, ``name_u``,
+    ``master`` (name of the master), ``text``, ``hyperlinks`` (list of
+    dicts having ``address``, ``sub_address`` and ``description``) and
+    ``properties`` (dict of custom properties).
+
+    If ``lazy`` is true, ``shapes`` is an iterator parsing the page, which
+    should be consumed before the next record.
+    """
+    if not os.path.exists(filename):
+        raise IOError('No such visio file: %s' % filename)
+    if not is_vsdx(filename):
+        msg = 'Extraction supports only .vsdx files: %s'
+        raise IOError(msg % filename)
+
+    def read_shapes(package, part, masters, master_texts):
+        try:
+            with package.open(part) as stream:
+                for shape in iter_shapes(stream, masters, master_texts):
+                    yield shape
+        except (KeyError, zipfile.BadZipfile, ElementTree.ParseError):
+            raise IOError('Could not read visio package: %s' % filename)
+
+    pages = read_pages(filename)
+    try:
+        with zipfile.ZipFile(filename) as package:
+            masters = read_masters(package)
+            master_texts = MasterTexts(package)
+            for page in pages:
+                shapes = iter([])
+                if page.part is not None:
+                    shapes = read_shapes(package, page.part, masters,
+                                         master_texts)
+                if not lazy:
+                    shapes = list(shapes)
+
+                yield {'filename': filename,
+                       'index': page.index,
+                       'id': page.id,
+                       'name': page.name,
+                       'name_u': page.name_u,
+                       'width': page.width,
+                       'height': page.height,
+                       'background': page.background,
+                       'shapes': shapes}
+    except (KeyError, zipfile.BadZipfile, ElementTree.ParseError):
+        raise IOError('Could not read visio package: %s' % filename)
+
+
+def write_record(record, stream):
+    """ Writes a record to stream as a line of JSON
+
+    Shapes are serialized as they are parsed (see iter_records()), and the
+    line is written at once.
+    """
+    shapes = [json.dumps(shape, sort_keys=True) for shape in record['shapes']]
+    page = dict(record, shapes=[])
+    line = json.dumps(page, sort_keys=True).replace(
+        '"shapes": []', '"shapes": [%s]' % ', '.join(shapes), 1)
+    stream.write(line + '\n')
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Incremental export of .vsdx files
+
+Each page of .vsdx file is stored in its own part, so the parts a page
+depends on (the page itself, its masters and media, background pages and
+the theme) tell whether its image is outdated.  Digests of them are kept in
+an index file next to the images.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import io
+import json
+import os
+import zipfile
+from collections import namedtuple
+from xml.etree import ElementTree
+
+from visio2img.backends import get_default_backend_name
+from visio2img.visio2img import (
+    check_output_dir, export_page, filter_pages, make_image_filenames,
+    open_document, select_pages_from_catalog
+)
+from visio2img.vsdx import PAGES_PART, REL_NS, is_vsdx, qname, read_rels
+
+INDEX_VERSION = 1
+DOCUMENT_PART = 'visio/document.xml'
+
+IncrementalResult = namedtuple('IncrementalResult',
+                               'exported unchanged removed')
+
+
+def collect_parts(package, part, parts):
+    """ Adds part and the parts it refers (recursively) to parts """
+    if part in parts or part not in package.namelist():
+        return  # visited, or external link
+
+    parts.add(part)
+    for target in read_rels(package, part).values():
+        collect_parts(package, target, parts)
+
+
+def digest_parts(package, parts, *extra):
+    digest = hashlib.sha1()
+    for value in extra:
+        digest.update(value)
+    for part in sorted(parts):
+        digest.update(part.encode('utf-8') + b'\0')
+        digest.update(hashlib.sha1(package.read(part)).digest())
+    return digest.hexdigest()
+
+
+def read_page_digests(filename):
+    """ Returns digests of pages of .vsdx file (list in the order of pages)
+
+    A digest covers the parts the page depends on: its page part, masters,
+    media, background pages, styles and the theme.
+    """
+    try:
+        with zipfile.ZipFile(filename) as package:
+            pages = ElementTree.fromstring(package.read(PAGES_PART))
+            rels = read_rels(package, PAGES_PART)
+
+            # styles and the theme (other parts like windows.xml are not
+            # related to images)
+            common = set([DOCUMENT_PART])
+            for target in read_rels(package, DOCUMENT_PART).values():
+                if target.startswith('visio/theme/'):
+                    collect_parts(package, target, common)
+
+            parts = {}
+            backpages = {}
+            sheets = {}
+            for page in pages.findall(qname('Page')):
+                page_id = page.get('ID')
+                rel = page.find(qname('Rel'))
+                part = rels.get(rel.get(qname('id', REL_NS)))
+                parts[page_id] = set(common)
+                collect_parts(package, part, parts[page_id])
+                backpages[page_id] = page.get('BackPage')
+                sheets[page_id] = ElementTree.tostring(page)
+
+            digests = []
+            for page in pages.findall(qname('Page')):
+                # the page and its background pages
+                page_ids = []
+                page_id = page.get('ID')
+                while page_id in parts and page_id not in page_ids:
+                    page_ids.append(page_id)
+                    page_id = backpages[page_id]
+
+                depends = set()
+                for page_id in page_ids:
+                    depends.update(parts[page_id])
+                digests.append(digest_parts(
+                    package, depends, *[sheets[i] for i in page_ids]))
+    except (IOError, OSError, KeyError, AttributeError, zipfile.BadZipfile,
+            ElementTree.ParseError):
+        raise IOError('Could not read visio package: %s' % filename)
+
+    return digests
+
+
+def get_index_filename(image_filename):
+    """ Returns the filename of index for image_filename """
+    dirname, basename = os.path.split(image_filename)
+    return os.path.join(dirname, '.%s.visio2img' % basename)
+
+
+def read_index(filename):
+    """ Reads index as a dict of image filename to digest """
+    try:
+        with io.open(filename, encoding='utf-8') as fd:
+            index = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return {}  # not exported yet (or broken)
+
+    if index.get('version') != INDEX_VERSION:
+        return {}
+
+    return index.get('pages', {})
+
+
+def write_index(filename, pages):
+    """ Writes index of image filename to digest """
+    content = json.dumps({'version': INDEX_VERSION, 'pages': pages},
+                         indent=1, sort_keys=True)
+    with io.open(filename, 'w', encoding='utf-8') as fd:
+        fd.write(u'%s\n' % content)
+
+
+def remove_outputs(image_filename):
+    """ Removes images recorded in the index of image_filename (and it)
+
+    Returns list of removed filenames.
+    """
+    image_pathname = os.path.abspath(image_filename)
+    index_filename = get_index_filename(image_pathname)
+    removed = []
+    for name in sorted(read_index(index_filename)):
+        filename = os.path.join(os.path.dirname(image_pathname), name)
+        if os.path.exists(filename):
+            os.remove(filename)
+            removed.append(filename)
+
+    if os.path.exists(index_filename):
+        os.remove(index_filename)
+    return removed
+
+
+def export_incremental(visio_filename, image_filename, pagenum=None,
+                       pagename=None, pool=None, native=False):
+    """ Exports only pages changed from the last export
+
+    Digests of exported pages are kept in an index next to the images; the
+    images of pages whose digest are not changed are left as is, and images
+    of removed pages are deleted.  Pages of files other than .vsdx are
+    always exported.  Returns IncrementalResult (lists of filenames).
+    """
+    image_pathname = check_output_dir(image_filename)
+    index_filename = get_index_filename(image_pathname)
+    ext = os.path.splitext(image_pathname)[1].lower()
+    renderer = 'native' if native else (get_default_backend_name() or 'visio')
+
+    pages = select_pages_from_catalog(visio_filename, pagenum, pagename)
+    if pages is not None and is_vsdx(visio_filename):
+        digests = read_page_digests(visio_filename)
+        indexes = [page.index for page in pages]
+        digests = [hashlib.sha1(u''.join((digests[i - 1], ext, renderer))
+                                .encode('ascii')).hexdigest()
+                   for i in indexes]
+    else:
+        indexes = digests = None  # detected after opening with Visio
+
+    last = read_index(index_filename)
+    current = {}
+    exported = []
+    unchanged = []
+    failed = []
+    if indexes is not None:
+        filenames = make_image_filenames(image_pathname, len(indexes))
+        outdated = []
+        for index, filename, digest in zip(indexes, filenames, digests):
+            name = os.path.basename(filename)
+            if last.get(name) == digest and os.path.exists(filename):
+                current[name] = digest
+                unchanged.append(filename)
+            else:
+                outdated.append((index, filename, digest))
+    else:
+        outdated = None
+
+    if outdated != []:
+        with open_document(visio_filename, pool, native) as visio:
+            if outdated is None:
+                selected = filter_pages(visio.pages, pagenum, pagename)
+                filenames = make_image_filenames(image_pathname,
+                                                 len(selected))
+                outdated = [(page.Index, filename, None)
+                            for page, filename in zip(selected, filenames)]
+
+            for index, filename, digest in outdated:
+                result = export_page(visio.pages[index - 1], filename)
+                if result.error:
+                    failed.append(filename)
+                else:
+                    current[os.path.basename(filename)] = digest
+                    exported.append(filename)
+
+    removed = []
+    for name in sorted(set(last) - set(current)):
+        filename = os.path.join(os.path.dirname(image_pathname), name)
+        if filename not in failed and os.path.exists(filename):
+            os.remove(filename)
+            removed.append(filename)
+
+    write_index(index_filename, current)
+    if failed:
+        raise IOError('Could not write image: %s' % ', '.join(failed))
+
+    return IncrementalResult(exported, unchanged, removed)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Persistent ledger of batch jobs
+
+Jobs are recorded in a SQLite database with their state::
+
+   pending  not converted yet
+   leased   being converted by a worker (until ``lease_timeout`` passes)
+   done     converted; the outputs and their checksums are recorded
+   failed   failed to convert; the error is recorded
+
+Workers lease jobs from the ledger, so several processes (or machines
+sharing the directory) can split a batch, and a restarted batch converts
+only unfinished jobs.  A worker gives its leases back when it stops (see
+run_ledger()), and jobs leased by dead processes of this host are
+reclaimed on start (see reclaim()).  A job leased by a worker crashed on
+another machine is leased again after ``lease_timeout`` seconds.
+
+Jobs are keyed by the visio file, the image file and ``options`` (options
+changing the images, ex. pages and the backend), so the same files
+converted with other options are other jobs.  verify() makes converted
+jobs pending again if their images are removed or changed.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import os
+import socket
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from visio2img.batch import BatchJob, find_outputs
+from visio2img.cache import file_digest
+from visio2img.visio2img import error_message
+
+STATES = ('pending', 'leased', 'done', 'failed')
+DEFAULT_LEASE_TIMEOUT = 600
+
+# Windows API
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+ERROR_ACCESS_DENIED = 5
+STILL_ACTIVE = 259
+
+LeasedJob = namedtuple('LeasedJob', 'id job')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    visio_filename TEXT NOT NULL,
+    image_filename TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    leased_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (visio_filename, image_filename, options)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (options, state, id);
+CREATE TABLE IF NOT EXISTS outputs (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    filename TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (job_id, filename)
+);
+'''
+
+
+def get_worker_name():
+    """ Returns the name of this process (host and process id) """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def is_process_alive(pid):
+    """ Tests the process of this host is running """
+    if os.name == 'nt':
+        # os.kill() terminates the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION,
+                                      False, pid)
+        if not handle:
+            return kernel32.GetLastError() == ERROR_ACCESS_DENIED
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM  # running as another user
+    return True
+
+
+class JobLedger(object):
+    """ Ledger of batch jobs stored in a SQLite database
+
+    Jobs are added and leased under ``options`` (a string describing
+    options changing the images).
+    """
+    def __init__(self, filename, lease_timeout=DEFAULT_LEASE_TIMEOUT,
+                 worker=None, options=''):
+        self.filename = filename
+        self.lease_timeout = lease_timeout
+        self.worker = worker or get_worker_name()
+        self.options = options
+        self.connection = sqlite3.connect(filename, timeout=60,
+                                          isolation_level=None)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """ Runs the block in a transaction locking the database """
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        else:
+            cursor.execute('COMMIT')
+
+    def add(self, jobs):
+        """ Adds jobs; jobs already in the ledger are left as is """
+        with self.transaction() as cursor:
+            cursor.executemany(
+                'INSERT OR IGNORE INTO jobs '
+                '(visio_filename, image_filename, options) VALUES (?, ?, ?)',
+                [(os.path.abspath(job.visio_filename),
+                  os.path.abspath(job.image_filename), self.options)
+                 for job in jobs])
+
+    def jobs(self):
+        """ Returns all jobs in the ledger (under any options) """
+        cursor = self.connection.execute(
+            'SELECT visio_filename, image_filename FROM jobs '
+            'GROUP BY visio_filename, image_filename ORDER BY MIN(id)')
+        return [BatchJob(*row) for row in cursor.fetchall()]
+
+    def lease(self, count=1):
+        """ Leases up to count unfinished jobs; returns list of LeasedJob """
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute(
+                "SELECT id, visio_filename, image_filename FROM jobs "
+                "WHERE options = ? AND (state = 'pending' OR "
+                "(state = 'leased' AND leased_at < ?)) "
+                "ORDER BY id LIMIT ?",
+                (self.options, now - self.lease_timeout, count))
+            leased = [LeasedJob(row[0], BatchJob(row[1], row[2]))
+                      for row in cursor.fetchall()]
+            cursor.executemany(
+                "UPDATE jobs SET state = 'leased', worker = ?, "
+                "leased_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(self.worker, now, entry.id) for entry in leased])
+
+        return leased
+
+    def release(self):
+        """ Makes jobs leased by this worker pending again """
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE jobs SET state = 'pending', worker = NULL, "
+                           "leased_at = NULL "
+                           "WHERE state = 'leased' AND worker = ?",
+                           (self.worker,))
+
+    def reclaim(self):
+        """ Makes jobs leased by dead processes of this host pending again
+
+        Returns names of the dead workers.
+        """
+        host = socket.gethostname()
+        cursor = self.connection.execute(
+            "SELECT DISTINCT worker FROM jobs WHERE state = 'leased'")
+        dead = []
+        for worker, in cursor.fetchall():
+            name, _, pid = (worker or '').rpartition(':')
+            if name != host or not pid.isdigit() or worker == self.worker:
+                continue  # not known to be a process of this host
+            if not is_process_alive(int(pid)):
+                dead.append(worker)
+
+        with self.transaction() as cursor:
+            cursor.executemany("UPDATE jobs SET state = 'pending', "
+                               "worker = NULL, leased_at = NULL "
+                               "WHERE state = 'leased' AND worker = ?",
+                               [(worker,) for worker in dead])
+        return dead
+
+    def done(self, job_id, filenames):
+        """ Records the job is converted to filenames """
+        outputs = [(job_id, os.path.abspath(filename), file_digest(filename))
+                   for filename in filenames]
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE jobs SET state = 'done', worker = NULL, "
+                           "error = NULL WHERE id = ?", (job_id,))
+            cursor.execute('DELETE FROM outputs WHERE job_id = ?', (job_id,))
+            cursor.executemany('INSERT INTO outputs VALUES (?, ?, ?)',
+                               outputs)
+
+    def verify(self):
+        """ Makes jobs pending again if their images are removed or changed
+
+        Returns ids of the jobs.
+        """
+        cursor = self.connection.execute(
+            "SELECT jobs.id, outputs.filename, outputs.checksum "
+            "FROM jobs JOIN outputs ON outputs.job_id = jobs.id "
+            "WHERE jobs.options = ? AND jobs.state = 'done' "
+            "ORDER BY jobs.id", (self.options,))
+        broken = []
+        for job_id, filename, checksum in cursor.fetchall():
+            if broken and broken[-1] == job_id:
+                continue
+            try:
+                if file_digest(filename) == checksum:
+                    continue
+            except (IOError, OSError):
+                pass  # removed
+            broken.append(job_id)
+
+        with self.transaction() as cursor:
+            cursor.executemany("UPDATE jobs SET state = 'pending' "
+                               "WHERE id = ? AND state = 'done'",
+                               [(job_id,) for job_id in broken])
+        return broken
+
+    def fail(self, job_id, error):
+        """ Records the job is failed """
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE jobs SET state = 'failed', worker = NULL, "
+                           "error = ? WHERE id = ?",
+                           (error_message(error), job_id))
+
+    def retry_failed(self):
+        """ Makes failed jobs pending again """
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE jobs SET state = 'pending', error = NULL "
+                           "WHERE options = ? AND state = 'failed'",
+                           (self.options,))
+
+    def counts(self):
+        """ Returns the number of jobs in each state """
+        counts = dict((state, 0) for state in STATES)
+        cursor = self.connection.execute(
+            'SELECT state, COUNT(*) FROM jobs WHERE options = ? '
+            'GROUP BY state', (self.options,))
+        for state, count in cursor.fetchall():
+            counts[state] = count
+        return counts
+
+    def outputs(self, job_id):
+        """ Returns list of (filename, checksum) of the job """
+        cursor = self.connection.execute(
+            'SELECT filename, checksum FROM outputs WHERE job_id = ? '
+            'ORDER BY filename', (job_id,))
+        return cursor.fetchall()
+
+
+def run_ledger(ledger, convert, size=1):
+    """ Converts jobs leased from ledger until no job is left
+
+    ``convert`` takes a list of BatchJob and yields BatchResult for each of
+    them (ex. run_batch()); ``size`` jobs are leased at once.  Results are
+    recorded to the ledger and yielded.  Jobs left leased when the run
+    stops (ex. interrupted, or the generator is closed) are made pending
+    again.
+    """
+    try:
+        while True:
+            leased = ledger.lease(size)
+            if not leased:
+                return
+
+            ids = dict((entry.job, entry.id) for entry in leased)
+            for result in convert([entry.job for entry in leased]):
+                if result.error is None:
+                    ledger.done(ids[result.job],
+                                find_outputs(result.job.image_filename))
+                else:
+                    ledger.fail(ids[result.job], result.error)
+                yield result
+    finally:
+        ledger.release()
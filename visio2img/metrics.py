@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Timing instrumentation
+
+Each phase of conversion is measured as a span::
+
+   launch   launching Visio (Dispatch)
+   open     opening a document (Documents.OpenEx)
+   export   exporting a page (page.Export); with index, name, filename
+            and size of the image
+   close    closing a document
+   quit     quitting Visio
+
+Spans are given to hooks registered by ``add_hook()``; ``Metrics``
+collects them while it is active::
+
+   with Metrics() as metrics:
+       export_img('diagram.vsdx', 'output.png')
+   print(metrics.to_dict())
+"""
+
+from __future__ import absolute_import
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+_hooks = []
+
+
+def add_hook(hook):
+    """ Registers a function called with (phase, elapsed, attrs) of spans """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def record(phase, elapsed, **attrs):
+    """ Gives a measured span to the hooks """
+    for hook in list(_hooks):
+        hook(phase, elapsed, attrs)
+
+
+@contextmanager
+def span(phase, **attrs):
+    """ Measures the block as a span of phase """
+    if not _hooks:
+        yield attrs
+        return
+
+    started = time.time()
+    try:
+        yield attrs  # the block can add attributes
+    finally:
+        record(phase, time.time() - started, **attrs)
+
+
+class Metrics(object):
+    """ Collects spans while it is active (as a context manager) """
+    def __init__(self):
+        self.spans = []
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.started = time.time()
+        add_hook(self)
+        return self
+
+    def __exit__(self, *args):
+        remove_hook(self)
+        self.finished = time.time()
+        return False
+
+    def __call__(self, phase, elapsed, attrs):
+        entry = dict(attrs, phase=phase, elapsed=elapsed)
+        with self.lock:
+            self.spans.append(entry)
+
+    def summary(self):
+        """ Returns count, total and max of elapsed time for each phase """
+        phases = {}
+        with self.lock:
+            for entry in self.spans:
+                phase = phases.setdefault(entry['phase'], {'count': 0,
+                                                           'total': 0.0,
+                                                           'max': 0.0})
+                phase['count'] += 1
+                phase['total'] += entry['elapsed']
+                phase['max'] = max(phase['max'], entry['elapsed'])
+        return phases
+
+    def to_dict(self):
+        with self.lock:
+            spans = list(self.spans)
+        pages = [entry for entry in spans if entry['phase'] == 'export']
+        return {'elapsed': (self.finished or time.time()) - self.started,
+                'phases': self.summary(),
+                'pages': len(pages),
+                'bytes': sum(entry.get('size') or 0 for entry in pages),
+                'spans': spans}
+
+    def write_json(self, stream):
+        """ Writes metrics as a line of JSON """
+        stream.write(u'%s\n' % json.dumps(self.to_dict(), sort_keys=True))
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Output stage of exported images
+
+Images are written to temporary files beside the outputs and renamed to
+them (see atomic_output()), so readers of the outputs never see
+half-written files.  OutputStage recompresses written images losslessly
+and replaces byte-identical images by hard links in a thread pool, and
+counts the bytes saved.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+TEMPORARY_PREFIX = '.visio2img-'
+
+
+def replace_file(source, filename):
+    """ Renames source to filename, replacing filename atomically """
+    if hasattr(os, 'replace'):
+        os.replace(source, filename)
+    else:
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)  # rename() does not replace on Windows
+        os.rename(source, filename)
+
+
+@contextmanager
+def temporary_output(filename):
+    """ Yields a temporary filename beside filename
+
+    The temporary file has the same basename (Visio chooses the format by
+    the extension) in a temporary directory, which is removed after the
+    block.
+    """
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    tmpdir = tempfile.mkdtemp(prefix=TEMPORARY_PREFIX, dir=dirname)
+    try:
+        yield os.path.join(tmpdir, basename)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@contextmanager
+def atomic_output(filename):
+    """ Yields a temporary filename; renamed to filename after the block
+
+    If the block fails, filename is left untouched.
+    """
+    with temporary_output(filename) as temporary:
+        yield temporary
+        if os.path.exists(temporary):
+            replace_file(temporary, filename)
+
+
+def link_file(source, filename):
+    """ Replaces filename by a hard link to source; returns True on success """
+    try:
+        with atomic_output(filename) as temporary:
+            os.link(source, temporary)
+        return True
+    except (AttributeError, OSError):
+        return False  # not supported
+
+
+def find_jpegtran():
+    """ Returns the path of jpegtran command (or None) """
+    which = getattr(shutil, 'which', None)
+    if which is None:
+        from distutils.spawn import find_executable as which
+    return which('jpegtran')
+
+
+def optimize_png(filename, output):
+    """ Writes PNG file optimized by Pillow (pixels are not changed) """
+    from PIL import Image, PngImagePlugin
+
+    with Image.open(filename) as image:
+        options = dict((key, image.info[key])
+                       for key in ('transparency', 'dpi', 'icc_profile')
+                       if key in image.info)
+        texts = getattr(image, 'text', {})
+        if texts:
+            options['pnginfo'] = PngImagePlugin.PngInfo()
+            for key, value in texts.items():
+                options['pnginfo'].add_text(key, value)
+        image.save(output, 'PNG', optimize=True, **options)
+
+
+def optimize_jpeg(filename, output):
+    """ Writes JPEG file optimized by jpegtran (not decoded) """
+    jpegtran = find_jpegtran()
+    if jpegtran is None:
+        raise OSError('jpegtran not found')
+
+    subprocess.check_call([jpegtran, '-copy', 'all', '-optimize',
+                           '-outfile', output, filename])
+
+
+def recompress(filename):
+    """ Recompresses PNG and JPG file losslessly; returns bytes saved
+
+    The file is replaced only when the recompressed one is smaller.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.png':
+        optimize = optimize_png
+    elif ext in ('.jpg', '.jpeg'):
+        optimize = optimize_jpeg
+    else:
+        return 0
+
+    size = os.path.getsize(filename)
+    with temporary_output(filename) as temporary:
+        optimize(filename, temporary)
+        saved = size - os.path.getsize(temporary)
+        if saved <= 0:
+            return 0
+        replace_file(temporary, filename)
+        return saved
+
+
+class OutputStage(object):
+    """ Post-processes written images in a thread pool
+
+    If ``recompress`` is true, PNG files are optimized by Pillow and JPG
+    files by jpegtran (if found); both are lossless.  If ``dedup`` is true,
+    an image byte-identical to an image given before is replaced by a hard
+    link to it.  Outputs are always replaced by rename, so a linked image
+    is never changed through the others.  Failures of post-processing are
+    ignored; the images are left as they are.
+    """
+    def __init__(self, recompress=False, dedup=False, workers=2):
+        from multiprocessing.pool import ThreadPool
+
+        self.recompress = recompress
+        self.dedup = dedup
+        self.workers = ThreadPool(workers)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.digests = {}  # digest -> filename
+        self.files = 0
+        self.recompressed = 0  # bytes saved by recompression
+        self.deduplicated = 0  # bytes saved by hard links
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    @property
+    def saved(self):
+        """ Total bytes saved """
+        return self.recompressed + self.deduplicated
+
+    def add(self, filenames):
+        """ Post-processes written images in background """
+        for filename in filenames:
+            self.pending.append(self.workers.apply_async(self.process,
+                                                         (filename,)))
+
+    def process(self, filename):
+        saved = 0
+        if self.recompress:
+            try:
+                saved = recompress(filename)
+            except Exception:
+                pass  # leave it as is
+
+        with self.lock:
+            self.files += 1
+            self.recompressed += saved
+
+        if self.dedup:
+            try:
+                self.deduplicate(filename)
+            except Exception:
+                pass  # leave it as is
+
+    def deduplicate(self, filename):
+        from visio2img.cache import file_digest
+
+        digest = file_digest(filename)
+        with self.lock:
+            original = self.digests.setdefault(digest, filename)
+
+        if original != filename:
+            size = os.path.getsize(filename)
+            if link_file(original, filename):
+                with self.lock:
+                    self.deduplicated += size
+
+    def wait(self):
+        """ Waits until all images given are processed """
+        pending, self.pending = self.pending, []
+        for result in pending:
+            result.get()
+
+    def close(self):
+        self.wait()
+        self.workers.close()
+        self.workers.join()
+
+    def summary(self):
+        return ('%d bytes saved (recompression: %d, deduplication: %d)' %
+                (self.saved, self.recompressed, self.deduplicated))
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import absolute_import
+
+import multiprocessing
+import multiprocessing.util
+import os
+
+from visio2img.backends import (
+    configure_default_backend, get_default_backend_name
+)
+from visio2img.batch import run_batch
+from visio2img.pool import VisioAppPool
+from visio2img.visio2img import (
+    PageResult, VisioFile, check_output_dir, error_message, export_page,
+    filter_pages, make_image_filenames, make_output_filenames, open_document,
+    record_page, select_pages_from_catalog
+)
+
+# state of a worker process
+_worker_pool = None
+_worker_document = None  # pair of (filename, VisioFile)
+
+
+def _init_worker(dispatch, backend):
+    global _worker_pool
+    configure_default_backend(backend)
+    _worker_pool = VisioAppPool(dispatch=dispatch)
+    multiprocessing.util.Finalize(None, _cleanup_worker, exitpriority=10)
+
+
+def _cleanup_worker():
+    _close_document()
+    _worker_pool.close()
+
+
+def _close_document():
+    global _worker_document
+    if _worker_document:
+        _worker_document[1].close()
+        _worker_document = None
+
+
+def _export_page(task):
+    """ Exports a page in worker; keeps the document open for next pages """
+    global _worker_document
+    visio_filename, index, image_filename, native = task
+    try:
+        if _worker_document is None or _worker_document[0] != visio_filename:
+            _close_document()
+            visio = open_document(visio_filename, _worker_pool, native)
+            _worker_document = (visio_filename, visio)
+
+        page = _worker_document[1].pages[index - 1]
+    except Exception as exc:
+        return PageResult(index, None, image_filename, None, 0, exc)
+
+    result = export_page(page, image_filename)
+    if result.error and not isinstance(result.error, EnvironmentError):
+        # COM errors are not always picklable
+        result = result._replace(error=IOError(error_message(result.error)))
+    return result
+
+
+def _export_document(task):
+    """ Exports a whole document in worker """
+    _close_document()
+    job, pagenum, pagename, cache, native = task
+    return next(run_batch([job], pagenum, pagename, _worker_pool, cache,
+                          native))
+
+
+class ParallelExporter(object):
+    """ Exports pages and documents over worker processes
+
+    Each worker process holds its own Visio application.  ``dispatch`` is
+    given to the VisioAppPool of each worker, so it should be picklable.
+    """
+    def __init__(self, processes=2, dispatch=None):
+        self.processes = processes
+        self.workers = multiprocessing.Pool(processes, _init_worker,
+                                            (dispatch,
+                                             get_default_backend_name()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self):
+        # let workers quit Visio; Pool.terminate() would orphan them
+        self.workers.close()
+        self.workers.join()
+
+    def select_pages(self, visio_filename, pagenum, pagename, pool,
+                     names=True):
+        """ Selects pages from the page catalog (or with Visio in pool)
+
+        If ``names`` is false, names of pages may be None (.vsd file).
+        """
+        pages = select_pages_from_catalog(visio_filename, pagenum, pagename)
+        if pages is not None and \
+                not (names and any(page.name is None for page in pages)):
+            return [(page.index, page.name) for page in pages]
+
+        with VisioFile.Open(visio_filename, pool) as visio:
+            pages = filter_pages(visio.pages, pagenum, pagename)
+            return [(page.Index, page.Name) for page in pages]
+
+    def iter_export(self, visio_filename, image_filename,
+                    pagenum=None, pagename=None, pool=None, native=False):
+        """ Exports pages of a visio file in parallel
+
+        Yields PageResult of each page in the order of completion.
+        """
+        visio_pathname = os.path.abspath(visio_filename)
+        image_pathname = check_output_dir(image_filename)
+        # names are required only by templates of filenames
+        names = '{' in os.path.basename(image_pathname)
+        pages = self.select_pages(visio_pathname, pagenum, pagename, pool,
+                                  names)
+        filenames = make_output_filenames(image_pathname, pages)
+        tasks = [(visio_pathname, index, filename, native)
+                 for (index, _), filename in zip(pages, filenames)]
+        for result in self.workers.imap_unordered(_export_page, tasks):
+            record_page(result)  # measured in the worker
+            yield result
+
+    def export_img(self, visio_filename, image_filename,
+                   pagenum=None, pagename=None, pool=None, cache=None,
+                   native=False):
+        """ Exports pages of a visio file in parallel
+
+        Pages are selected from the page catalog (or with Visio borrowed
+        from ``pool`` in this process), and then exported by workers.
+        """
+        visio_pathname = os.path.abspath(visio_filename)
+        image_pathname = check_output_dir(image_filename)
+
+        if cache is not None:
+            key = cache.make_key(visio_pathname, pagenum, pagename,
+                                 image_pathname, native)
+            if cache.get(key, image_pathname):
+                return
+
+        pages = self.select_pages(visio_pathname, pagenum, pagename, pool,
+                                  names=False)
+        filenames = make_image_filenames(image_pathname, len(pages))
+        tasks = [(visio_pathname, index, filename, native)
+                 for (index, _), filename in zip(pages, filenames)]
+        results = list(self.workers.imap_unordered(_export_page, tasks))
+        for result in results:
+            record_page(result)  # measured in the worker
+        if any(result.error for result in results):
+            raise IOError('Could not write image: %s' % image_pathname)
+
+        if cache is not None:
+            cache.put(key, filenames)
+
+    def run_batch(self, jobs, pagenum=None, pagename=None, cache=None,
+                  native=False):
+        """ Converts jobs in parallel and yields BatchResult in order """
+        tasks = [(job, pagenum, pagename, cache, native) for job in jobs]
+        for result in self.workers.imap(_export_document, tasks):
+            yield result
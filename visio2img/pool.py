@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import absolute_import
+
+import atexit
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from visio2img import metrics
+
+
+def dispatch_visio():
+    """ Launches a new invisible Visio application """
+    try:
+        import win32com.client
+        return win32com.client.Dispatch('Visio.InvisibleApp')
+    except Exception:
+        msg = 'Visio not found. visio2img requires Visio.'
+        raise OSError(msg)
+
+
+def terminate_process(pid):
+    """ Kills the process of Visio (requires pywin32) """
+    import win32api
+    import win32con
+
+    handle = win32api.OpenProcess(win32con.PROCESS_TERMINATE, False, pid)
+    try:
+        win32api.TerminateProcess(handle, 1)
+    finally:
+        win32api.CloseHandle(handle)
+
+
+def get_memory_usage(pid):
+    """ Returns resident memory (working set) of the process in bytes """
+    import win32api
+    import win32con
+    import win32process
+
+    flags = win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ
+    handle = win32api.OpenProcess(flags, False, pid)
+    try:
+        return win32process.GetProcessMemoryInfo(handle)['WorkingSetSize']
+    finally:
+        win32api.CloseHandle(handle)
+
+
+class VisioTimeout(OSError):
+    """ Raised when Visio did not respond in time (and it was killed) """
+
+
+class Watchdog(object):
+    """ Calls functions when their deadlines pass (on its own thread) """
+    def __init__(self):
+        self.timers = []
+        self.counter = itertools.count()
+        self.cancelled = set()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def schedule(self, timeout, function, *args):
+        """ Calls function(*args) after timeout; returns a token to cancel """
+        with self.condition:
+            token = next(self.counter)
+            heapq.heappush(self.timers,
+                           (time.time() + timeout, token, function, args))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+            return token
+
+    def cancel(self, token):
+        with self.condition:
+            if any(timer[1] == token for timer in self.timers):
+                self.cancelled.add(token)
+
+    def stop(self):
+        """ Stops the thread; functions not called yet are dropped """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(1)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.timers and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+
+                deadline, token, function, args = self.timers[0]
+                if token in self.cancelled:
+                    heapq.heappop(self.timers)
+                    self.cancelled.discard(token)
+                    continue
+                elif deadline > time.time():
+                    self.condition.wait(deadline - time.time())
+                    continue
+
+                heapq.heappop(self.timers)
+
+            function(*args)
+
+
+_watchdog = Watchdog()
+atexit.register(_watchdog.stop)  # before the interpreter tears modules down
+
+
+def initialize_com():
+    """ Initializes COM for the current thread (if pywin32 is available) """
+    try:
+        import pythoncom
+        pythoncom.CoInitialize()
+    except ImportError:
+        pass
+
+
+def uninitialize_com():
+    try:
+        import pythoncom
+        pythoncom.CoUninitialize()
+    except ImportError:
+        pass
+
+
+class PooledApp(object):
+    """ Bookkeeping of an application instance owned by VisioAppPool """
+    def __init__(self, app):
+        self.app = app
+        self.documents = 0
+        self.last_used = time.time()
+        self.killed = False
+        self.reaper = None  # token of the watchdog quitting it when idle
+        try:
+            self.pid = app.ProcessID
+        except Exception:
+            self.pid = None  # the application can not be killed
+
+
+class VisioAppPool(object):
+    """ Pool of warm Visio applications
+
+    Applications are borrowed with ``acquire()`` and given back with
+    ``release()``.  An application is quit when it has been idle longer
+    than ``idle_timeout`` seconds, has served ``max_documents`` documents
+    or uses more than ``max_memory`` bytes of resident memory.  Idle
+    applications are quit by the watchdog thread even if the pool is not
+    used again (they are killed if COM refuses calls from that thread);
+    their COM objects are dropped on the next use of the pool, because COM
+    objects must be released from the thread using them.
+
+    If ``timeout`` is given, an operation guarded by ``guard()`` (opening a
+    document or exporting a page) taking longer than ``timeout`` seconds
+    kills the application, and VisioTimeout is raised.  Processes are
+    killed by ``terminate(pid)`` and measured by ``memory_usage(pid)``;
+    they are taken from ``dispatch`` if it has them (ex. FakeDispatcher).
+    Quitting and killing are reported to metrics as ``quit`` spans with
+    ``reason`` and ``timeout`` spans.
+    """
+    def __init__(self, size=1, idle_timeout=300, max_documents=100,
+                 dispatch=None, timeout=None, max_memory=None,
+                 terminate=None, memory_usage=None):
+        if size < 1:
+            raise ValueError('Pool size must be positive: %d' % size)
+
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_documents = max_documents
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.dispatch = dispatch or dispatch_visio
+        self.terminate = (terminate or getattr(self.dispatch, 'terminate',
+                                               None) or terminate_process)
+        self.memory_usage = (memory_usage or getattr(
+            self.dispatch, 'memory_usage', None) or get_memory_usage)
+        self.idle = []
+        self.expired = []  # quit by the watchdog; dropped on the next use
+        self.busy = {}
+        self.launching = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def __len__(self):
+        with self.condition:
+            return len(self.idle) + len(self.busy) + self.launching
+
+    def acquire(self, timeout=None):
+        """ Borrows an application from the pool """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            self._reap()
+            while True:
+                if self.closed:
+                    raise OSError('Visio application pool is closed')
+                elif self.idle:
+                    entry = self.idle.pop()  # most recently used one
+                    _watchdog.cancel(entry.reaper)
+                    self.busy[id(entry.app)] = entry
+                    return entry.app
+                elif len(self.busy) + self.launching < self.size:
+                    self.launching += 1
+                    break
+                else:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise OSError('No Visio application available')
+                    self.condition.wait(remaining)
+
+        try:
+            with metrics.span('launch'):
+                entry = PooledApp(self.dispatch())
+        except Exception:
+            with self.condition:
+                self.launching -= 1
+                self.condition.notify()
+            raise
+
+        with self.condition:
+            self.launching -= 1
+            self.busy[id(entry.app)] = entry
+            return entry.app
+
+    def release(self, app, discard=False):
+        """ Returns an application to the pool
+
+        The application is quit instead when ``discard`` is given (ex. it
+        looks broken) or it has reached ``max_documents`` or ``max_memory``.
+        """
+        with self.condition:
+            entry = self.busy.pop(id(app), None)
+            if entry is None:
+                raise ValueError('Application does not belong to the pool')
+
+            entry.documents += 1
+            entry.last_used = time.time()
+            reason = self._get_quit_reason(entry, discard)
+            if reason:
+                self._quit(entry, reason)
+            else:
+                self.idle.append(entry)
+                if self.idle_timeout:
+                    entry.reaper = _watchdog.schedule(self.idle_timeout,
+                                                      self._expire, entry)
+            self._reap()
+            self.condition.notify()
+
+    def _get_quit_reason(self, entry, discard):
+        if entry.killed:
+            return 'timeout'
+        elif discard:
+            return 'discard'
+        elif self.closed:
+            return 'close'
+        elif self.max_documents and entry.documents >= self.max_documents:
+            return 'documents'
+        elif self.max_memory and entry.pid is not None:
+            try:
+                if self.memory_usage(entry.pid) > self.max_memory:
+                    return 'memory'
+            except Exception:
+                pass  # not measurable
+
+        return None
+
+    @contextmanager
+    def guard(self, app, operation, **attrs):
+        """ Kills the application if the block does not finish in time """
+        if not self.timeout:
+            yield
+            return
+
+        with self.condition:
+            entry = self.busy.get(id(app))
+        if entry is None:
+            yield
+            return
+
+        started = time.time()
+        token = _watchdog.schedule(self.timeout, self._kill, entry,
+                                   operation, started, attrs)
+        try:
+            yield
+        except Exception:
+            if entry.killed:
+                raise VisioTimeout('Visio did not respond in %s seconds: %s' %
+                                   (self.timeout, operation))
+            raise
+        finally:
+            _watchdog.cancel(token)
+
+        if entry.killed:
+            raise VisioTimeout('Visio did not respond in %s seconds: %s' %
+                               (self.timeout, operation))
+
+    def _kill(self, entry, operation, started, attrs):
+        entry.killed = True
+        metrics.record('timeout', time.time() - started, operation=operation,
+                       **attrs)
+        if entry.pid is not None:
+            try:
+                self.terminate(entry.pid)
+            except Exception:
+                pass  # already gone
+
+    def reap(self):
+        """ Quits applications idle longer than idle_timeout """
+        with self.condition:
+            self._reap()
+
+    def close(self):
+        """ Quits all idle applications; busy ones are quit on release """
+        with self.condition:
+            self.closed = True
+            del self.expired[:]
+            while self.idle:
+                self._quit(self.idle.pop(), 'close')
+            self.condition.notify_all()
+
+    def _reap(self):
+        del self.expired[:]
+        if self.idle_timeout is None:
+            return
+
+        now = time.time()
+        for entry in list(self.idle):
+            if now - entry.last_used >= self.idle_timeout:
+                self.idle.remove(entry)
+                self._quit(entry, 'idle')
+
+    def _expire(self, entry):
+        """ Quits the application left idle (on the watchdog thread) """
+        with self.condition:
+            if entry not in self.idle:
+                return  # borrowed or quit in the meantime
+            self.idle.remove(entry)
+            self.expired.append(entry)
+
+        try:
+            with metrics.span('quit', reason='idle'):
+                entry.app.Quit()
+        except Exception:
+            # the application belongs to another apartment of COM
+            if entry.pid is not None:
+                try:
+                    self.terminate(entry.pid)
+                except Exception:
+                    pass  # already gone
+
+    def _quit(self, entry, reason):
+        try:
+            with metrics.span('quit', reason=reason):
+                if not entry.killed:
+                    entry.app.Quit()
+        except Exception:
+            pass  # application has already gone
+
+
+_default_pool = None
+_default_options = {}
+
+
+def configure_default_pool(**options):
+    """ Sets options of VisioAppPool for the default pool (ex. timeout) """
+    global _default_pool, _default_options
+    _default_options = options
+    if _default_pool is not None:
+        _default_pool.close()
+        _default_pool = None
+
+
+def get_default_pool():
+    """ Returns the process wide pool used when no pool is given """
+    global _default_pool
+    if _default_pool is None or _default_pool.closed:
+        _default_pool = VisioAppPool(**_default_options)
+        atexit.register(_default_pool.close)
+    return _default_pool
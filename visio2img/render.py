@@ -0,0 +1,838 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Native renderer of .vsdx files
+
+``NativeFile`` has the same interface as ``VisioFile``, but draws pages to
+SVG in pure Python (without Windows and Visio).  Raster images are made from
+the SVG with cairosvg (PNG) and Pillow (GIF and JPG) if they are installed.
+
+Supported: geometry sections (lines, arcs, elliptical arcs, ellipses,
+béziers and polylines), masters, stylesheets, theme colors, groups,
+background pages and plain text.  Unsupported: gradients, shadows,
+effects, arrows, text formatting and evaluation of formulas (cached values
+in the file are used).
+"""
+
+from __future__ import absolute_import
+
+import io
+import os
+import zipfile
+from math import atan2, cos, degrees, hypot, pi, sin
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+from visio2img import metrics
+from visio2img.vsdx import (
+    PAGES_PART, REL_NS, is_vsdx, qname, read_pages, read_rels
+)
+
+DRAWINGML_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+DPI = 96
+EPSILON = 1e-9
+
+# Visio's built-in color palette (index 0 to 23)
+PALETTE = [
+    '#000000', '#FFFFFF', '#FF0000', '#00FF00', '#0000FF', '#FFFF00',
+    '#FF00FF', '#00FFFF', '#800000', '#008000', '#000080', '#808000',
+    '#800080', '#008080', '#C0C0C0', '#E6E6E6', '#CDCDCD', '#B3B3B3',
+    '#9A9A9A', '#808080', '#666666', '#4D4D4D', '#333333', '#1A1A1A',
+]
+
+LINE_CELLS = ('LineWeight', 'LineColor', 'LinePattern', 'LineCap',
+              'Rounding')
+FILL_CELLS = ('FillForegnd', 'FillBkgnd', 'FillPattern')
+
+IDENTITY = (1, 0, 0, 1, 0, 0)
+
+
+def multiply(m1, m2):
+    """ Multiplies two affine matrices in SVG order (a b c d e f) """
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (a1 * a2 + c1 * b2, b1 * a2 + d1 * b2,
+            a1 * c2 + c1 * d2, b1 * c2 + d1 * d2,
+            a1 * e2 + c1 * f2 + e1, b1 * e2 + d1 * f2 + f1)
+
+
+def transform(matrix, x, y):
+    a, b, c, d, e, f = matrix
+    return a * x + c * y + e, b * x + d * y + f
+
+
+def to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def fmt(value):
+    return ('%.6f' % value).rstrip('0').rstrip('.') or '0'
+
+
+def shade(color, ratio):
+    """ Makes color darker by ratio """
+    rgb = [int(color[i:i + 2], 16) for i in (1, 3, 5)]
+    return '#%02X%02X%02X' % tuple(int(c * ratio) for c in rgb)
+
+
+def circle_arc(p0, p1, p2):
+    """ Returns (center, radius, sweep, large_arc) of the arc p0-p1-p2
+
+    sweep is True for counterclockwise arcs; returns None if the points
+    are on a line.
+    """
+    (x0, y0), (x1, y1), (x2, y2) = p0, p1, p2
+    det = 2 * (x0 * (y1 - y2) + x1 * (y2 - y0) + x2 * (y0 - y1))
+    if abs(det) < EPSILON:
+        return None
+
+    s0, s1, s2 = x0 * x0 + y0 * y0, x1 * x1 + y1 * y1, x2 * x2 + y2 * y2
+    cx = (s0 * (y1 - y2) + s1 * (y2 - y0) + s2 * (y0 - y1)) / det
+    cy = (s0 * (x2 - x1) + s1 * (x0 - x2) + s2 * (x1 - x0)) / det
+    radius = hypot(x0 - cx, y0 - cy)
+
+    sweep = (x1 - x0) * (y2 - y0) - (y1 - y0) * (x2 - x0) > 0
+    start = atan2(y0 - cy, x0 - cx)
+    end = atan2(y2 - cy, x2 - cx)
+    if sweep:
+        span = (end - start) % (2 * pi)
+    else:
+        span = (start - end) % (2 * pi)
+    return (cx, cy), radius, sweep, span > pi
+
+
+class Path(object):
+    """ Builder of SVG path data in shape local coordinates """
+    def __init__(self):
+        self.commands = []
+        self.points = []
+        self.start = None
+        self.current = (0.0, 0.0)
+        self.closed = True
+
+    def __bool__(self):
+        return bool(self.commands)
+
+    __nonzero__ = __bool__  # for python2
+
+    def _add(self, command, *points):
+        self.commands.append(command)
+        self.points.extend(points)
+
+    def move_to(self, x, y):
+        self._close_subpath()
+        self.start = self.current = (x, y)
+        self._add('M %s %s' % (fmt(x), fmt(y)), (x, y))
+
+    def line_to(self, x, y):
+        self.current = (x, y)
+        self._add('L %s %s' % (fmt(x), fmt(y)), (x, y))
+
+    def curve_to(self, x1, y1, x2, y2, x, y):
+        self.current = (x, y)
+        values = tuple(fmt(v) for v in (x1, y1, x2, y2, x, y))
+        self._add('C %s %s %s %s %s %s' % values, (x1, y1), (x2, y2), (x, y))
+
+    def quad_to(self, x1, y1, x, y):
+        self.current = (x, y)
+        self._add('Q %s %s %s %s' % tuple(map(fmt, (x1, y1, x, y))),
+                  (x1, y1), (x, y))
+
+    def elliptical_arc_to(self, x, y, a, b, angle, ratio):
+        """ Draws an arc through (a, b) of the ellipse with major axis at
+        angle and ratio of major/minor axes (EllipticalArcTo row) """
+        if abs(ratio) < EPSILON:
+            return self.line_to(x, y)
+
+        def to_circle(px, py):
+            rx = px * cos(-angle) - py * sin(-angle)
+            ry = px * sin(-angle) + py * cos(-angle)
+            return rx / ratio, ry
+
+        arc = circle_arc(to_circle(*self.current), to_circle(a, b),
+                         to_circle(x, y))
+        if arc is None:
+            return self.line_to(x, y)
+
+        _, radius, sweep, large = arc
+        self.current = (x, y)
+        self._add('A %s %s %s %d %d %s %s' % (fmt(radius * abs(ratio)),
+                                              fmt(radius),
+                                              fmt(degrees(angle)),
+                                              large, sweep, fmt(x), fmt(y)),
+                  (a, b), (x, y))
+
+    def arc_to(self, x, y, bow):
+        """ Draws a circular arc bulging by bow (ArcTo row) """
+        x0, y0 = self.current
+        chord = hypot(x - x0, y - y0)
+        if abs(bow) < EPSILON or chord < EPSILON:
+            return self.line_to(x, y)
+
+        # positive bow is counterclockwise; the arc bulges to the right
+        ux, uy = (x - x0) / chord, (y - y0) / chord
+        mid = ((x0 + x) / 2 + bow * uy, (y0 + y) / 2 - bow * ux)
+        self.elliptical_arc_to(x, y, mid[0], mid[1], 0, 1)
+
+    def ellipse(self, cx, cy, ax, ay, bx, by):
+        """ Draws an ellipse with points on its major/minor axes """
+        self._close_subpath()
+        rx = hypot(ax - cx, ay - cy)
+        ry = hypot(bx - cx, by - cy)
+        angle = degrees(atan2(ay - cy, ax - cx))
+        x0, y0 = 2 * cx - ax, 2 * cy - ay
+        arc = 'A %s %s %s 0 1' % (fmt(rx), fmt(ry), fmt(angle))
+        self._add('M %s %s %s %s %s %s %s %s Z' %
+                  (fmt(ax), fmt(ay), arc, fmt(x0), fmt(y0),
+                   arc, fmt(ax), fmt(ay)),
+                  (ax, ay), (x0, y0), (bx, by), (2 * cx - bx, 2 * cy - by))
+        self.current = (ax, ay)
+
+    def close(self):
+        self._close_subpath()
+
+    def _close_subpath(self):
+        if self.start is None:
+            return
+
+        if all(abs(current - start) < 1e-6
+               for current, start in zip(self.current, self.start)):
+            self.commands.append('Z')
+        else:
+            self.closed = False  # Visio does not fill open paths
+        self.start = None
+
+    @property
+    def data(self):
+        return ' '.join(self.commands)
+
+
+class Section(object):
+    """ Geometry section merged with the one of master """
+    def __init__(self, cells=None, rows=None):
+        self.cells = cells or {}
+        self.rows = rows or {}  # IX => (type, cells)
+
+    @classmethod
+    def parse(cls, element):
+        section = cls(read_cells(element))
+        for row in element.findall(qname('Row')):
+            if row.get('Del') == '1':
+                section.rows[row.get('IX')] = None
+            else:
+                section.rows[row.get('IX')] = (row.get('T'), read_cells(row))
+        return section
+
+    def merge(self, base):
+        """ Returns a new section inheriting base """
+        cells = dict(base.cells)
+        cells.update(self.cells)
+        rows = dict(base.rows)
+        for ix, row in self.rows.items():
+            if row is None:
+                rows.pop(ix, None)
+            elif rows.get(ix) is not None:
+                kind = row[0] or rows[ix][0]
+                rows[ix] = (kind, dict(rows[ix][1], **row[1]))
+            else:
+                rows[ix] = row
+        return Section(cells, rows)
+
+    def iter_rows(self):
+        for ix in sorted(self.rows, key=lambda ix: int(ix or 0)):
+            if self.rows[ix] is not None:
+                yield self.rows[ix]
+
+
+def read_cells(element):
+    return dict((cell.get('N'), cell.get('V'))
+                for cell in element.findall(qname('Cell')))
+
+
+class Shape(object):
+    def __init__(self, element, master=None):
+        self.id = element.get('ID')
+        self.type = element.get('Type')
+        self.styles = {'line': element.get('LineStyle'),
+                       'fill': element.get('FillStyle'),
+                       'text': element.get('TextStyle')}
+        self.cells = read_cells(element)
+        self.character = {}
+        self.geometry = {}
+        self.deleted_geometry = set()
+        self.master = master
+        self.children = []
+
+        for section in element.findall(qname('Section')):
+            name = section.get('N')
+            if name == 'Geometry':
+                if section.get('Del') == '1':
+                    self.deleted_geometry.add(section.get('IX'))
+                else:
+                    self.geometry[section.get('IX')] = Section.parse(section)
+            elif name == 'Character':
+                row = section.find(qname('Row'))
+                if row is not None:
+                    self.character = read_cells(row)
+
+        text = element.find(qname('Text'))
+        if text is None:
+            self.text = None
+        else:
+            self.text = ''.join(text.itertext()).strip()
+
+    def cell(self, name):
+        """ Returns the value of cell (inherited from master) """
+        if name in self.cells:
+            return self.cells[name]
+        elif self.master is not None:
+            return self.master.cell(name)
+        else:
+            return None
+
+    def style(self, kind):
+        if self.styles[kind] is not None:
+            return self.styles[kind]
+        elif self.master is not None:
+            return self.master.style(kind)
+        else:
+            return None
+
+    def char(self, name):
+        if name in self.character:
+            return self.character[name]
+        elif self.master is not None:
+            return self.master.char(name)
+        else:
+            return None
+
+    def get_text(self):
+        if self.text is not None:
+            return self.text
+        elif self.master is not None:
+            return self.master.get_text()
+        else:
+            return None
+
+    def sections(self):
+        """ Returns geometry sections merged with master """
+        if self.master is not None:
+            sections = self.master.sections()
+        else:
+            sections = {}
+
+        for ix in self.deleted_geometry:
+            sections.pop(ix, None)
+        for ix, section in self.geometry.items():
+            if ix in sections:
+                sections[ix] = section.merge(sections[ix])
+            else:
+                sections[ix] = section
+        return sections
+
+    def get_children(self):
+        if self.children or self.master is None:
+            return self.children
+        else:
+            return self.master.get_children()
+
+
+class NativeFile(object):
+    """ Visio file rendered by visio2img itself (.vsdx only) """
+    @classmethod
+    def Open(cls, filename):
+        obj = cls()
+        obj.open(filename)
+        return obj
+
+    def __init__(self):
+        self.package = None
+        self.filename = None
+        self.pages = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def open(self, filename):
+        assert self.package is None
+
+        if not os.path.exists(filename):
+            raise IOError('No such visio file: %s' % filename)
+        if not is_vsdx(filename):
+            msg = 'Native renderer supports only .vsdx files: %s'
+            raise IOError(msg % filename)
+
+        self.filename = filename
+        self.package = zipfile.ZipFile(filename)
+        try:
+            with metrics.span('open', filename=filename):
+                self.load_document()
+                self.pages = [NativePage(self, info)
+                              for info in read_pages(filename)]
+        except Exception:
+            self.close()
+            raise IOError('Could not open file: %s' % filename)
+
+    def close(self):
+        if self.package:
+            self.package.close()
+            self.package = None
+        self.pages = []
+
+    def read_xml(self, part):
+        return ElementTree.fromstring(self.package.read(part))
+
+    def load_document(self):
+        document = self.read_xml('visio/document.xml')
+        self.colors = list(PALETTE)
+        for entry in document.iter(qname('ColorEntry')):
+            index = int(entry.get('IX'))
+            while len(self.colors) <= index:
+                self.colors.append('#000000')
+            self.colors[index] = entry.get('RGB')
+
+        self.stylesheets = {}
+        for sheet in document.iter(qname('StyleSheet')):
+            self.stylesheets[sheet.get('ID')] = Shape(sheet)
+
+        self.theme = {'dk1': '#000000', 'lt1': '#FFFFFF',
+                      'accent1': '#5B9BD5'}
+        for target in read_rels(self.package, 'visio/document.xml').values():
+            if target.startswith('visio/theme/'):
+                self.load_theme(target)
+                break
+
+        self.masters = {}
+        rels = read_rels(self.package, 'visio/masters/masters.xml')
+        try:
+            masters = self.read_xml('visio/masters/masters.xml')
+        except KeyError:
+            masters = None  # no masters
+        if masters is not None:
+            for master in masters.findall(qname('Master')):
+                rel = master.find(qname('Rel'))
+                part = rels.get(rel.get(qname('id', REL_NS)))
+                self.masters[master.get('ID')] = part
+
+        self.master_shapes = {}
+        self.backpages = {}
+        pages = self.read_xml(PAGES_PART)
+        rels = read_rels(self.package, PAGES_PART)
+        parts = {}
+        for page in pages.findall(qname('Page')):
+            rel = page.find(qname('Rel'))
+            parts[page.get('ID')] = rels.get(rel.get(qname('id', REL_NS)))
+            self.backpages[page.get('ID')] = page.get('BackPage')
+        self.page_parts = parts
+
+    def load_theme(self, part):
+        theme = self.read_xml(part)
+        scheme = theme.find('.//{%s}clrScheme' % DRAWINGML_NS)
+        if scheme is None:
+            return
+
+        for entry in scheme:
+            name = entry.tag.split('}')[-1]
+            color = entry.find('{%s}srgbClr' % DRAWINGML_NS)
+            if color is None:
+                color = entry.find('{%s}sysClr' % DRAWINGML_NS)
+                value = None if color is None else color.get('lastClr')
+            else:
+                value = color.get('val')
+            if value:
+                self.theme[name] = '#' + value.upper()
+
+    def get_master_shapes(self, master_id):
+        """ Returns top-level shapes and all shapes (by ID) of master """
+        if master_id not in self.master_shapes:
+            part = self.masters.get(master_id)
+            if part is None:
+                self.master_shapes[master_id] = ([], {})
+            else:
+                shapes = {}
+                root = self.read_xml(part)
+                top = self.parse_shapes(root.find(qname('Shapes')),
+                                        None, shapes)
+                self.master_shapes[master_id] = (top, shapes)
+
+        return self.master_shapes[master_id]
+
+    def parse_shapes(self, element, master_id, registry=None):
+        """ Parses Shapes element into list of Shape """
+        shapes = []
+        if element is None:
+            return shapes
+
+        for child in element.findall(qname('Shape')):
+            master = None
+            child_master_id = child.get('Master', master_id)
+            if child.get('Master') is not None:
+                top, _ = self.get_master_shapes(child.get('Master'))
+                if top:
+                    master = top[0]
+            elif child.get('MasterShape') is not None and master_id:
+                _, all_shapes = self.get_master_shapes(master_id)
+                master = all_shapes.get(child.get('MasterShape'))
+
+            shape = Shape(child, master)
+            shape.children = self.parse_shapes(child.find(qname('Shapes')),
+                                               child_master_id, registry)
+            if registry is not None:
+                registry[shape.id] = shape
+            shapes.append(shape)
+
+        return shapes
+
+    def resolve(self, shape, name):
+        """ Returns the value of cell of shape (inherited from styles) """
+        value = shape.cell(name)
+        if value is not None:
+            return value
+
+        if name in LINE_CELLS:
+            kind = 'line'
+        elif name in FILL_CELLS:
+            kind = 'fill'
+        else:
+            kind = 'text'
+
+        style_id = shape.style(kind)
+        visited = set()
+        while style_id is not None and style_id not in visited:
+            visited.add(style_id)
+            style = self.stylesheets.get(style_id)
+            if style is None:
+                break
+            if name in style.cells:
+                return style.cells[name]
+            style_id = style.styles[kind]
+
+        return None
+
+    def resolve_char(self, shape, name):
+        value = shape.char(name)
+        style_id = shape.style('text')
+        visited = set()
+        while value is None and style_id is not None:
+            if style_id in visited or style_id not in self.stylesheets:
+                break
+            visited.add(style_id)
+            style = self.stylesheets[style_id]
+            value = style.character.get(name)
+            style_id = style.styles['text']
+        return value
+
+    def color(self, value, themed):
+        if value is None:
+            return None
+        elif value.startswith('#'):
+            return value
+        elif value == 'Themed':
+            return themed
+
+        try:
+            return self.colors[int(float(value))]
+        except (ValueError, IndexError):
+            return themed
+
+
+class NativePage(object):
+    def __init__(self, document, info):
+        self.document = document
+        self.info = info
+        self.Index = info.index
+        self.Name = info.name
+
+    @property
+    def name(self):
+        return self.Name
+
+    def Export(self, filename):
+        """ Exports the page; the format is chosen by extension """
+        ext = os.path.splitext(filename)[1].lower()
+        svg = self.render_svg()
+        if ext == '.svg':
+            with io.open(filename, 'w', encoding='utf-8') as fd:
+                fd.write(svg)
+        else:
+            rasterize(svg, filename)
+
+    def load_shapes(self, page_id):
+        part = self.document.page_parts.get(page_id)
+        if part is None:
+            return []
+        root = self.document.read_xml(part)
+        return self.document.parse_shapes(root.find(qname('Shapes')), None)
+
+    def render_svg(self):
+        """ Renders the page to SVG; the image is cropped to the drawing """
+        doc = self.document
+        pages = []
+        page_id = str(self.info.id)
+        while page_id is not None and page_id not in pages:
+            pages.insert(0, page_id)
+            page_id = doc.backpages.get(page_id)
+
+        renderer = SVGRenderer(doc)
+        for page_id in pages:
+            for shape in self.load_shapes(page_id):
+                renderer.draw_shape(shape, IDENTITY)
+
+        if renderer.bounds is None:
+            # empty page: render whole of the page
+            renderer.extend_bounds(0, 0)
+            renderer.extend_bounds(self.info.width or 0,
+                                   self.info.height or 0)
+        return renderer.to_svg()
+
+
+class SVGRenderer(object):
+    def __init__(self, document):
+        self.document = document
+        self.paths = []
+        self.texts = []
+        self.bounds = None
+        self.margin = 0
+
+    def extend_bounds(self, x, y):
+        if self.bounds is None:
+            self.bounds = [x, y, x, y]
+        else:
+            self.bounds = [min(self.bounds[0], x), min(self.bounds[1], y),
+                           max(self.bounds[2], x), max(self.bounds[3], y)]
+
+    def draw_shape(self, shape, parent):
+        doc = self.document
+        width = to_float(shape.cell('Width'))
+        height = to_float(shape.cell('Height'))
+        angle = to_float(shape.cell('Angle'))
+        flip_x = -1 if shape.cell('FlipX') == '1' else 1
+        flip_y = -1 if shape.cell('FlipY') == '1' else 1
+        matrix = multiply(parent, (1, 0, 0, 1,
+                                   to_float(shape.cell('PinX')),
+                                   to_float(shape.cell('PinY'))))
+        matrix = multiply(matrix, (cos(angle), sin(angle),
+                                   -sin(angle), cos(angle), 0, 0))
+        matrix = multiply(matrix, (flip_x, 0, 0, flip_y, 0, 0))
+        matrix = multiply(matrix, (1, 0, 0, 1,
+                                   -to_float(shape.cell('LocPinX')),
+                                   -to_float(shape.cell('LocPinY'))))
+
+        line_pattern = doc.resolve(shape, 'LinePattern')
+        line_pattern = 1 if line_pattern == 'Themed' else to_float(
+            line_pattern, 1)
+        fill_pattern = doc.resolve(shape, 'FillPattern')
+        fill_pattern = 1 if fill_pattern == 'Themed' else to_float(
+            fill_pattern, 1)
+        weight = doc.resolve(shape, 'LineWeight')
+        weight = 0.75 / 72 if weight == 'Themed' else to_float(weight,
+                                                               0.01)
+        accent = doc.theme.get('accent1', '#5B9BD5')
+        stroke = doc.color(doc.resolve(shape, 'LineColor'),
+                           shade(accent, 0.75)) or '#000000'
+        fill = doc.color(doc.resolve(shape, 'FillForegnd'),
+                         accent) or '#FFFFFF'
+
+        filled = False
+        for ix, section in sorted(shape.sections().items(),
+                                  key=lambda item: int(item[0] or 0)):
+            if section.cells.get('NoShow') == '1':
+                continue
+
+            path = build_path(section, width, height)
+            if not path:
+                continue
+
+            no_fill = any((section.cells.get('NoFill') == '1',
+                           not path.closed, fill_pattern == 0))
+            no_line = section.cells.get('NoLine') == '1' or line_pattern == 0
+            if no_fill and no_line:
+                continue
+
+            filled = filled or not no_fill
+            attrs = [('d', path.data),
+                     ('fill', 'none' if no_fill else fill),
+                     ('stroke', 'none' if no_line else stroke)]
+            if not no_line:
+                attrs.append(('stroke-width', fmt(weight)))
+                attrs.append(('stroke-linejoin', 'round'))
+                if line_pattern > 1:
+                    dash = fmt(weight * 4)
+                    attrs.append(('stroke-dasharray',
+                                  '%s,%s' % (dash, dash)))
+                self.margin = max(self.margin, weight / 2)
+
+            self.paths.append(
+                '<path transform="matrix(%s)" %s/>' %
+                (' '.join(fmt(v) for v in matrix),
+                 ' '.join('%s=%s' % (k, quoteattr(v)) for k, v in attrs)))
+            for x, y in path.points:
+                self.extend_bounds(*transform(matrix, x, y))
+
+        for child in shape.get_children():
+            self.draw_shape(child, matrix)
+
+        self.draw_text(shape, matrix, width, height, filled)
+
+    def draw_text(self, shape, matrix, width, height, filled):
+        doc = self.document
+        text = shape.get_text()
+        if not text:
+            return
+
+        x = to_float(shape.cell('TxtPinX'), width / 2)
+        y = to_float(shape.cell('TxtPinY'), height / 2)
+        x, y = transform(matrix, x, y)
+        size = to_float(doc.resolve_char(shape, 'Size'), 1.0 / 6)
+        font = doc.resolve_char(shape, 'Font')
+        if not font or font == 'Themed':
+            font = 'sans-serif'
+        themed = doc.theme['lt1'] if filled else doc.theme['dk1']
+        color = doc.color(doc.resolve_char(shape, 'Color') or 'Themed',
+                          themed)
+
+        lines = text.splitlines()
+        top = -y - size * (len(lines) - 1) / 2.0
+        tspans = []
+        for i, line in enumerate(lines):
+            tspans.append('<tspan x="%s" y="%s">%s</tspan>' %
+                          (fmt(x), fmt(top + size * i), escape(line)))
+            half = len(line) * size * 0.3
+            self.extend_bounds(x - half, y - size * (i + 1))
+            self.extend_bounds(x + half, y + size)
+
+        self.texts.append(
+            '<text font-family=%s font-size="%s" fill="%s" '
+            'text-anchor="middle" dominant-baseline="central">%s</text>' %
+            (quoteattr(font), fmt(size), color or '#000000',
+             ''.join(tspans)))
+
+    def to_svg(self):
+        left, bottom, right, top = self.bounds
+        left -= self.margin
+        bottom -= self.margin
+        right += self.margin
+        top += self.margin
+        width = max(right - left, EPSILON)
+        height = max(top - bottom, EPSILON)
+
+        # y-axis of Visio points upward; paths are flipped by <g>,
+        # and text is placed on flipped coordinates directly
+        return (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                u'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+                u'width="%dpx" height="%dpx" viewBox="%s %s %s %s">\n'
+                u'<g transform="scale(1,-1)">\n%s\n</g>\n%s\n</svg>\n' %
+                (round(width * DPI), round(height * DPI),
+                 fmt(left), fmt(-top), fmt(width), fmt(height),
+                 u'\n'.join(self.paths), u'\n'.join(self.texts)))
+
+
+def build_path(section, width, height):
+    """ Builds Path from geometry rows """
+    path = Path()
+    for kind, cells in section.iter_rows():
+        # coordinates of Rel* rows are relative to the size of shape
+        scale = {}
+        if kind and kind.startswith('Rel'):
+            scale = {'X': width, 'Y': height, 'A': width, 'B': height}
+            if kind != 'RelEllipticalArcTo':
+                scale.update(C=width, D=height)
+
+        def get(name):
+            return to_float(cells.get(name)) * scale.get(name, 1)
+
+        if kind in ('MoveTo', 'RelMoveTo'):
+            path.move_to(get('X'), get('Y'))
+        elif kind in ('LineTo', 'RelLineTo', 'NURBSTo', 'SplineStart',
+                      'SplineKnot'):
+            path.line_to(get('X'), get('Y'))
+        elif kind == 'ArcTo':
+            path.arc_to(get('X'), get('Y'), get('A'))
+        elif kind in ('EllipticalArcTo', 'RelEllipticalArcTo'):
+            path.elliptical_arc_to(get('X'), get('Y'), get('A'), get('B'),
+                                   get('C'), get('D'))
+        elif kind == 'Ellipse':
+            path.ellipse(get('X'), get('Y'), get('A'), get('B'),
+                         get('C'), get('D'))
+        elif kind == 'RelCubBezTo':
+            path.curve_to(get('A'), get('B'), get('C'), get('D'),
+                          get('X'), get('Y'))
+        elif kind == 'RelQuadBezTo':
+            path.quad_to(get('A'), get('B'), get('X'), get('Y'))
+        elif kind == 'PolylineTo':
+            for x, y in parse_polyline(cells.get('A'), width, height):
+                path.line_to(x, y)
+            path.line_to(get('X'), get('Y'))
+
+    path.close()
+    return path
+
+
+def parse_polyline(formula, width, height):
+    """ Parses points of POLYLINE(xType, yType, x1, y1, ...) formula """
+    if not formula or not formula.upper().startswith('POLYLINE('):
+        return []
+
+    try:
+        args = [float(v) for v in formula[9:].rstrip(')').split(',')]
+    except ValueError:
+        return []
+
+    x_scale = width if args[0] == 0 else 1
+    y_scale = height if args[1] == 0 else 1
+    coords = args[2:]
+    return [(coords[i] * x_scale, coords[i + 1] * y_scale)
+            for i in range(0, len(coords) - 1, 2)]
+
+
+def is_cairosvg_available():
+    """ Tests cairosvg is installed """
+    try:
+        import cairosvg  # NOQA: import test
+        return True
+    except (ImportError, OSError):  # OSError: libcairo not found
+        return False
+
+
+def rasterize(svg, filename):
+    """ Converts SVG to PNG (cairosvg), or GIF and JPG (plus Pillow) """
+    if not is_cairosvg_available():
+        msg = 'cairosvg not found. Native rendering to %s requires cairosvg.'
+        raise OSError(msg % os.path.splitext(filename)[1])
+
+    import cairosvg
+    png = cairosvg.svg2png(bytestring=svg.encode('utf-8'))
+    if filename.lower().endswith('.png'):
+        with open(filename, 'wb') as fd:
+            fd.write(png)
+        return
+
+    try:
+        from PIL import Image
+    except ImportError:
+        msg = 'Pillow not found. Native rendering to %s requires Pillow.'
+        raise OSError(msg % os.path.splitext(filename)[1])
+
+    image = Image.open(io.BytesIO(png)).convert('RGBA')
+    canvas = Image.new('RGB', image.size, (255, 255, 255))
+    canvas.paste(image, mask=image.split()[3])
+    canvas.save(filename)
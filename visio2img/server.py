@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Conversion server keeping Visio warm (--serve mode)
+
+The server accepts jobs over HTTP with JSON bodies::
+
+   POST /jobs              submit a job; 202, or 503 if the queue is full
+   GET  /jobs/<id>?wait=N  status of the job (waits N seconds to finish)
+   GET  /status            length of the queue and number of workers
+
+Jobs are exported by worker threads; each of them owns a VisioAppPool.
+The server has no authentication; it reads and writes files only under its
+root directories (the current directory by default), and rejects other
+jobs (403).
+"""
+
+from __future__ import absolute_import
+
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from visio2img.pool import VisioAppPool, initialize_com, uninitialize_com
+from visio2img.visio2img import error_message, iter_export
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from queue import Full, Queue
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import parse_qs, urlparse
+    from urllib.request import Request, urlopen
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from Queue import Full, Queue
+    from SocketServer import ThreadingMixIn
+    from urllib2 import HTTPError, Request, URLError, urlopen
+    from urlparse import parse_qs, urlparse
+
+DEFAULT_ADDRESS = '127.0.0.1:8077'
+DEFAULT_QUEUE_SIZE = 16
+MAX_WAIT = 60
+
+
+class ServerBusy(IOError):
+    """ Raised when the queue of server is full """
+    pass
+
+
+def parse_address(address):
+    """ Parses ``host:port`` to a pair """
+    host, _, port = address.rpartition(':')
+    try:
+        return (host or '127.0.0.1', int(port))
+    except ValueError:
+        raise ValueError('Invalid address: %s' % address)
+
+
+def normalize_path(path):
+    """ Returns the real path of path for comparison """
+    return os.path.normcase(os.path.realpath(os.path.abspath(path)))
+
+
+def is_under(path, roots):
+    """ Tests path is in one of the directories of roots """
+    path = normalize_path(path)
+    for root in roots:
+        root = normalize_path(root)
+        if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+class Job(object):
+    """ A conversion job and its status """
+    ids = itertools.count(1)
+
+    def __init__(self, visio_filename, image_filename, pagenum=None,
+                 pagename=None, native=False):
+        self.id = str(next(self.ids))
+        self.visio_filename = visio_filename
+        self.image_filename = image_filename
+        self.pagenum = pagenum
+        self.pagename = pagename
+        self.native = native
+        self.status = 'queued'
+        self.error = None
+        self.pages = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        return {'id': self.id,
+                'status': self.status,
+                'error': self.error,
+                'visio_filename': self.visio_filename,
+                'image_filename': self.image_filename,
+                'pages': [{'index': page.index,
+                           'name': page.name,
+                           'filename': page.filename,
+                           'size': page.size,
+                           'elapsed': page.elapsed,
+                           'error': page.error and error_message(page.error)}
+                          for page in self.pages],
+                'submitted': self.submitted,
+                'started': self.started,
+                'finished': self.finished}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/status':
+            self.send_json(200, self.server.conversion.status())
+        elif url.path.startswith('/jobs/'):
+            query = parse_qs(url.query)
+            try:
+                wait = min(float(query.get('wait', [0])[0]), MAX_WAIT)
+            except ValueError:
+                return self.send_json(400, {'error': 'Invalid wait'})
+
+            job = self.server.conversion.get(url.path[6:], wait)
+            if job is None:
+                self.send_json(404, {'error': 'Job not found'})
+            else:
+                self.send_json(200, job.to_dict())
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            return self.send_json(404, {'error': 'Not found'})
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length).decode('utf-8'))
+            job = Job(params['visio_filename'], params['image_filename'],
+                      params.get('pagenum'), params.get('pagename'),
+                      bool(params.get('native')))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self.send_json(400, {'error': 'Invalid job'})
+
+        for path in (job.visio_filename, job.image_filename):
+            if not self.server.conversion.is_allowed(path):
+                return self.send_json(403, {'error': 'Path not allowed: %s' %
+                                            path})
+
+        try:
+            self.server.conversion.submit(job)
+            self.send_json(202, job.to_dict())
+        except Full:
+            self.send_json(503, {'error': 'Queue is full'},
+                           {'Retry-After': '1'})
+
+    def send_json(self, code, body, headers=None):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        log = self.server.conversion.log
+        if log:
+            log.write('%s - %s\n' % (self.address_string(), format % args))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ConversionServer(object):
+    """ Server converting visio files with warm Visio applications
+
+    Up to ``queue_size`` jobs wait in the queue; more jobs are rejected
+    (HTTP 503) so that clients back off.  ``workers`` threads export jobs,
+    each of them with its own VisioAppPool launching Visio by ``dispatch``.
+    Finished jobs are kept for ``history`` jobs to be queried.  Visio files
+    and images of jobs should be in ``roots`` (list of directories; the
+    current directory by default).
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, workers=1,
+                 queue_size=DEFAULT_QUEUE_SIZE, dispatch=None, history=1000,
+                 log=None, roots=None):
+        self.roots = [os.path.abspath(root) for root in roots or ['.']]
+        self.queue = Queue(queue_size)
+        self.queue_size = queue_size
+        self.dispatch = dispatch
+        self.history = history
+        self.log = log
+        self.jobs = OrderedDict()
+        self.condition = threading.Condition()
+        self.running = 0
+
+        self.httpd = ThreadingHTTPServer(parse_address(address),
+                                         RequestHandler)
+        self.httpd.conversion = self
+        self.workers = [threading.Thread(target=self.work)
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return '%s:%d' % (host, port)
+
+    @property
+    def url(self):
+        return 'http://%s' % self.address
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """ Serves in a background thread """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """ Stops the server after finishing queued jobs """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def is_allowed(self, path):
+        """ Tests the job may read or write path """
+        return os.path.isabs(path) and is_under(path, self.roots)
+
+    def submit(self, job):
+        """ Queues the job; raises queue.Full if the queue is full """
+        with self.condition:
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+            self.expire()
+
+    def get(self, job_id, wait=0):
+        """ Returns the job (waits ``wait`` seconds for it to finish) """
+        deadline = time.time() + wait
+        with self.condition:
+            job = self.jobs.get(job_id)
+            while job is not None and not job.done:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return job
+
+    def status(self):
+        with self.condition:
+            return {'queued': self.queue.qsize(),
+                    'running': self.running,
+                    'workers': len(self.workers),
+                    'queue_size': self.queue_size}
+
+    def expire(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def work(self):
+        initialize_com()  # COM objects belong to the thread
+        pool = VisioAppPool(dispatch=self.dispatch)
+        try:
+            while True:
+                job = self.queue.get()
+                if job is None:
+                    break
+                self.run(job, pool)
+        finally:
+            pool.close()
+            uninitialize_com()
+
+    def run(self, job, pool):
+        with self.condition:
+            job.status = 'running'
+            job.started = time.time()
+            self.running += 1
+
+        try:
+            job.pages = list(iter_export(job.visio_filename,
+                                         job.image_filename, job.pagenum,
+                                         job.pagename, pool, job.native))
+            errors = [page for page in job.pages if page.error]
+            if errors:
+                job.error = 'Could not write image: %s' % ', '.join(
+                    page.filename for page in errors)
+        except Exception as exc:
+            job.error = error_message(exc)
+
+        with self.condition:
+            job.status = 'failed' if job.error else 'done'
+            job.finished = time.time()
+            self.running -= 1
+            self.expire()
+            self.condition.notify_all()
+
+
+class ConversionClient(object):
+    """ Client of ConversionServer """
+    def __init__(self, url, timeout=MAX_WAIT):
+        if '://' not in url:
+            url = 'http://' + url
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, path, body=None):
+        if body is None:
+            request = Request(self.url + path)
+        else:
+            request = Request(self.url + path,
+                              json.dumps(body).encode('utf-8'),
+                              {'Content-Type': 'application/json'})
+
+        try:
+            response = urlopen(request, timeout=self.timeout + 10)
+            return json.loads(response.read().decode('utf-8'))
+        except HTTPError as exc:
+            if exc.code == 503:
+                raise ServerBusy('Server is busy: %s' % self.url)
+            elif exc.code == 404:
+                raise IndexError('Job not found: %s' % path)
+            elif exc.code == 403:
+                try:
+                    error = json.loads(exc.read().decode('utf-8'))['error']
+                except (ValueError, KeyError, TypeError):
+                    error = 'Forbidden'
+                raise IOError('Rejected by server: %s' % error)
+            else:
+                raise IOError('Server error (%d): %s' % (exc.code, path))
+        except URLError as exc:
+            raise IOError('Could not connect to server: %s (%s)' %
+                          (self.url, exc.reason))
+
+    def submit(self, visio_filename, image_filename, pagenum=None,
+               pagename=None, native=False, retries=10):
+        """ Submits a job; retries while the server is busy """
+        body = {'visio_filename': os.path.abspath(visio_filename),
+                'image_filename': os.path.abspath(image_filename),
+                'pagenum': pagenum,
+                'pagename': pagename,
+                'native': native}
+        for i in itertools.count():
+            try:
+                return self.request('/jobs', body)
+            except ServerBusy:
+                if i >= retries:
+                    raise
+                time.sleep(min(0.1 * 2 ** i, 5))
+
+    def get(self, job_id, wait=0):
+        """ Returns status of the job """
+        return self.request('/jobs/%s?wait=%s' % (job_id, wait))
+
+    def status(self):
+        return self.request('/status')
+
+    def convert(self, visio_filename, image_filename, pagenum=None,
+                pagename=None, native=False):
+        """ Converts a visio file on the server and waits for it """
+        job = self.submit(visio_filename, image_filename, pagenum, pagename,
+                          native)
+        while job['status'] not in ('done', 'failed'):
+            job = self.get(job['id'], self.timeout)
+
+        if job['error']:
+            raise IOError(job['error'])
+        return job
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Stand-in of the Visio COM automation objects
+
+``FakeDispatcher`` can be given to ``VisioAppPool`` as ``dispatch`` to run
+visio2img without Windows, pywin32 and Visio (ex. in tests and benchmarks).
+Exported "images" are small text files describing the page, or synthetic
+images cropped to the extents of the shapes like Visio (see draw_shapes()).
+``FakeBackend`` is a backend converting with it (register it by
+``register_backend()``).
+"""
+
+from __future__ import absolute_import
+
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from visio2img import vsd
+from visio2img.backends import VisioBackend
+from visio2img.pool import VisioAppPool
+from visio2img.vsdx import PageInfo, is_vsdx, read_pages
+
+
+class FakeCell(object):
+    def __init__(self, sheet, name):
+        self.sheet = sheet
+        self.name = name
+
+    @property
+    def ResultIU(self):
+        return self.sheet.cells[self.name]
+
+    @ResultIU.setter
+    def ResultIU(self, value):
+        self.sheet.cells[self.name] = value
+
+
+class FakeShapeSheet(object):
+    def __init__(self, cells):
+        self.cells = cells
+
+    def CellsU(self, name):
+        return FakeCell(self, name)
+
+
+SHAPE_IDS = itertools.count(1)
+
+
+class FakeShape(object):
+    """ Rectangle shape (color is None for shapes by DrawRectangle()) """
+    def __init__(self, page, bbox, color=None):
+        self.page = page
+        self.bbox = bbox  # (left, bottom, right, top) in inches
+        self.color = color
+        self.Name = 'Sheet.%d' % next(SHAPE_IDS)
+        self.sheet = FakeShapeSheet({'LinePattern': 1, 'FillPattern': 1})
+
+    def CellsU(self, name):
+        return self.sheet.CellsU(name)
+
+    def BoundingBox(self, flags):
+        # pywin32 returns out parameters as a tuple
+        return self.bbox
+
+    @property
+    def visible(self):
+        cells = self.sheet.cells
+        return cells['LinePattern'] != 0 or cells['FillPattern'] != 0
+
+    def Delete(self):
+        self.page.shapes.remove(self)
+
+
+class FakeSelection(object):
+    def __init__(self, page):
+        self.page = page
+        self.shapes = []
+
+    def Select(self, shape, flags):
+        self.shapes.append(shape)
+
+    def BoundingBox(self, flags):
+        return get_extents(self.shapes)
+
+    def Export(self, filename):
+        self.page.export(filename, self.shapes)
+
+
+class FakePage(object):
+    def __init__(self, document, info):
+        self.Document = document
+        self.Index = info.index
+        self.ID = info.id
+        self.Name = info.name
+        self.NameU = info.name_u
+        self.Background = int(info.background)
+        self.PageSheet = FakeShapeSheet({'PageWidth': info.width,
+                                         'PageHeight': info.height})
+        self.BackPage = None
+        self.shapes = make_grid(self, info.width or 0, info.height or 0)
+
+    @property
+    def name(self):
+        # COM attributes are case-insensitive
+        return self.Name
+
+    @property
+    def Shapes(self):
+        return list(self.shapes)
+
+    def DrawRectangle(self, x1, y1, x2, y2):
+        shape = FakeShape(self, (min(x1, x2), min(y1, y2),
+                                 max(x1, x2), max(y1, y2)))
+        self.shapes.append(shape)
+        return shape
+
+    def Export(self, filename):
+        shapes = list(self.shapes)
+        back = self.BackPage
+        while back is not None:  # shapes of background pages are exported
+            shapes = back.shapes + shapes
+            back = back.BackPage
+        self.export(filename, shapes)
+
+    def export(self, filename, shapes):
+        app = self.Document.Application
+        dispatcher = app.dispatcher
+        app.check_alive()
+        dispatcher.sleep(dispatcher.export_latency)
+        dispatcher.check_hang(app, 'export')
+        if self.Name in dispatcher.broken_pages:
+            raise Exception('Export failed: %s' % self.Name)  # as COM error
+        if not os.path.isdir(os.path.dirname(filename)):
+            raise IOError('Could not write image: %s' % filename)
+
+        if dispatcher.images:
+            draw_shapes(shapes, app.Settings.dpi).save(filename)
+        else:
+            with open(filename, 'wb') as fd:
+                content = u'%s\n%s\n' % (self.Document.FullName, self.Name)
+                fd.write(content.encode('utf-8'))
+        with dispatcher.lock:
+            dispatcher.exported.append(filename)
+
+    def CreateSelection(self, selection_type):
+        return FakeSelection(self)
+
+
+def make_grid(page, width, height):
+    """ Makes shapes of a synthetic drawing on a page
+
+    The drawing is a grid of 1 inch squares colored by their position; it
+    covers whole inches from the bottom left corner of the page, so the
+    drawing is smaller than the page (like drawings with margins).
+    """
+    return [FakeShape(page, (x, y, x + 1, y + 1),
+                      (x * 40 % 256, y * 40 % 256, 128))
+            for x in range(int(math.floor(width)))
+            for y in range(int(math.floor(height)))]
+
+
+def get_extents(shapes):
+    """ Returns (left, bottom, right, top) of shapes """
+    if not shapes:
+        return (0, 0, 0, 0)
+    return (min(shape.bbox[0] for shape in shapes),
+            min(shape.bbox[1] for shape in shapes),
+            max(shape.bbox[2] for shape in shapes),
+            max(shape.bbox[3] for shape in shapes))
+
+
+def draw_shapes(shapes, dpi, extents=None):
+    """ Draws shapes cropped to extents (requires Pillow)
+
+    Like Visio, images are cropped to the extents of the shapes if not
+    given.  Shapes drawn by DrawRectangle() are filled black unless their
+    line and fill are hidden.
+    """
+    from PIL import Image, ImageDraw
+
+    left, bottom, right, top = extents or get_extents(shapes)
+    size = (max(int(round((right - left) * dpi)), 1),
+            max(int(round((top - bottom) * dpi)), 1))
+    image = Image.new('RGB', size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for shape in shapes:
+        if shape.visible:
+            x1 = int(round((shape.bbox[0] - left) * dpi))
+            x2 = int(round((shape.bbox[2] - left) * dpi))
+            y1 = int(round((top - shape.bbox[3]) * dpi))
+            y2 = int(round((top - shape.bbox[1]) * dpi))
+            draw.rectangle((x1, y1, x2 - 1, y2 - 1),
+                           fill=shape.color or (0, 0, 0))
+
+    return image
+
+
+def draw_page(width, height, dpi):
+    """ Draws the synthetic drawing on the whole page (requires Pillow)
+
+    This is the image of the page not cropped by Visio (ex. stitched from
+    tiles).  See make_grid() for the drawing.
+    """
+    return draw_shapes(make_grid(None, width, height), dpi,
+                       (0, 0, width, height))
+
+
+class FakePages(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, index):
+        # pywin32 maps [] of collections to 0-based enumeration
+        return self.pages[index]
+
+    @property
+    def Count(self):
+        return len(self.pages)
+
+    def Item(self, index):
+        # Visio collections are indexed from 1
+        return self.pages[index - 1]
+
+
+class FakeDocument(object):
+    def __init__(self, app, filename, pages):
+        self.Application = app
+        self.FullName = filename
+        self.Pages = FakePages([FakePage(self, info) for info in pages])
+        self.closed = False
+
+    def Close(self):
+        self.Application.check_alive()
+        self.closed = True
+        self.Application.Documents.documents.remove(self)
+
+
+class FakeDocuments(object):
+    def __init__(self, app):
+        self.app = app
+        self.documents = []
+
+    def __len__(self):
+        return len(self.documents)
+
+    def OpenEx(self, filename, flags):
+        dispatcher = self.app.dispatcher
+        self.app.check_alive()
+        dispatcher.sleep(dispatcher.open_latency)
+        dispatcher.check_hang(self.app, 'open')
+        if not os.path.exists(filename):
+            raise IOError('No such visio file: %s' % filename)
+
+        document = FakeDocument(self.app, filename,
+                                dispatcher.get_pages(filename))
+        self.documents.append(document)
+        self.app.opened += 1
+        return document
+
+    def Open(self, filename):
+        return self.OpenEx(filename, 0)
+
+
+class FakeSettings(object):
+    visRasterUseScreenResolution = 0
+    visRasterUseCustomResolution = 3
+
+    def __init__(self):
+        self.resolution = (self.visRasterUseScreenResolution, 96, 96, 0)
+
+    @property
+    def dpi(self):
+        if self.resolution[0] == self.visRasterUseCustomResolution:
+            return self.resolution[1]
+        return 96
+
+    def GetRasterExportResolution(self):
+        # pywin32 returns out parameters as a tuple
+        return self.resolution
+
+    def SetRasterExportResolution(self, resolution, width, height, units):
+        self.resolution = (resolution, width, height, units)
+
+
+class FakeApplication(object):
+    def __init__(self, dispatcher, pid):
+        self.dispatcher = dispatcher
+        self.ProcessID = pid
+        self.Documents = FakeDocuments(self)
+        self.Settings = FakeSettings()
+        self.opened = 0
+        self.quitted = False
+        self.terminated = threading.Event()
+
+    @property
+    def ActiveDocument(self):
+        return self.Documents.documents[-1]
+
+    @property
+    def memory(self):
+        """ Resident memory; grows by memory_leak for each document """
+        return 64 * 1024 * 1024 + self.opened * self.dispatcher.memory_leak
+
+    def check_alive(self):
+        if self.terminated.is_set():
+            raise RuntimeError('The RPC server is unavailable')  # COM error
+        elif self.quitted:
+            raise RuntimeError('Application has already quitted')
+
+    def Quit(self):
+        self.quitted = True
+        self.dispatcher.sleep(self.dispatcher.quit_latency)
+
+
+class FakeDispatcher(object):
+    """ Callable which launches a FakeApplication
+
+    ``page_names`` is a list of page names for every document or a function
+    which takes a filename and returns them.  By default, pages of .vsdx
+    files are read from the file and other files have a page.  Latencies
+    are in seconds.  Exporting pages named in ``broken_pages`` fails.  If
+    ``images`` is true, blank images of the page size are exported instead
+    of text files (requires Pillow).  Operations hang on demand (see
+    hang()) until the application is killed by terminate(), and memory
+    usage of applications grows by ``memory_leak`` bytes for each document.
+    """
+    def __init__(self, page_names=None, startup_latency=0, open_latency=0,
+                 export_latency=0, quit_latency=0, broken_pages=(),
+                 images=False, memory_leak=0):
+        self.page_names = page_names
+        self.broken_pages = broken_pages
+        self.images = images
+        self.memory_leak = memory_leak
+        self.hangs = {}
+        self.startup_latency = startup_latency
+        self.open_latency = open_latency
+        self.export_latency = export_latency
+        self.quit_latency = quit_latency
+        self.lock = threading.Lock()
+        self.apps = []
+        self.exported = []
+
+    def __getstate__(self):
+        # picklable to be given to worker processes (without history)
+        state = dict(self.__dict__)
+        del state['lock'], state['apps'], state['exported']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.apps = []
+        self.exported = []
+
+    def __call__(self):
+        self.sleep(self.startup_latency)
+        with self.lock:
+            app = FakeApplication(self, 1000 + len(self.apps))
+            self.apps.append(app)
+        return app
+
+    def hang(self, operation, times=1):
+        """ Makes next ``times`` of operation ('open' or 'export') hang """
+        with self.lock:
+            self.hangs[operation] = times
+
+    def check_hang(self, app, operation):
+        with self.lock:
+            hanging = self.hangs.get(operation, 0) > 0
+            if hanging:
+                self.hangs[operation] -= 1
+
+        if hanging:
+            app.terminated.wait(60)  # not forever, even if not killed
+            app.check_alive()
+
+    def get_app(self, pid):
+        with self.lock:
+            for app in self.apps:
+                if app.ProcessID == pid:
+                    return app
+        raise OSError('No such process: %d' % pid)
+
+    def terminate(self, pid):
+        """ Kills the application (see VisioAppPool) """
+        self.get_app(pid).terminated.set()
+
+    def memory_usage(self, pid):
+        return self.get_app(pid).memory
+
+    def get_pages(self, filename):
+        """ Returns list of PageInfo for the document """
+        if callable(self.page_names):
+            names = self.page_names(filename)
+        elif self.page_names is not None:
+            names = self.page_names
+        elif is_vsdx(filename):
+            return read_pages(filename)
+        else:
+            try:
+                names = [u'Page-%d' % page.index
+                         for page in vsd.read_pages(filename)]
+            except IOError:
+                names = [u'Page-1']
+
+        return [PageInfo(i + 1, i, name, name, 8.5, 11, False, None)
+                for i, name in enumerate(names)]
+
+    def sleep(self, seconds):
+        if seconds:
+            time.sleep(seconds)
+
+
+class FakeBackend(VisioBackend):
+    """ Backend converting with its own pool of FakeDispatcher """
+    name = 'fake'
+
+    def __init__(self, dispatcher=None):
+        self.pool = VisioAppPool(dispatch=dispatcher or FakeDispatcher())
+
+    def is_available(self):
+        return True
+
+    def open(self, filename, pool=None, documents=None):
+        return super(FakeBackend, self).open(filename, pool or self.pool,
+                                             documents)
+
+    def close(self):
+        self.pool.close()
+
+
+@contextmanager
+def fake_visio(dispatcher):
+    """ Replaces Visio launched by default (ex. by the CLI) with dispatcher """
+    from visio2img import pool, visio2img
+
+    saved = (pool.dispatch_visio, pool._default_pool, pool._default_options,
+             visio2img.is_pywin32_available)
+    pool.dispatch_visio = dispatcher
+    pool._default_pool = None
+    visio2img.is_pywin32_available = lambda: True
+    try:
+        yield dispatcher
+    finally:
+        if pool._default_pool is not None:
+            pool._default_pool.close()
+        (pool.dispatch_visio, pool._default_pool, pool._default_options,
+         visio2img.is_pywin32_available) = saved
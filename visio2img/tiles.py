@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Tiled export of large pages
+
+A large page is exported by Visio as a grid of tiles at the target
+resolution.  Visio crops images to the extents of the shapes exported, so
+each tile is exported as a selection of the shapes crossing the tile and
+an invisible frame of the tile, and is cut out of the image by the extents
+of the selection.  Shapes are never moved; only the frame is added to the
+page during the export (the document is never saved).  As Visio renders
+whole shapes, a shape spanning the page (ex. a border) would make every
+tile an export of the whole page; such a tile is rejected by the size of
+the image instead (see MAX_EXPORT_TILES).
+
+Tiles are stitched into a PNG by a streaming writer which holds only a
+row of tiles in memory, or written as a Deep Zoom image (a pyramid of
+tiles) for deep-zoom viewers.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import namedtuple
+from math import ceil, log
+
+from visio2img.output import atomic_output
+from visio2img.variants import ExportResolution, is_pillow_available
+from visio2img.visio2img import (
+    check_output_dir, check_page_selection, make_output_filenames,
+    open_document, select_pages
+)
+
+DEFAULT_TILE_SIZE = 1024  # pixels
+DEFAULT_DPI = 300
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+DZI_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+                'Format="png" Overlap="0" TileSize="%d">'
+                '<Size Width="%d" Height="%d"/></Image>\n')
+WHITE = (255, 255, 255)
+
+# VisSelectionTypes, VisSelectArgs and VisBoundingBoxArgs
+visSelTypeEmpty = 0
+visSelect = 2
+visBBoxExtents = 4
+
+MAX_BACKGROUND_PAGES = 16
+MAX_EXPORT_TILES = 16  # limit of an image exported for a tile (in tiles)
+
+Tile = namedtuple('Tile', 'column row left top width height')
+
+
+def plan_tiles(width, height, tile_size):
+    """ Splits an image of width x height pixels into rows of Tiles """
+    rows = []
+    for row, top in enumerate(range(0, height, tile_size)):
+        rows.append([Tile(column, row, left, top,
+                          min(tile_size, width - left),
+                          min(tile_size, height - top))
+                     for column, left in enumerate(range(0, width,
+                                                         tile_size))])
+    return rows
+
+
+class PNGWriter(object):
+    """ Writes an RGB PNG image to stream row by row """
+    def __init__(self, stream, width, height):
+        self.stream = stream
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.compressor = zlib.compressobj()
+
+        stream.write(PNG_SIGNATURE)
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                              8, 2, 0, 0, 0))
+
+    def write_chunk(self, kind, data):
+        self.stream.write(struct.pack('>I', len(data)))
+        self.stream.write(kind + data)
+        self.stream.write(struct.pack('>I',
+                                      zlib.crc32(kind + data) & 0xffffffff))
+
+    def write_rows(self, data):
+        """ Writes rows given as RGB bytes (ex. Image.tobytes()) """
+        stride = self.width * 3
+        lines = [b'\0' + data[offset:offset + stride]  # filter: none
+                 for offset in range(0, len(data), stride)]
+        self.rows += len(lines)
+        compressed = self.compressor.compress(b''.join(lines))
+        if compressed:
+            self.write_chunk(b'IDAT', compressed)
+
+    def close(self):
+        if self.rows != self.height:
+            raise IOError('PNG image is incomplete: %d of %d rows' %
+                          (self.rows, self.height))
+        self.write_chunk(b'IDAT', self.compressor.flush())
+        self.write_chunk(b'IEND', b'')
+
+
+def intersects(bbox, region):
+    """ Tests two boxes of (left, bottom, right, top) overlap """
+    return all((bbox[0] < region[2], region[0] < bbox[2],
+                bbox[1] < region[3], region[1] < bbox[3]))
+
+
+def get_area(bbox):
+    """ Returns the area of a box of (left, bottom, right, top) """
+    return (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+
+
+def paste_image(canvas, image, keyed=False):
+    """ Pastes image onto canvas; transparent pixels are skipped
+
+    If ``keyed`` is true, white pixels are also taken as transparent (to
+    compose a page over its background pages).
+    """
+    from PIL import ImageChops
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        canvas.paste(image, mask=image.split()[3])
+    elif keyed:
+        image = image.convert('RGB')
+        white = image.point(lambda value: 255)
+        mask = ImageChops.difference(image, white).convert('L')
+        canvas.paste(image, mask=mask.point(lambda value: 255 * bool(value)))
+    else:
+        canvas.paste(image.convert('RGB'))
+
+
+class PageTiler(object):
+    """ Exports regions of a Visio page
+
+    Bounding boxes of shapes (of the page and its background pages) are
+    read once.  An image exported by Visio covers the shapes crossing the
+    tile, so a tile is not exported if the image would be larger than
+    ``max_pixels`` (IOError is raised before the export).  Background
+    pages are exported the same way and composed beneath the page; white
+    pixels of the page are taken as transparent then.
+    """
+    def __init__(self, page, dpi, max_pixels=None):
+        self.page = page
+        self.dpi = dpi
+        self.max_pixels = max_pixels
+        sheet = page.PageSheet
+        self.width = sheet.CellsU('PageWidth').ResultIU
+        self.height = sheet.CellsU('PageHeight').ResultIU
+        self.layers = None  # [(page, [(shape, bbox)])] from the background
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.layers = None
+        return False
+
+    @property
+    def size(self):
+        """ Size of the image of the page in pixels """
+        return (int(round(self.width * self.dpi)),
+                int(round(self.height * self.dpi)))
+
+    def get_layers(self):
+        """ Returns pages (background first) and bounding boxes of shapes """
+        if self.layers is None:
+            pages = [self.page]
+            back = self.page.BackPage
+            while back is not None and len(pages) <= MAX_BACKGROUND_PAGES:
+                pages.insert(0, back)
+                back = back.BackPage
+
+            self.layers = [(page, [(shape, shape.BoundingBox(visBBoxExtents))
+                                   for shape in page.Shapes])
+                           for page in pages]
+        return self.layers
+
+    def export(self, tile, filename):
+        """ Exports the region of tile; returns the image (RGB) """
+        from PIL import Image
+
+        dpi = float(self.dpi)
+        region = (tile.left / dpi,
+                  self.height - (tile.top + tile.height) / dpi,
+                  (tile.left + tile.width) / dpi,
+                  self.height - tile.top / dpi)
+        canvas = Image.new('RGB', (tile.width, tile.height), WHITE)
+        layers = self.get_layers()
+        for page, shapes in layers:
+            crossing = [(shape, bbox) for shape, bbox in shapes
+                        if intersects(bbox, region)]
+            if crossing:
+                self.check_extents(page, crossing, region, tile)
+                crossing = [shape for shape, bbox in crossing]
+                image = self.export_region(page, crossing, region, tile,
+                                           filename)
+                paste_image(canvas, image, keyed=len(layers) > 1)
+
+        return canvas
+
+    def check_extents(self, page, shapes, region, tile):
+        """ Raises IOError if the image of shapes would be too large """
+        if self.max_pixels is None:
+            return
+
+        boxes = [region] + [bbox for shape, bbox in shapes]
+        left, bottom, right, top = (min(box[0] for box in boxes),
+                                    min(box[1] for box in boxes),
+                                    max(box[2] for box in boxes),
+                                    max(box[3] for box in boxes))
+        width = int(round((right - left) * self.dpi))
+        height = int(round((top - bottom) * self.dpi))
+        if width * height > self.max_pixels:
+            shape, bbox = max(shapes, key=lambda item: get_area(item[1]))
+            raise IOError('Could not export tile %d,%d of page %s: '
+                          'shapes crossing it (ex. %s) make an image of '
+                          '%dx%d pixels; use lower dpi or larger tiles' %
+                          (tile.column, tile.row, page.Name, shape.Name,
+                           width, height))
+
+    def export_region(self, page, shapes, region, tile, filename):
+        """ Exports shapes and cuts the region out of the image """
+        from PIL import Image
+
+        frame = page.DrawRectangle(*region)
+        try:
+            frame.CellsU('LinePattern').ResultIU = 0
+            frame.CellsU('FillPattern').ResultIU = 0
+            selection = page.CreateSelection(visSelTypeEmpty)
+            selection.Select(frame, visSelect)
+            for shape in shapes:
+                selection.Select(shape, visSelect)
+            left, bottom, right, top = selection.BoundingBox(visBBoxExtents)
+            try:
+                selection.Export(filename)
+            except EnvironmentError:
+                raise
+            except Exception:
+                raise IOError('Could not export tile %d,%d of page: %s' %
+                              (tile.column, tile.row, page.Name))
+        finally:
+            frame.Delete()
+
+        with Image.open(filename) as image:
+            # the scale of the image may be a pixel off from dpi
+            scale_x = image.size[0] / (right - left)
+            scale_y = image.size[1] / (top - bottom)
+            x = int(round((region[0] - left) * scale_x))
+            y = int(round((top - region[3]) * scale_y))
+            cropped = image.crop((x, y, x + tile.width, y + tile.height))
+            cropped.load()
+        os.remove(filename)
+        return cropped
+
+
+def stitch(tiler, filename, tile_size, tmpdir):
+    """ Exports tiles of the page and stitches them into a PNG file """
+    from PIL import Image
+
+    width, height = tiler.size
+    tile_filename = os.path.join(tmpdir, 'tile.png')
+    with atomic_output(filename) as temporary:
+        with open(temporary, 'wb') as fd:
+            writer = PNGWriter(fd, width, height)
+            for tiles in plan_tiles(width, height, tile_size):
+                band = Image.new('RGB', (width, tiles[0].height), WHITE)
+                for tile in tiles:
+                    band.paste(tiler.export(tile, tile_filename),
+                               (tile.left, 0))
+                writer.write_rows(band.tobytes())
+            writer.close()
+
+
+def get_level_size(width, height, levels, level):
+    """ Returns the size of the image at level of a Deep Zoom image """
+    scale = 2 ** (levels - 1 - level)
+    return (int(ceil(float(width) / scale)), int(ceil(float(height) / scale)))
+
+
+def write_pyramid(tiler, filename, tile_size, tmpdir):
+    """ Exports tiles of the page as a Deep Zoom image (.dzi)
+
+    Tiles of the full resolution are exported by Visio, and each of the
+    lower levels is made from four tiles of the level above.
+    """
+    from PIL import Image
+
+    width, height = tiler.size
+    levels = int(ceil(log(max(width, height, 1), 2))) + 1
+    files_dir = os.path.splitext(filename)[0] + '_files'
+    if os.path.isdir(files_dir):
+        shutil.rmtree(files_dir)
+
+    def tile_path(level, column, row):
+        return os.path.join(files_dir, str(level), '%d_%d.png' % (column, row))
+
+    os.makedirs(os.path.join(files_dir, str(levels - 1)))
+    tile_filename = os.path.join(tmpdir, 'tile.png')
+    for tiles in plan_tiles(width, height, tile_size):
+        for tile in tiles:
+            image = tiler.export(tile, tile_filename)
+            image.save(tile_path(levels - 1, tile.column, tile.row))
+
+    for level in range(levels - 2, -1, -1):
+        os.makedirs(os.path.join(files_dir, str(level)))
+        upper_width, upper_height = get_level_size(width, height, levels,
+                                                   level + 1)
+        level_width, level_height = get_level_size(width, height, levels,
+                                                   level)
+        for tiles in plan_tiles(level_width, level_height, tile_size):
+            for tile in tiles:
+                left = tile.left * 2
+                top = tile.top * 2
+                canvas = Image.new('RGB',
+                                   (min(tile_size * 2, upper_width - left),
+                                    min(tile_size * 2, upper_height - top)),
+                                   WHITE)
+                for dx in (0, 1):
+                    for dy in (0, 1):
+                        path = tile_path(level + 1, tile.column * 2 + dx,
+                                         tile.row * 2 + dy)
+                        if os.path.exists(path):
+                            with Image.open(path) as upper:
+                                canvas.paste(upper, (dx * tile_size,
+                                                     dy * tile_size))
+                image = canvas.resize((tile.width, tile.height),
+                                      Image.LANCZOS)
+                image.save(tile_path(level, tile.column, tile.row))
+
+    with atomic_output(filename) as temporary:
+        with open(temporary, 'w') as fd:
+            fd.write(DZI_TEMPLATE % (tile_size, width, height))
+
+
+def export_tiled(visio_filename, image_filename, pagenum=None, pagename=None,
+                 pool=None, documents=None, dpi=DEFAULT_DPI,
+                 tile_size=DEFAULT_TILE_SIZE, pyramid=False):
+    """ Exports pages at dpi as tiles of tile_size pixels
+
+    Tiles are stitched into PNG files, or written as Deep Zoom images
+    (``image_filename`` is a .dzi file and the tiles go to the ``_files``
+    directory beside it) if ``pyramid`` is true.  Output filenames of
+    pages are made like export_img().  Returns list of written filenames.
+    """
+    if not is_pillow_available():
+        raise OSError('Pillow not found. Tiled export requires Pillow.')
+
+    image_pathname = check_output_dir(image_filename)
+    check_page_selection(visio_filename, [pagenum or pagename])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with open_document(visio_filename, pool, False, documents) as visio:
+            with ExportResolution(getattr(visio, 'app', None), dpi):
+                pages = select_pages(visio, pagenum, pagename)
+                filenames = make_output_filenames(
+                    image_pathname, [(p.Index, p.Name) for p in pages])
+                for page, filename in zip(pages, filenames):
+                    max_pixels = MAX_EXPORT_TILES * tile_size ** 2
+                    with PageTiler(page, dpi, max_pixels) as tiler:
+                        if pyramid:
+                            write_pyramid(tiler, filename, tile_size, tmpdir)
+                        else:
+                            stitch(tiler, filename, tile_size, tmpdir)
+
+        return filenames
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
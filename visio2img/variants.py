@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Derived images of various sizes and formats
+
+Each page is exported by Visio only once, as a high resolution PNG (the
+master), and the variants are made from it by Pillow in a thread pool.
+Variants are described in a JSON file::
+
+   {"resolution": 300,
+    "variants": [{"suffix": "", "format": "png"},
+                 {"suffix": "-web", "format": "jpg", "width": 1024,
+                  "quality": 85},
+                 {"suffix": "-thumb", "format": "gif", "width": 200,
+                  "height": 200}]}
+
+A variant is written to ``<output><suffix>.<format>``.  Images are scaled
+down to fit in ``width`` and ``height`` (keeping the aspect ratio); they
+are never scaled up.
+"""
+
+from __future__ import absolute_import
+
+import io
+import json
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from visio2img.output import atomic_output
+from visio2img.visio2img import (
+    check_output_dir, check_page_selection, export_page,
+    make_output_filenames, open_document, raise_page_error, select_pages
+)
+
+FORMATS = ['gif', 'jpg', 'png']
+DEFAULT_RESOLUTION = 300  # dpi of masters
+
+# VisRasterExportResolution and VisRasterExportResolutionUnits
+visRasterUseCustomResolution = 3
+visRasterPixelsPerInch = 0
+
+Variant = namedtuple('Variant', 'suffix format width height quality')
+
+
+def make_variant(suffix='', format='png', width=None, height=None,
+                 quality=None):
+    """ Makes a Variant; raises ValueError for invalid values """
+    format = format.lower().lstrip('.')
+    if format == 'jpeg':
+        format = 'jpg'
+    if format not in FORMATS:
+        raise ValueError('Unsupported image format: %s' % format)
+    for value in (width, height):
+        if value is not None and (not isinstance(value, int) or value < 1):
+            raise ValueError('Invalid size of variant: %r' % value)
+
+    return Variant(suffix, format, width, height, quality)
+
+
+def read_variants(filename):
+    """ Reads a config of variants; returns list of Variant and resolution """
+    try:
+        with io.open(filename, encoding='utf-8') as fd:
+            config = json.load(fd)
+
+        variants = [make_variant(**entry) for entry in config['variants']]
+        resolution = int(config.get('resolution', DEFAULT_RESOLUTION))
+    except (ValueError, TypeError, KeyError, AttributeError) as exc:
+        raise IOError('Invalid variants config: %s: %s' % (filename, exc))
+
+    if not variants:
+        raise IOError('No variants in config: %s' % filename)
+    return variants, resolution
+
+
+def is_pillow_available():
+    """ Tests Pillow is installed """
+    try:
+        from PIL import Image  # NOQA: import test
+        return True
+    except ImportError:
+        return False
+
+
+def get_variant_filename(image_filename, variant):
+    return '%s%s.%s' % (os.path.splitext(image_filename)[0], variant.suffix,
+                        variant.format)
+
+
+def write_variants(master_filename, image_filename, variants):
+    """ Makes images of variants from the master image """
+    from PIL import Image
+
+    filenames = []
+    master = Image.open(master_filename)
+    master.load()
+    for variant in variants:
+        image = master.copy()
+        if variant.width or variant.height:
+            image.thumbnail((variant.width or image.size[0],
+                             variant.height or image.size[1]), Image.LANCZOS)
+
+        options = {}
+        if variant.format in ('gif', 'jpg'):
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                canvas = Image.new('RGB', image.size, (255, 255, 255))
+                canvas.paste(image, mask=image.split()[3])
+                image = canvas
+            else:
+                image = image.convert('RGB')
+        if variant.format == 'gif':
+            image = image.convert('P', palette=Image.ADAPTIVE)
+        if variant.format == 'jpg' and variant.quality:
+            options['quality'] = variant.quality
+
+        filename = get_variant_filename(image_filename, variant)
+        with atomic_output(filename) as temporary:
+            image.save(temporary, **options)
+        filenames.append(filename)
+
+    return filenames
+
+
+class ExportResolution(object):
+    """ Sets raster export resolution of Visio during the block """
+    def __init__(self, app, resolution):
+        self.settings = getattr(app, 'Settings', None)
+        self.resolution = resolution
+        self.saved = None
+
+    def __enter__(self):
+        if self.settings is not None and self.resolution:
+            self.saved = self.settings.GetRasterExportResolution()
+            self.settings.SetRasterExportResolution(
+                visRasterUseCustomResolution, self.resolution,
+                self.resolution, visRasterPixelsPerInch)
+        return self
+
+    def __exit__(self, *args):
+        if self.saved is not None:
+            # the application goes back to the pool; restore it
+            self.settings.SetRasterExportResolution(*self.saved)
+        return False
+
+
+def export_variants(visio_filename, image_filename, variants, pagenum=None,
+                    pagename=None, pool=None, native=False, documents=None,
+                    resolution=DEFAULT_RESOLUTION, workers=4):
+    """ Exports pages once and makes images of variants from them
+
+    Masters are exported at ``resolution`` dpi (the native renderer uses its
+    own resolution), and variants are written by ``workers`` threads while
+    Visio exports the next page.  Output filenames of pages are made like
+    export_img() from ``image_filename`` (its extension is replaced by the
+    variants).  Returns list of written filenames.
+    """
+    if not is_pillow_available():
+        raise OSError('Pillow not found. Variants require Pillow.')
+
+    image_pathname = check_output_dir(image_filename)
+    check_page_selection(visio_filename, [pagenum or pagename])
+
+    tmpdir = tempfile.mkdtemp()
+    threads = ThreadPool(workers)
+    try:
+        pending = []
+        with open_document(visio_filename, pool, native, documents) as visio:
+            with ExportResolution(getattr(visio, 'app', None), resolution):
+                pages = select_pages(visio, pagenum, pagename)
+                filenames = make_output_filenames(
+                    image_pathname, [(p.Index, p.Name) for p in pages])
+                for page, filename in zip(pages, filenames):
+                    master = os.path.join(tmpdir, '%d.png' % len(pending))
+                    raise_page_error(export_page(page, master),
+                                     'Could not write image: %s' % filename)
+                    pending.append(threads.apply_async(
+                        write_variants, (master, filename, variants)))
+
+        written = []
+        for result in pending:
+            written.extend(result.get())
+        return written
+    finally:
+        threads.close()
+        threads.join()
+        shutil.rmtree(tmpdir, ignore_errors=True)
@@ -13,19 +13,35 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from __future__ import absolute_import
+
+import io
 import os
 import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
 from math import log
 from optparse import OptionParser
 
+from visio2img import metrics
+from visio2img.backends import (
+    VisioBackend, configure_default_backend, get_backend, get_backend_names,
+    get_default_backend_name, is_module_available, select_backend
+)
+from visio2img.pool import (
+    VisioTimeout, configure_default_pool, get_default_pool
+)
+from visio2img.output import atomic_output
+from visio2img.vsdx import is_vsdx, read_pages
+
+PageResult = namedtuple('PageResult', 'index name filename size elapsed error')
+
 
 def is_pywin32_available():
-    """ Tests pywin32 is installed """
-    try:
-        import win32com  # NOQA: import test
-        return True
-    except ImportError:
-        return False
+    """ Tests pywin32 is installed (it is imported when Visio is launched) """
+    return is_module_available('win32com')
 
 
 def filter_pages(pages, pagenum, pagename):
@@ -44,15 +60,98 @@ def filter_pages(pages, pagenum, pagename):
     return pages
 
 
+def read_catalog(visio_filename):
+    """ Reads the page catalog of .vsdx or .vsd file without Visio
+
+    Returns list of PageInfo, or None if the catalog is not available.
+    Pages of .vsd files having the default names have no names (None).
+    """
+    from visio2img import vsd
+
+    try:
+        if is_vsdx(visio_filename):
+            return read_pages(visio_filename)
+        elif vsd.is_ole_file(visio_filename):
+            return vsd.read_pages(visio_filename)
+    except IOError:
+        pass
+
+    return None  # leave it to Visio
+
+
+def select_pages_from_catalog(visio_filename, pagenum=None, pagename=None):
+    """ Choices pages from the page catalog of visio file without Visio
+
+    Returns None if the catalog is not available, or if pagename is not
+    found but the catalog lacks names of some pages (.vsd file).
+    """
+    pages = read_catalog(visio_filename)
+    if pages is None:
+        return None
+    elif pagename and any(page.name is None for page in pages) and \
+            pagename not in [page.name for page in pages]:
+        return None
+
+    return filter_pages(pages, pagenum, pagename)
+
+
+def list_pages(visio_filename, pool=None):
+    """ Lists pages of visio file as PageInfo
+
+    Pages are read from the page catalog without Visio (see
+    read_catalog()).  The backend lists them only if the catalog is not
+    available, or if it lacks names of pages (default names of .vsd files
+    are localized by Visio) and the backend is available.
+    """
+    pages = read_catalog(visio_filename)
+    if pages is not None:
+        if all(page.name is not None for page in pages):
+            return pages
+        elif not get_backend().is_available():
+            return pages  # pages having default names have no names
+
+    return get_backend().list_pages(visio_filename, pool)
+
+
+def print_pages(pages, stream):
+    """ Prints list of PageInfo """
+    for page in pages:
+        name = page.name
+        if name is None:
+            name = u'(default name)'  # not known without Visio
+        line = u'%d: %s (%.2f x %.2f in)' % (page.index, name,
+                                             page.width or 0,
+                                             page.height or 0)
+        if page.background:
+            line += u' [background]'
+        stream.write(line + u'\n')
+
+
+def make_image_filenames(image_filename, count):
+    """ Makes output filenames for count pages
+
+    Multiple pages are numbered like ``output01.png``, ``output02.png``...
+    """
+    if count == 1:
+        return [image_filename]
+    else:
+        digits = int(log(count, 10)) + 1
+        basename, ext = os.path.splitext(image_filename)
+        filename_format = "%s%%0%dd%s" % (basename, digits, ext)
+        return [filename_format % (i + 1) for i in range(count)]
+
+
 class VisioFile(object):
     @classmethod
-    def Open(cls, filename):
-        obj = cls()
+    def Open(cls, filename, pool=None):
+        obj = cls(pool)
         obj.open(filename)
         return obj
 
-    def __init__(self):
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else get_default_pool()
         self.app = None
+        self.document = None
 
     def __enter__(self):
         return self
@@ -68,13 +167,7 @@ class VisioFile(object):
         if not os.path.exists(visio_pathname):
             raise IOError('No such visio file: %s', filename)
 
-        try:
-            import win32com.client
-            self.app = win32com.client.Dispatch('Visio.InvisibleApp')
-        except Exception:
-            msg = 'Visio not found. visio2img requires Visio.'
-            raise OSError(msg)
-
+        self.app = self.pool.acquire()
         try:
             if hasattr(self.app.Documents, "OpenEx"):
                 # Visio >= 4.5 supports OpenEx
@@ -83,9 +176,15 @@ class VisioFile(object):
                 visOpenCopy = 0x1
                 visOpenRO = 0x2
                 open_flags = visOpenCopy | visOpenRO
-                self.app.Documents.OpenEx(visio_pathname, open_flags)
+                with self.guard('open', filename=filename):
+                    self.document = self.app.Documents.OpenEx(visio_pathname,
+                                                              open_flags)
             else:
-                self.app.Documents.Open(visio_pathname)
+                with self.guard('open', filename=filename):
+                    self.document = self.app.Documents.Open(visio_pathname)
+        except VisioTimeout:
+            self.close()
+            raise
         except Exception:
             self.close()
             msg = 'Could not open file (already opend by other process?): %s'
@@ -93,19 +192,130 @@ class VisioFile(object):
 
     def close(self):
         if self.app:
-            self.app.Quit()
-            self.app = None
+            # close only the document; the application goes back to the pool
+            try:
+                if self.document is not None:
+                    with metrics.span('close'):
+                        self.document.Close()
+                self.pool.release(self.app)
+            except Exception:
+                self.pool.release(self.app, discard=True)
+            finally:
+                self.app = None
+                self.document = None
+
+    @contextmanager
+    def guard(self, operation, **attrs):
+        """ Measures the operation; Visio is killed if it hangs """
+        with metrics.span(operation, **attrs):
+            with self.pool.guard(self.app, operation, **attrs):
+                yield
 
     @property
     def pages(self):
-        if self.app:
-            return self.app.ActiveDocument.Pages
+        if self.document is not None:
+            pages = self.document.Pages
+        elif self.app:
+            pages = self.app.ActiveDocument.Pages
         else:
             return []
 
+        if getattr(self.pool, 'timeout', None):
+            return [GuardedPage(page, self) for page in pages]
+        else:
+            return pages
+
+
+class GuardedPage(object):
+    """ Page of VisioFile whose export is guarded by timeout of the pool """
+    def __init__(self, page, visio):
+        self.page = page
+        self.visio = visio
+
+    def __getattr__(self, name):
+        return getattr(self.page, name)
+
+    def Export(self, filename):
+        with self.visio.pool.guard(self.visio.app, 'export'):
+            self.page.Export(filename)
+
+
+def open_document(visio_filename, pool=None, native=False, documents=None):
+    """ Opens visio file with the default backend (or the native renderer)
+
+    If ``documents`` (DocumentCache) is given, the document is taken from it
+    and kept open after use.
+    """
+    backend = get_backend('native' if native else None)
+    return backend.open(visio_filename, pool, documents)
+
+
+def select_pages(visio, pagenum=None, pagename=None):
+    """ Choices pages of opened document by pagenum and pagename """
+    page_index = getattr(visio, 'page_index', None)  # of cached documents
+    if page_index is None or (pagenum and pagename):
+        return filter_pages(visio.pages, pagenum, pagename)
+    else:
+        return page_index.select(pagenum or pagename or None)
+
+
+def export_page(page, filename):
+    """ Exports a page and returns PageResult (errors are not raised) """
+    started = time.time()
+    index = name = size = error = None
+    try:
+        index = page.Index
+        name = page.Name
+        with atomic_output(filename) as temporary:
+            page.Export(temporary)
+        size = os.path.getsize(filename)
+    except Exception as exc:
+        error = exc
+
+    result = PageResult(index, name, filename, size, time.time() - started,
+                        error)
+    record_page(result)
+    return result
+
+
+def raise_page_error(result, message=None):
+    """ Raises the error of PageResult (if failed)
+
+    Errors of the filesystem are raised as they are; the others (ex. COM
+    errors) are raised as IOError with message.
+    """
+    if isinstance(result.error, EnvironmentError):
+        raise result.error
+    elif result.error:
+        raise IOError(message or 'Could not write image: %s' % (
+            result.filename,))
+
+
+def error_message(error):
+    """ Returns the message of exception as text
+
+    On Python 2, str() fails for messages having non-ASCII characters (ex.
+    page names), so the message is taken as unicode.
+    """
+    try:
+        return u'%s' % (error,)
+    except UnicodeError:  # Python 2: message of non-ASCII characters
+        message = error.args[0] if len(error.args) == 1 else repr(error.args)
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+        return message
+
 
-def export_img(visio_filename, image_filename, pagenum=None, pagename=None):
-    """ Exports images from visio file """
+def record_page(result):
+    """ Gives PageResult to metrics as a span of export """
+    metrics.record('export', result.elapsed, index=result.index,
+                   name=result.name, filename=result.filename,
+                   size=result.size,
+                   error=result.error and error_message(result.error))
+
+
+def check_output_dir(image_filename):
+    """ Returns absolute path of image_filename; its directory must exist """
     # visio requires absolute path
     image_pathname = os.path.abspath(image_filename)
 
@@ -113,26 +323,207 @@ def export_img(visio_filename, image_filename, pagenum=None, pagename=None):
         msg = 'Could not write image file: %s' % image_filename
         raise IOError(msg)
 
-    with VisioFile.Open(visio_filename) as visio:
-        pages = filter_pages(visio.pages, pagenum, pagename)
+    return image_pathname
+
+
+def make_output_filenames(image_filename, pages):
+    """ Makes output filenames for pages (list of index and name)
+
+    ``image_filename`` may be a template having ``{index}`` and ``{name}``
+    fields (ex. ``page-{index}.png``); otherwise the pages are numbered by
+    make_image_filenames().
+    """
+    dirname, basename = os.path.split(image_filename)
+    if '{' not in basename:
+        return make_image_filenames(image_filename, len(pages))
+    if isinstance(basename, bytes):
+        # Python 2: format page names (unicode) into a unicode template
+        basename = basename.decode(sys.getfilesystemencoding() or 'utf-8')
+
+    filenames = []
+    for index, name in pages:
+        for char in '\\/:*?"<>|':
+            name = name.replace(char, '_')
+        filenames.append(os.path.join(dirname, basename.format(index=index,
+                                                               name=name)))
+    return filenames
+
+
+def iter_export(visio_filename, image_filename, pagenum=None, pagename=None,
+                pool=None, native=False, documents=None):
+    """ Exports images from visio file page by page
+
+    Yields PageResult of each page as soon as it is written.  A failure of
+    a page is reported by ``error`` of the result, and the rest of pages
+    are exported anyway.  See make_output_filenames() for the filenames.
+    """
+    image_pathname = check_output_dir(image_filename)
+    check_page_selection(visio_filename, [pagenum or pagename])
+
+    with open_document(visio_filename, pool, native, documents) as visio:
+        pages = select_pages(visio, pagenum, pagename)
+        filenames = make_output_filenames(
+            image_pathname, [(page.Index, page.Name) for page in pages])
+        for page, filename in zip(pages, filenames):
+            yield export_page(page, filename)
+
+
+def export_img(visio_filename, image_filename, pagenum=None, pagename=None,
+               pool=None, cache=None, native=False, documents=None,
+               retries=1):
+    """ Exports images from visio file
+
+    Visio applications are borrowed from ``pool`` (or the default pool),
+    so successive calls do not pay for launching Visio again.  When
+    ``cache`` (ImageCache) is given, images of unchanged visio files are
+    taken from it without Visio.  If ``native`` is true, .vsdx files are
+    rendered by visio2img itself instead of Visio.  ``documents``
+    (DocumentCache) keeps documents open between calls.  When Visio is
+    killed by the timeout of the pool, the export is retried ``retries``
+    times with a fresh application.
+    """
+    image_pathname = check_output_dir(image_filename)
+
+    if cache is not None:
+        key = cache.make_key(visio_filename, pagenum, pagename,
+                             image_pathname, native)
+        if cache.get(key, image_pathname):
+            return
+
+    check_page_selection(visio_filename, [pagenum or pagename])
+
+    for attempt in range(retries + 1):
         try:
-            if len(pages) == 1:
-                pages[0].Export(image_pathname)
-            else:
-                digits = int(log(len(pages), 10)) + 1
-                basename, ext = os.path.splitext(image_pathname)
-                filename_format = "%s%%0%dd%s" % (basename, digits, ext)
+            filenames = export_document(visio_filename, image_pathname,
+                                        pagenum, pagename, pool, native,
+                                        documents)
+            break
+        except VisioTimeout:
+            if attempt == retries:
+                raise
+            metrics.record('retry', 0, filename=visio_filename)
+
+    if cache is not None:
+        cache.put(key, filenames)
+
+
+def export_document(visio_filename, image_pathname, pagenum, pagename,
+                    pool, native, documents):
+    """ Exports selected pages; raises an error of the first failed page """
+    with open_document(visio_filename, pool, native, documents) as visio:
+        pages = select_pages(visio, pagenum, pagename)
+        filenames = make_image_filenames(image_pathname, len(pages))
+        for page, filename in zip(pages, filenames):
+            raise_page_error(export_page(page, filename),
+                             'Could not write image: %s' % image_pathname)
+
+    return filenames
+
+
+def parse_output_spec(spec):
+    """ Parses ``PAGE:PATH`` of --output option to a pair of page and path
+
+    PAGE is a page number, a page name or ``*`` (all pages; returned as
+    None).
+    """
+    page, sep, path = spec.partition(':')
+    if not sep or not page or not path:
+        raise ValueError('Invalid output: %s' % spec)
+
+    if page == '*':
+        return None, path
+    elif page.isdigit():
+        return int(page), path
+    else:
+        return page, path
 
-                for i, page in enumerate(pages):
-                    filename = filename_format % (i + 1)
-                    page.Export(filename)
-        except Exception:
-            raise IOError('Could not write image: %s' % image_pathname)
+
+class PageIndex(object):
+    """ Looks up pages of a document by number and by name """
+    def __init__(self, pages, names):
+        self.pages = pages
+        self.names = {}
+        for page, name in zip(pages, names):
+            self.names.setdefault(name, page)
+
+    def select(self, page):
+        """ Returns pages selected by page number, name or None (all) """
+        if page is None:
+            return self.pages
+        elif isinstance(page, int):
+            if not 0 < page <= len(self.pages):
+                raise IndexError('Invalid page number: %d' % page)
+            return [self.pages[page - 1]]
+        elif page in self.names:
+            return [self.names[page]]
+        else:
+            raise IndexError('Page not found: pagename=%s' % page)
+
+
+def check_page_selection(visio_filename, selections):
+    """ Detects invalid page selection before launching Visio
+
+    ``selections`` is a list of page numbers, page names or None (all
+    pages); IndexError is raised for a page not in the page catalog.
+    Nothing is checked if the catalog is not available, and names not
+    found are not checked if the catalog lacks names of some pages (.vsd
+    file).
+    """
+    selections = [page for page in selections if page is not None]
+    if not selections:
+        return
+
+    catalog = read_catalog(visio_filename)
+    if catalog is not None:
+        names = [page.name for page in catalog]
+        index = PageIndex(catalog, names)
+        for page in selections:
+            if isinstance(page, int) or None not in names:
+                index.select(page)
+
+
+def export_outputs(visio_filename, outputs, pool=None, native=False,
+                   documents=None):
+    """ Exports pages of visio file to several outputs at once
+
+    ``outputs`` is a mapping (or a list of pairs) of page and image
+    filename; a page is given by page number, page name or None (all
+    pages).  The document is opened only once for all outputs.
+
+    Returns list of PageResult; failures are reported by ``error``.
+    """
+    if hasattr(outputs, 'items'):
+        outputs = list(outputs.items())
+
+    targets = [(page, check_output_dir(filename))
+               for page, filename in outputs]
+    check_page_selection(visio_filename, [page for page, _ in targets])
+
+    results = []
+    with open_document(visio_filename, pool, native, documents) as visio:
+        index = getattr(visio, 'page_index', None)  # of cached documents
+        if index is None:
+            pages = list(visio.pages)
+            index = PageIndex(pages, [page.Name for page in pages])
+        for page, image_pathname in targets:
+            selected = index.select(page)
+            filenames = make_output_filenames(
+                image_pathname, [(p.Index, p.Name) for p in selected])
+            for selected_page, filename in zip(selected, filenames):
+                results.append(export_page(selected_page, filename))
+
+    return results
 
 
 def parse_options(args):
     """ Parses command line options """
-    usage = 'usage: %prog [options] visio_filename image_filename'
+    usage = ('usage: %prog [options] visio_filename image_filename\n'
+             '       %prog -o PAGE:PATH [-o PAGE:PATH]... visio_filename\n'
+             '       %prog --batch [options] (file|dir|glob)...\n'
+             '       %prog --list visio_filename...\n'
+             '       %prog --extract (file|dir|glob)...\n'
+             '       %prog --watch [options] dir...\n'
+             '       %prog --serve [--address HOST:PORT] [--jobs N]')
     parser = OptionParser(usage=usage)
     parser.add_option('-p', '--page', action='store',
                       type='int', dest='pagenum',
@@ -140,32 +531,687 @@ def parse_options(args):
     parser.add_option('-n', '--name', action='store',
                       type='string', dest='pagename',
                       help='pick a page by page name')
+    parser.add_option('-o', '--output', action='append',
+                      type='string', dest='outputs', metavar='PAGE:PATH',
+                      help='export PAGE (number, name or *) to PATH; '
+                           'can be repeated to open the file only once')
+    parser.add_option('--variants', action='store',
+                      type='string', dest='variants', metavar='CONFIG',
+                      help='export each page once and make images of the '
+                           'variants described in CONFIG (JSON)')
+    parser.add_option('--tile-size', action='store',
+                      type='int', dest='tile_size', metavar='PIXELS',
+                      help='export large pages as tiles of PIXELS and '
+                           'stitch them into a PNG')
+    parser.add_option('--pyramid', action='store_true',
+                      dest='pyramid', default=False,
+                      help='write tiles as a Deep Zoom image (.dzi)')
+    parser.add_option('--dpi', action='store',
+                      type='int', dest='dpi',
+                      help='resolution of tiled export (default: 300)')
+    parser.add_option('-l', '--list', action='store_true',
+                      dest='list', default=False,
+                      help='list pages of visio files')
+    parser.add_option('-x', '--extract', action='store_true',
+                      dest='extract', default=False,
+                      help='write text and metadata of pages of .vsdx '
+                           'files as JSON Lines (without Visio)')
+    parser.add_option('-b', '--batch', action='store_true',
+                      dest='batch', default=False,
+                      help='convert many visio files in one process')
+    parser.add_option('-w', '--watch', action='store_true',
+                      dest='watch', default=False,
+                      help='watch directories and export changed files')
+    parser.add_option('--interval', action='store',
+                      type='float', dest='interval', default=1.0,
+                      help='polling interval of watch mode in seconds '
+                           '(default: 1.0)')
+    parser.add_option('-d', '--output-dir', action='store',
+                      type='string', dest='output_dir', default='.',
+                      help='output directory of batch and watch mode '
+                           '(default: .)')
+    parser.add_option('-f', '--format', action='store',
+                      type='choice', dest='format', default='png',
+                      choices=['gif', 'jpg', 'png', 'svg'],
+                      help='image format of batch and watch mode '
+                           '(default: png)')
+    parser.add_option('-m', '--manifest', action='store',
+                      type='string', dest='manifest',
+                      help='read pairs of visio file and output from file')
+    parser.add_option('--ledger', action='store',
+                      type='string', dest='ledger',
+                      help='record jobs of batch mode to FILE (SQLite) and '
+                           'convert only unfinished ones')
+    parser.add_option('--lease-timeout', action='store',
+                      type='float', dest='lease_timeout',
+                      help='lease jobs of the ledger again after SECONDS '
+                           'if not finished (default: 600)')
+    parser.add_option('-j', '--jobs', action='store',
+                      type='int', dest='jobs', default=1,
+                      help='export pages (or files in batch mode) by N '
+                           'Visio processes in parallel (default: 1)')
+    parser.add_option('--cache-dir', action='store',
+                      type='string', dest='cache_dir',
+                      help='reuse images of unchanged files from the cache '
+                           'directory (default: $VISIO2IMG_CACHE_DIR)')
+    parser.add_option('--cache-size', action='store',
+                      type='int', dest='cache_size', default=1024,
+                      help='maximum size of the cache in MB (default: 1024)')
+    parser.add_option('--no-cache', action='store_false',
+                      dest='use_cache', default=True,
+                      help='do not use the cache')
+    parser.add_option('--incremental', action='store_true',
+                      dest='incremental', default=False,
+                      help='export only pages changed from the last export')
+    parser.add_option('--recompress', action='store_true',
+                      dest='recompress', default=False,
+                      help='recompress written PNG and JPG images losslessly')
+    parser.add_option('--dedup', action='store_true',
+                      dest='dedup', default=False,
+                      help='replace byte-identical images by hard links')
+    parser.add_option('--native', action='store_true',
+                      dest='native', default=False,
+                      help='render .vsdx files without Visio (experimental)')
+    parser.add_option('--backend', action='store',
+                      type='string', dest='backend',
+                      help='convert by the backend NAME (default: chosen '
+                           'by the platform and the input)')
+    parser.add_option('--serve', action='store_true',
+                      dest='serve', default=False,
+                      help='run a conversion server keeping Visio warm')
+    parser.add_option('--address', action='store',
+                      type='string', dest='address',
+                      default='127.0.0.1:8077',
+                      help='address of the server (default: 127.0.0.1:8077)')
+    parser.add_option('--queue-size', action='store',
+                      type='int', dest='queue_size', default=16,
+                      help='maximum number of jobs waiting in the server '
+                           '(default: 16)')
+    parser.add_option('--root', action='append',
+                      type='string', dest='roots',
+                      help='let the server read and write files only under '
+                           'DIR (repeatable; default: current directory)')
+    parser.add_option('--server', action='store',
+                      type='string', dest='server',
+                      default=os.environ.get('VISIO2IMG_SERVER'),
+                      help='convert on the server at URL '
+                           '(default: $VISIO2IMG_SERVER)')
+    parser.add_option('--timeout', action='store',
+                      type='float', dest='timeout',
+                      help='kill Visio not responding in SECONDS while '
+                           'opening a file or exporting a page, and retry')
+    parser.add_option('--max-memory', action='store',
+                      type='int', dest='max_memory',
+                      help='restart Visio using more than MB of memory')
+    parser.add_option('--metrics', action='store',
+                      type='choice', dest='metrics', choices=['json'],
+                      help='write timing of each phase (launch, open, '
+                           'export, close and quit) in FORMAT (json)')
+    parser.add_option('--metrics-output', action='store',
+                      type='string', dest='metrics_output',
+                      help='write metrics to FILE (default: stderr)')
     options, argv = parser.parse_args(args)
 
     if options.pagenum and options.pagename:
         parser.error('options --page and --name are mutually exclusive')
 
+    if options.jobs < 1:
+        parser.error('option --jobs must be positive: %d' % options.jobs)
+
+    if options.cache_dir is None and not options.server:
+        options.cache_dir = os.environ.get('VISIO2IMG_CACHE_DIR')
+
+    if options.timeout is not None and options.timeout <= 0:
+        parser.error('option --timeout must be positive: %s' %
+                     options.timeout)
+    if options.max_memory is not None and options.max_memory < 1:
+        parser.error('option --max-memory must be positive: %d' %
+                     options.max_memory)
+
+    if options.backend:
+        if options.backend not in get_backend_names():
+            parser.error('Unknown backend: %s' % options.backend)
+        if options.native and options.backend != 'native':
+            parser.error('--native is exclusive with --backend')
+        options.native = options.backend == 'native'
+    elif options.native:
+        options.backend = 'native'
+
+    if options.serve:
+        if argv:
+            parser.print_usage(sys.stderr)
+            parser.exit()
+        if not options.address.rpartition(':')[2].isdigit():
+            parser.error('Invalid address: %s' % options.address)
+        if options.queue_size < 1:
+            parser.error('option --queue-size must be positive: %d' %
+                         options.queue_size)
+        for root in options.roots or []:
+            if not os.path.isdir(root):
+                parser.error('No such directory: %s' % root)
+        return options, argv
+
+    if options.roots:
+        parser.error('--root is available only with --serve')
+
+    if options.list:
+        if not argv:
+            parser.print_usage(sys.stderr)
+            parser.exit()
+        return options, argv
+
+    if options.extract:
+        if not argv:
+            parser.print_usage(sys.stderr)
+            parser.exit()
+        if options.batch or options.watch:
+            parser.error('--extract is exclusive with --batch and --watch')
+        return options, argv
+
+    if options.server:
+        # these are options of the local Visio; the server does not take them
+        if options.batch or options.watch:
+            parser.error('--server (or $VISIO2IMG_SERVER) is not supported '
+                         'with --batch and --watch')
+        if any((options.jobs > 1, options.cache_dir, options.timeout,
+                options.max_memory)):
+            parser.error('--jobs, --cache-dir, --timeout and --max-memory '
+                         'are not supported with --server')
+
+    if not options.server and (argv or options.batch or options.watch):
+        # formats and modes depend on the backend; choose it first
+        try:
+            options.backend = choose_backend(options, argv)
+            options.native = options.backend == 'native'
+        except OSError:
+            pass  # no backend; reported on conversion
+
+    formats = ['.gif', '.jpg', '.png']
+    if options.native:
+        formats.append('.svg')
+    visio = options.backend is None or isinstance(get_backend(options.backend),
+                                                  VisioBackend)
+
+    tiled = options.tile_size is not None or options.pyramid
+    if options.tile_size is not None and options.tile_size < 1:
+        parser.error('option --tile-size must be positive: %d' %
+                     options.tile_size)
+    if options.dpi is not None and options.dpi < 1:
+        parser.error('option --dpi must be positive: %d' % options.dpi)
+    if options.dpi is not None and not tiled:
+        parser.error('--dpi is available only with --tile-size and '
+                     '--pyramid')
+    if tiled and any((options.batch, options.watch, options.outputs,
+                      options.variants, options.incremental, options.server)):
+        parser.error('--tile-size and --pyramid are not supported with '
+                     '--batch, --watch, --output, --variants, '
+                     '--incremental and --server')
+    if tiled and not visio:
+        parser.error('--tile-size and --pyramid require the Visio backend '
+                     '(backend: %s)' % options.backend)
+
+    if (options.recompress or options.dedup) and any((
+            tiled, options.watch, options.outputs, options.variants,
+            options.incremental, options.server)):
+        parser.error('--recompress and --dedup are not supported with '
+                     '--tile-size, --pyramid, --watch, --output, '
+                     '--variants, --incremental and --server')
+
+    if options.watch:
+        if not argv:
+            parser.print_usage(sys.stderr)
+            parser.exit()
+        if any((options.batch, options.outputs, options.variants,
+                options.incremental)):
+            parser.error('--watch is exclusive with --batch, --output, '
+                         '--variants and --incremental')
+        if options.interval <= 0:
+            parser.error('option --interval must be positive: %s' %
+                         options.interval)
+        if '.' + options.format not in formats:
+            parser.error('Unsupported image format: %s' % options.format)
+        return options, argv
+
+    if options.ledger and not options.batch:
+        parser.error('--ledger is available only in batch mode')
+    if options.lease_timeout is not None:
+        if not options.ledger:
+            parser.error('--lease-timeout is available only with --ledger')
+        if options.lease_timeout <= 0:
+            parser.error('option --lease-timeout must be positive: %s' %
+                         options.lease_timeout)
+
+    if options.batch:
+        if not argv and not options.manifest and not options.ledger:
+            parser.print_usage(sys.stderr)
+            parser.exit()
+        if options.incremental:
+            parser.error('--incremental is not supported in batch mode')
+        if options.outputs:
+            parser.error('--output is not supported in batch mode')
+        if options.variants:
+            parser.error('--variants is not supported in batch mode')
+        if '.' + options.format not in formats:
+            parser.error('Unsupported image format: %s' % options.format)
+        return options, argv
+
+    if options.outputs:
+        if len(argv) != 1:
+            parser.print_usage(sys.stderr)
+            parser.exit()
+        if options.pagenum or options.pagename:
+            parser.error('--output is exclusive with --page and --name')
+        if options.incremental or options.server or options.variants:
+            parser.error('--output is not supported with --incremental, '
+                         '--server and --variants')
+
+        outputs = []
+        for spec in options.outputs:
+            try:
+                page, path = parse_output_spec(spec)
+            except ValueError as exc:
+                parser.error(str(exc))
+            if os.path.splitext(path)[1].lower() not in formats:
+                parser.error('Unsupported image format: %s' % path)
+            outputs.append((page, path))
+        options.outputs = outputs
+        return options, argv
+
     if len(argv) != 2:
         parser.print_usage(sys.stderr)
         parser.exit()
 
+    if options.variants:
+        if options.incremental or options.server:
+            parser.error('--variants is not supported with --incremental '
+                         'and --server')
+        if not visio:
+            # resolution of the masters is a setting of Visio
+            parser.error('--variants requires the Visio backend '
+                         '(backend: %s)' % options.backend)
+        return options, argv  # formats are given by the variants
+
+    if tiled:
+        ext = '.dzi' if options.pyramid else '.png'
+        if os.path.splitext(argv[1])[1].lower() != ext:
+            parser.error('Tiled export writes %s files: %s' % (ext, argv[1]))
+        return options, argv
+
     output_ext = os.path.splitext(argv[1])[1].lower()
-    if output_ext not in ('.gif', '.jpg', '.png'):
+    if output_ext not in formats:
         parser.error('Unsupported image format: %s' % argv[1])
 
     return options, argv
 
 
-def main(args=sys.argv[1:]):
-    """ main funcion of visio2img """
-    if not is_pywin32_available():
-        sys.stderr.write('win32com module not found')
+def get_pool_options(options):
+    """ Makes options of VisioAppPool from command line options """
+    pool_options = {}
+    if options.timeout:
+        pool_options['timeout'] = options.timeout
+    if options.max_memory:
+        pool_options['max_memory'] = options.max_memory * 1024 * 1024
+    return pool_options
+
+
+def make_cache(options):
+    """ Makes ImageCache from command line options (or None) """
+    if options.cache_dir and options.use_cache:
+        from visio2img.cache import ImageCache
+        return ImageCache(options.cache_dir, options.cache_size * 1024 * 1024)
+    else:
+        return None
+
+
+def convert_batch(options, argv):
+    """ Converts many visio files reusing Visio (--batch mode) """
+    from visio2img.batch import collect_jobs, read_manifest, run_batch
+
+    jobs = collect_jobs(argv, options.output_dir, '.' + options.format)
+    if options.manifest:
+        jobs += read_manifest(options.manifest)
+
+    kwargs = dict(pagenum=options.pagenum, pagename=options.pagename,
+                  cache=make_cache(options), native=options.native)
+    with make_output_stage(options) as stage:
+        if options.jobs > 1:
+            from visio2img.parallel import ParallelExporter
+            with ParallelExporter(options.jobs) as exporter:
+                convert = partial(exporter.run_batch, **kwargs)
+                failed = convert_jobs(options, jobs,
+                                      staged(convert, stage, options))
+        else:
+            convert = partial(run_batch, **kwargs)
+            failed = convert_jobs(options, jobs,
+                                  staged(convert, stage, options))
+    print_output_summary(stage)
+
+    if failed:
         return -1
+    else:
+        return 0
+
+
+def make_output_stage(options):
+    """ Makes OutputStage from command line options """
+    from visio2img.output import OutputStage
+    return OutputStage(options.recompress, options.dedup, max(options.jobs, 2))
+
+
+def staged(convert, stage, options):
+    """ Wraps convert of batch jobs to give the outputs to stage """
+    from visio2img.batch import find_outputs
+
+    if not (stage.recompress or stage.dedup):
+        return convert
+
+    def convert_staged(jobs):
+        for result in convert(jobs):
+            if result.error is None:
+                stage.add(find_outputs(result.job.image_filename))
+                if options.ledger:
+                    stage.wait()  # the ledger records checksums of outputs
+            yield result
 
+    return convert_staged
+
+
+def print_output_summary(stage):
+    """ Prints bytes saved by the output stage (if enabled) """
+    if stage.recompress or stage.dedup:
+        sys.stdout.write('%s\n' % stage.summary())
+
+
+def get_ledger_options(options):
+    """ Describes options changing images of batch jobs (key of ledger) """
+    return 'backend=%s page=%s name=%s' % (get_default_backend_name(),
+                                           options.pagenum or '',
+                                           options.pagename or '')
+
+
+def convert_jobs(options, jobs, convert):
+    """ Converts jobs (through the ledger if given)
+
+    Returns the number of failures (and of jobs left unfinished in the
+    ledger).
+    """
+    from visio2img.batch import print_summary
+
+    if not options.ledger:
+        return print_summary(convert(jobs), sys.stdout)
+
+    from visio2img.ledger import DEFAULT_LEASE_TIMEOUT, JobLedger, run_ledger
+    ledger = JobLedger(options.ledger,
+                       options.lease_timeout or DEFAULT_LEASE_TIMEOUT,
+                       options=get_ledger_options(options))
+    with ledger:
+        # without inputs, all jobs in the ledger are resumed
+        ledger.add(jobs or ledger.jobs())
+        ledger.verify()
+        ledger.reclaim()  # leased by this host's processes which died
+
+        results = run_ledger(ledger, convert, options.jobs)
+        try:
+            failed = print_summary(results, sys.stdout)
+        finally:
+            results.close()  # gives the leases back if interrupted
+
+        # leased by other workers (or by crashed workers of other hosts)
+        counts = ledger.counts()
+        unfinished = counts['pending'] + counts['leased']
+        if unfinished:
+            sys.stdout.write('%d unfinished (leased by other workers)\n' %
+                             unfinished)
+        return failed + unfinished
+
+
+def watch(options, argv):
+    """ Exports changed files until interrupted (--watch mode) """
+    from visio2img.pool import VisioAppPool
+    from visio2img.watch import Watcher
+
+    # keep Visio warm while watching
+    with VisioAppPool(idle_timeout=None, **get_pool_options(options)) as pool:
+        watcher = Watcher(argv, options.output_dir, '.' + options.format,
+                          options.pagenum, options.pagename, pool=pool,
+                          native=options.native, interval=options.interval)
+        try:
+            watcher.run(sys.stdout)
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+
+def serve(options):
+    """ Runs a conversion server (--serve mode) """
+    from visio2img.server import ConversionServer
+
+    server = ConversionServer(options.address, options.jobs,
+                              options.queue_size, log=sys.stderr,
+                              roots=options.roots)
+    sys.stderr.write('Serving on %s\n' % server.url)
     try:
-        options, argv = parse_options(args)
-        export_img(argv[0], argv[1], options.pagenum, options.pagename)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+    return 0
+
+
+def convert_remote(options, argv):
+    """ Converts a visio file on the server (--server mode) """
+    from visio2img.server import ConversionClient
+
+    client = ConversionClient(options.server)
+    client.convert(argv[0], argv[1], options.pagenum, options.pagename,
+                   options.native)
+    return 0
+
+
+def convert_outputs(options, argv):
+    """ Exports pages to several outputs (--output option) """
+    results = export_outputs(argv[0], options.outputs,
+                             native=options.native)
+    for result in results:
+        raise_page_error(result)
+    return 0
+
+
+def convert_variants(options, argv):
+    """ Makes images of variants from each page (--variants option) """
+    from visio2img.variants import export_variants, read_variants
+
+    variants, resolution = read_variants(options.variants)
+    export_variants(argv[0], argv[1], variants, options.pagenum,
+                    options.pagename, native=options.native,
+                    resolution=resolution)
+    return 0
+
+
+def convert_tiled(options, argv):
+    """ Exports pages as tiles (--tile-size and --pyramid options) """
+    from visio2img.tiles import DEFAULT_DPI, DEFAULT_TILE_SIZE, export_tiled
+
+    export_tiled(argv[0], argv[1], options.pagenum, options.pagename,
+                 dpi=options.dpi or DEFAULT_DPI,
+                 tile_size=options.tile_size or DEFAULT_TILE_SIZE,
+                 pyramid=options.pyramid)
+    return 0
+
+
+def list_pages_command(argv):
+    """ Prints pages of visio files (--list mode) """
+    for visio_filename in argv:
+        if len(argv) > 1:
+            sys.stdout.write('%s:\n' % visio_filename)
+        print_pages(list_pages(visio_filename), sys.stdout)
+
+    return 0
+
+
+def extract_command(argv):
+    """ Writes text and metadata of visio files as JSON Lines (--extract) """
+    from visio2img.batch import find_visio_files
+    from visio2img.extract import iter_records, write_record
+
+    failed = 0
+    for path in argv:
+        for _, filename in find_visio_files(path):
+            try:
+                for record in iter_records(filename, lazy=True):
+                    write_record(record, sys.stdout)
+            except IOError as exc:
+                sys.stderr.write('error: %s\n' % exc)
+                failed += 1
+
+    return 1 if failed else 0
+
+
+def run_with_metrics(options, argv):
+    """ Runs the command measuring its phases (--metrics option) """
+    collected = metrics.Metrics()
+    try:
+        with collected:
+            try:
+                return run_command(options, argv)
+            finally:
+                get_default_pool().close()  # measure quitting Visio too
+    finally:
+        if options.metrics_output:
+            with io.open(options.metrics_output, 'w', encoding='utf-8') as fd:
+                collected.write_json(fd)
+        else:
+            collected.write_json(sys.stderr)
+
+
+def collect_inputs(options, argv):
+    """ Returns visio files given to --batch and --watch (found for now) """
+    from visio2img.batch import find_visio_files, read_manifest
+
+    inputs = []
+    try:
+        for path in argv:
+            inputs.extend(filename for _, filename in find_visio_files(path))
+        if options.batch and options.manifest:
+            inputs.extend(job.visio_filename
+                          for job in read_manifest(options.manifest))
+    except IOError:
+        pass  # reported on conversion
+
+    return inputs
+
+
+def choose_backend(options, argv):
+    """ Chooses the backend by options, or by the platform and the input
+
+    In --batch and --watch modes, the backend is chosen for the files found
+    when started: a backend of their type if all of them have one type
+    (ex. the native renderer for .vsdx files), or a backend for any visio
+    files.
+    """
+    if options.backend:
+        return options.backend
+    elif options.batch or options.watch:
+        inputs = collect_inputs(options, argv)
+        extensions = set(os.path.splitext(filename)[1].lower()
+                         for filename in inputs)
+        if len(extensions) == 1:
+            return select_backend(inputs[0])
+        else:
+            return select_backend()  # for any visio files
+    else:
+        return select_backend(argv[0])
+
+
+def configure_backend(options, argv):
+    """ Configures the backend chosen as the default """
+    backend = choose_backend(options, argv)
+    configure_default_backend(backend)
+    options.native = backend == 'native'
+
+
+def run_command(options, argv):
+    """ Runs the command specified by options """
+    if options.list:
+        # .vsdx files can be listed without Visio
+        return list_pages_command(argv)
+
+    if options.extract:
+        return extract_command(argv)
+
+    if options.serve:
+        configure_default_backend(options.backend)
+        return serve(options)
+
+    if options.server:
+        # Visio runs on the server
+        return convert_remote(options, argv)
+
+    configure_backend(options, argv)
+
+    pool_options = get_pool_options(options)
+    if pool_options:
+        configure_default_pool(**pool_options)
+
+    if options.watch:
+        return watch(options, argv)
+
+    if options.batch:
+        return convert_batch(options, argv)
+
+    if options.outputs:
+        return convert_outputs(options, argv)
+
+    if options.variants:
+        return convert_variants(options, argv)
+
+    if options.tile_size or options.pyramid:
+        return convert_tiled(options, argv)
+
+    if options.incremental:
+        from visio2img.incremental import export_incremental
+        export_incremental(argv[0], argv[1], options.pagenum,
+                           options.pagename, native=options.native)
         return 0
+
+    kwargs = {}
+    cache = make_cache(options)
+    if cache:
+        kwargs['cache'] = cache
+    if options.native:
+        kwargs['native'] = True
+
+    if options.jobs > 1:
+        from visio2img.parallel import ParallelExporter
+        with ParallelExporter(options.jobs) as exporter:
+            exporter.export_img(argv[0], argv[1], options.pagenum,
+                                options.pagename, **kwargs)
+    else:
+        export_img(argv[0], argv[1], options.pagenum, options.pagename,
+                   **kwargs)
+
+    if options.recompress or options.dedup:
+        from visio2img.batch import find_outputs
+        with make_output_stage(options) as stage:
+            stage.add(find_outputs(argv[1]))
+        print_output_summary(stage)
+    return 0
+
+
+def main(args=sys.argv[1:]):
+    """ main funcion of visio2img """
+    backend = get_default_backend_name()
+    try:
+        options, argv = parse_options(args)
+        if options.metrics:
+            return run_with_metrics(options, argv)
+        else:
+            return run_command(options, argv)
     except (IOError, OSError, IndexError) as err:
         sys.stderr.write("error: %s" % err)
         return -1
+    finally:
+        configure_default_backend(backend)
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Reader of legacy binary Visio files (.vsd)
+
+A .vsd file is an OLE2 compound file.  The document is stored in its
+``VisioDocument`` stream as a tree of (mostly compressed) streams; this
+module reads the page catalog and the document properties without Visio.
+Only the file format of Visio 2003-2010 (version 11) is supported.
+
+Names of pages having the default names (ex. "Page-1") are not decoded:
+they are localized by Visio on loading.
+"""
+
+from __future__ import absolute_import
+
+import codecs
+import re
+import struct
+
+from visio2img.vsdx import PageInfo
+
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+NOSTREAM = 0xFFFFFFFF
+
+STGTY_STORAGE = 1
+STGTY_STREAM = 2
+STGTY_ROOT = 5
+
+DOCUMENT_STREAM = 'VisioDocument'
+SUMMARY_STREAM = '\x05SummaryInformation'
+DOCUMENT_SIGNATURE = b'Visio (TM) Drawing\r\n'
+FORMAT_VERSION = 11
+
+# types of streams and chunks
+VSD_TRAILER_STREAM = 0x14
+VSD_PAGE = 0x15
+VSD_PAGES = 0x27
+VSD_NAME_LIST2 = 0x32
+VSD_NAME2 = 0x33
+VSD_PAGE_PROPS = 0x92
+VSD_NAMEIDX = 0xc9
+BACKGROUND_FORMATS = (0xd2, 0xd6)
+
+# universal names given to pages by Visio
+DEFAULT_PAGE_NAME = re.compile(r'^(Page|Background)-\d+$')
+
+# property ids of SummaryInformation
+SUMMARY_PROPERTIES = {2: 'title', 3: 'subject', 4: 'author', 5: 'keywords',
+                      6: 'comments', 7: 'template', 8: 'last_author',
+                      18: 'application'}
+PID_CODEPAGE = 1
+VT_LPSTR = 0x1e
+
+
+def is_ole_file(filename):
+    """ Tests the file is an OLE2 compound file """
+    try:
+        with open(filename, 'rb') as fd:
+            return fd.read(8) == OLE_SIGNATURE
+    except (IOError, OSError):
+        return False
+
+
+class CompoundFile(object):
+    """ Read-only OLE2 compound file held in memory """
+    def __init__(self, data):
+        if data[:8] != OLE_SIGNATURE or len(data) < 512:
+            raise IOError('Not an OLE2 compound file')
+
+        header = struct.unpack('<8s16sHHHHH6sIIIIIIIII', data[:76])
+        self.data = data
+        self.sector_size = 1 << header[5]
+        self.mini_sector_size = 1 << header[6]
+        self.mini_cutoff = header[12]
+        first_dir = header[10]
+        first_minifat, minifat_count = header[13], header[14]
+        first_difat, difat_count = header[15], header[16]
+
+        difat = list(struct.unpack('<109I', data[76:512]))
+        sector = first_difat
+        for _ in range(difat_count):
+            if sector in (ENDOFCHAIN, FREESECT):
+                break
+            entries = struct.unpack('<%dI' % (self.sector_size // 4),
+                                    self.read_sector(sector))
+            difat.extend(entries[:-1])
+            sector = entries[-1]
+
+        self.fat = []
+        for sector in difat:
+            if sector == FREESECT:
+                continue
+            self.fat.extend(struct.unpack('<%dI' % (self.sector_size // 4),
+                                          self.read_sector(sector)))
+
+        self.entries = self.read_directory(self.read_chain(first_dir))
+        root = self.entries[0]
+        self.mini_stream = self.read_chain(root['start'], root['size'])
+        minifat = self.read_chain(first_minifat) if minifat_count else b''
+        self.minifat = struct.unpack('<%dI' % (len(minifat) // 4), minifat)
+
+    @classmethod
+    def open(cls, filename):
+        with open(filename, 'rb') as fd:
+            return cls(fd.read())
+
+    def read_sector(self, sector):
+        offset = (sector + 1) * self.sector_size
+        return self.data[offset:offset + self.sector_size]
+
+    def read_chain(self, start, size=None):
+        chunks = []
+        sector = start
+        visited = set()
+        while sector not in (ENDOFCHAIN, FREESECT):
+            if sector in visited or sector >= len(self.fat):
+                raise IOError('Broken sector chain in compound file')
+            visited.add(sector)
+            chunks.append(self.read_sector(sector))
+            sector = self.fat[sector]
+
+        data = b''.join(chunks)
+        return data if size is None else data[:size]
+
+    def read_mini_chain(self, start, size):
+        chunks = []
+        sector = start
+        visited = set()
+        while sector not in (ENDOFCHAIN, FREESECT):
+            if sector in visited or sector >= len(self.minifat):
+                raise IOError('Broken sector chain in compound file')
+            visited.add(sector)
+            offset = sector * self.mini_sector_size
+            chunks.append(self.mini_stream[offset:
+                                           offset + self.mini_sector_size])
+            sector = self.minifat[sector]
+
+        return b''.join(chunks)[:size]
+
+    def read_directory(self, data):
+        entries = []
+        for offset in range(0, len(data) - 127, 128):
+            entry = data[offset:offset + 128]
+            name_size, kind = struct.unpack('<HB', entry[64:67])
+            left, right, child = struct.unpack('<III', entry[68:80])
+            start, size = struct.unpack('<II', entry[116:124])
+            name = entry[:max(name_size - 2, 0)].decode('utf-16-le')
+            entries.append({'name': name, 'type': kind, 'left': left,
+                            'right': right, 'child': child, 'start': start,
+                            'size': size})
+        return entries
+
+    def children(self, index):
+        """ Returns entries of the storage (tree of siblings flattened) """
+        found = []
+        stack = [self.entries[index]['child']]
+        while stack:
+            sid = stack.pop()
+            if sid == NOSTREAM or sid >= len(self.entries):
+                continue
+            entry = self.entries[sid]
+            found.append(entry)
+            stack.append(entry['left'])
+            stack.append(entry['right'])
+        return found
+
+    def find(self, path):
+        """ Returns directory entry of ``path`` (ex. 'VisioDocument') """
+        index = 0
+        for name in path.split('/'):
+            for sid, entry in enumerate(self.entries):
+                if entry in self.children(index) and \
+                        entry['name'].lower() == name.lower():
+                    index = sid
+                    break
+            else:
+                return None
+        return self.entries[index]
+
+    def read_stream(self, path):
+        """ Returns content of the stream """
+        entry = self.find(path)
+        if entry is None or entry['type'] != STGTY_STREAM:
+            raise IOError('No such stream in compound file: %s' % path)
+
+        if entry['size'] < self.mini_cutoff:
+            return self.read_mini_chain(entry['start'], entry['size'])
+        else:
+            return self.read_chain(entry['start'], entry['size'])
+
+    def listdir(self):
+        return sorted(entry['name'] for entry in self.children(0))
+
+
+def decompress(data):
+    """ Decompresses a stream of VisioDocument (LZ77 with 4KB window) """
+    data = bytearray(data)
+    window = bytearray(4096)
+    output = bytearray()
+    pos = offset = 0
+    while offset < len(data) - 1:
+        flags = data[offset]
+        offset += 1
+        for bit in range(8):
+            if offset >= len(data):
+                break
+            if flags & (1 << bit):
+                window[pos & 4095] = data[offset]
+                output.append(data[offset])
+                offset += 1
+                pos += 1
+            else:
+                if offset > len(data) - 2:
+                    break
+                low, high = data[offset], data[offset + 1]
+                offset += 2
+                length = (high & 15) + 3
+                pointer = ((high & 0xf0) << 4) | low
+                if pointer > 4078:
+                    pointer -= 4078
+                else:
+                    pointer += 18
+                for i in range(length):
+                    window[(pos + i) & 4095] = window[(pointer + i) & 4095]
+                    output.append(window[(pointer + i) & 4095])
+                pos += length
+
+    return bytes(output)
+
+
+class Pointer(object):
+    """ Pointer to a stream in VisioDocument """
+    def __init__(self, data, offset):
+        (self.type, self.offset, self.length,
+         self.format) = struct.unpack('<I4xIIH', data[offset:offset + 18])
+        self.type &= 0xffff
+
+    @property
+    def compressed(self):
+        return bool(self.format & 2)
+
+    @property
+    def has_pointers(self):
+        return (self.format >> 4) in (0, 4, 5)
+
+
+class VisioDocument(object):
+    """ VisioDocument stream of .vsd file """
+    def __init__(self, data):
+        if not data.startswith(DOCUMENT_SIGNATURE) or len(data) < 0x36:
+            raise IOError('Not a visio document')
+
+        self.data = data
+        self.version = bytearray(data)[0x1a]
+        if self.version != FORMAT_VERSION:
+            raise IOError('Unsupported version of visio document: %d' %
+                          self.version)
+
+        self.trailer = Pointer(data, 0x24)
+
+    def read(self, pointer):
+        """ Returns the content of the stream pointed by pointer """
+        data = self.data[pointer.offset:pointer.offset + pointer.length]
+        if len(data) != pointer.length:
+            raise IOError('Broken stream in visio document')
+        if pointer.compressed:
+            return decompress(data)
+        else:
+            return data
+
+    def pointers(self, pointer):
+        """ Returns list of (index, Pointer) in the stream in the order
+
+        Pointers not in the order (ex. the name index of pages) follow.
+        """
+        data = self.read(pointer)
+        shift = 4 if pointer.compressed else 0
+        offset = shift + struct.unpack('<I', data[shift:shift + 4])[0] - 4
+        order_size, count = struct.unpack('<Ii', data[offset:offset + 8])
+        offset += 12
+
+        pointers = []
+        for i in range(count):
+            pointers.append(Pointer(data, offset))
+            offset += 18
+
+        order = struct.unpack('<%dI' % order_size,
+                              data[offset:offset + order_size * 4])
+        if not order or max(order) >= count:
+            order = range(count)
+        ordered = set(order)
+        order = list(order) + [i for i in range(count) if i not in ordered]
+
+        return [(i, pointers[i]) for i in order if pointers[i].type != 0]
+
+    def find(self, pointer, kind):
+        """ Returns list of (index, Pointer) of the kind under the stream """
+        return [(i, child) for i, child in self.pointers(pointer)
+                if child.type == kind]
+
+
+def iter_chunks(data):
+    """ Yields (type, data) of chunks in a stream of VisioDocument """
+    data = bytearray(data)
+    offset = 0
+    while offset + 19 <= len(data):
+        if data[offset] == 0:  # padding
+            offset += 1
+            continue
+
+        kind, _, chunk_list, length, level, unknown = \
+            struct.unpack('<IIIIHB', bytes(data[offset:offset + 19]))
+        trailer = 0
+        if chunk_list or kind in (0x0d, 0x2c, 0x64, 0x65, 0x66, 0x69, 0x6a,
+                                  0x6b, 0x70, 0x71):
+            trailer += 8
+        if chunk_list or (level == 2 and unknown == 0x55) or \
+                (level == 2 and unknown == 0x54 and kind == 0xaa) or \
+                (level == 3 and unknown not in (0x50, 0x54)):
+            trailer += 4
+        if kind in (0x1f, 0xc9):
+            trailer = 0
+
+        offset += 19
+        yield kind, bytes(data[offset:offset + length])
+        offset += length + trailer
+
+
+def read_page_size(data):
+    """ Returns (width, height) of the page in inches from a page stream """
+    for kind, chunk in iter_chunks(data):
+        if kind == VSD_PAGE_PROPS and len(chunk) >= 18:
+            return struct.unpack('<xdxd', chunk[:18])
+
+    return None, None
+
+
+def read_names(document):
+    """ Returns a dict of name ids to the names in the name list """
+    names = {}
+    for _, stream in document.find(document.trailer, VSD_NAME_LIST2):
+        for name_id, pointer in document.find(stream, VSD_NAME2):
+            data = document.read(pointer)
+            shift = 4 if pointer.compressed else 0
+            text = data[shift + 4:]
+            names[name_id] = decode_string(text[:len(text) // 2 * 2], 1200)
+
+    return names
+
+
+def read_name_index(document, pointer, names):
+    """ Returns a dict of element ids to their (name, universal name) """
+    index = {}
+    for _, stream in document.find(pointer, VSD_NAMEIDX):
+        data = document.read(stream)
+        offset = 4 if stream.compressed else 0
+        count = struct.unpack('<I', data[offset:offset + 4])[0]
+        for i in range(count):
+            record = offset + 4 + i * 13
+            name_id, name_u_id, element_id = \
+                struct.unpack('<III', data[record:record + 12])
+            index[element_id] = (names.get(name_id), names.get(name_u_id))
+
+    return index
+
+
+def read_pages(filename):
+    """ Reads list of PageInfo from .vsd file
+
+    Pages are listed in the order of Visio's Pages collection (background
+    pages are included).  Page sizes are in inches.  ``name`` and
+    ``name_u`` are None for pages having the default names, and ``part`` is
+    always None.
+    """
+    try:
+        document = VisioDocument(CompoundFile.open(filename)
+                                 .read_stream(DOCUMENT_STREAM))
+        names = read_names(document)
+        pages = []
+        for _, stream in document.find(document.trailer, VSD_PAGES):
+            page_names = read_name_index(document, stream, names)
+            for page_id, pointer in document.find(stream, VSD_PAGE):
+                width, height = read_page_size(document.read(pointer))
+                name, name_u = page_names.get(page_id, (None, None))
+                if name_u is None or DEFAULT_PAGE_NAME.match(name_u):
+                    name = name_u = None
+                pages.append(PageInfo(
+                    index=len(pages) + 1,
+                    id=page_id,
+                    name=name,
+                    name_u=name_u,
+                    width=width,
+                    height=height,
+                    background=pointer.format in BACKGROUND_FORMATS,
+                    part=None))
+    except (IOError, OSError, struct.error, IndexError, ValueError):
+        raise IOError('Could not read visio document: %s' % filename)
+
+    return pages
+
+
+def decode_string(data, codepage):
+    try:
+        if codepage == 1200:
+            encoding = 'utf-16-le'
+        elif codepage == 65001:
+            encoding = 'utf-8'
+        else:
+            encoding = codecs.lookup('cp%d' % codepage).name
+        text = data.decode(encoding)
+    except (LookupError, UnicodeDecodeError):
+        text = data.decode('latin-1')
+
+    return text.split(u'\x00')[0]
+
+
+def read_properties(filename):
+    """ Reads document properties (title, author and so on) of .vsd file
+
+    Returns a dict of property names to the values; empty properties are
+    omitted.
+    """
+    try:
+        data = CompoundFile.open(filename).read_stream(SUMMARY_STREAM)
+        section = struct.unpack('<I', data[44:48])[0]
+        count = struct.unpack('<I', data[section + 4:section + 8])[0]
+        entries = []
+        for i in range(count):
+            offset = section + 8 + i * 8
+            pid, value = struct.unpack('<II', data[offset:offset + 8])
+            entries.append((pid, section + value))
+
+        values = {}
+        for pid, offset in entries:
+            vt = struct.unpack('<I', data[offset:offset + 4])[0]
+            if vt == VT_LPSTR:
+                size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+                values[pid] = data[offset + 8:offset + 8 + size]
+            elif pid == PID_CODEPAGE:
+                values[pid] = struct.unpack('<H',
+                                            data[offset + 4:offset + 6])[0]
+    except (IOError, OSError, struct.error):
+        raise IOError('Could not read visio document: %s' % filename)
+
+    codepage = values.get(PID_CODEPAGE, 1252)
+    properties = {}
+    for pid, name in SUMMARY_PROPERTIES.items():
+        if pid in values:
+            text = decode_string(values[pid], codepage)
+            if text:
+                properties[name] = text
+
+    return properties
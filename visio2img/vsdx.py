@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Reader of Visio 2013+ packages (.vsdx)
+
+A .vsdx file is a zip archive of XML parts, so the structure of document
+can be read without Visio.
+"""
+
+from __future__ import absolute_import
+
+import posixpath
+import zipfile
+from collections import namedtuple
+from xml.etree import ElementTree
+
+VISIO_NS = 'http://schemas.microsoft.com/office/visio/2012/main'
+REL_NS = ('http://schemas.openxmlformats.org/officeDocument/2006/'
+          'relationships')
+PACKAGE_REL_NS = ('http://schemas.openxmlformats.org/package/2006/'
+                  'relationships')
+
+PAGES_PART = 'visio/pages/pages.xml'
+
+PageInfo = namedtuple('PageInfo',
+                      'index id name name_u width height background part')
+
+
+def qname(name, ns=VISIO_NS):
+    """ Returns qualified name of ElementTree """
+    return '{%s}%s' % (ns, name)
+
+
+def is_vsdx(filename):
+    """ Tests filename is a zip package like .vsdx """
+    try:
+        return zipfile.is_zipfile(filename)
+    except (IOError, OSError):
+        return False
+
+
+def rels_part(part):
+    """ Returns the name of relationships part of part """
+    dirname, basename = posixpath.split(part)
+    return posixpath.join(dirname, '_rels', basename + '.rels')
+
+
+def read_rels(package, part):
+    """ Reads relationships of part as a dict of id to target part """
+    try:
+        root = ElementTree.fromstring(package.read(rels_part(part)))
+    except KeyError:
+        return {}
+
+    dirname = posixpath.dirname(part)
+    rels = {}
+    for rel in root.iter(qname('Relationship', PACKAGE_REL_NS)):
+        target = posixpath.normpath(posixpath.join(dirname,
+                                                   rel.get('Target')))
+        rels[rel.get('Id')] = target
+
+    return rels
+
+
+def get_cell(element, name, default=None):
+    """ Returns the value of named cell under element """
+    for cell in element.findall(qname('Cell')):
+        if cell.get('N') == name:
+            return cell.get('V', default)
+
+    return default
+
+
+def read_pages(filename):
+    """ Reads list of PageInfo from .vsdx file
+
+    Pages are listed in the order of Visio's Pages collection (background
+    pages are included).  Page sizes are in inches.
+    """
+    try:
+        with zipfile.ZipFile(filename) as package:
+            root = ElementTree.fromstring(package.read(PAGES_PART))
+            rels = read_rels(package, PAGES_PART)
+    except (IOError, OSError, KeyError, zipfile.BadZipfile,
+            ElementTree.ParseError):
+        raise IOError('Could not read visio package: %s' % filename)
+
+    pages = []
+    for i, page in enumerate(root.findall(qname('Page'))):
+        sheet = page.find(qname('PageSheet'))
+        if sheet is None:
+            width = height = None
+        else:
+            width = float(get_cell(sheet, 'PageWidth', 0))
+            height = float(get_cell(sheet, 'PageHeight', 0))
+
+        rel = page.find(qname('Rel'))
+        if rel is None:
+            part = None
+        else:
+            part = rels.get(rel.get(qname('id', REL_NS)))
+
+        name_u = page.get('NameU')
+        pages.append(PageInfo(index=i + 1,
+                              id=int(page.get('ID')),
+                              name=page.get('Name', name_u),
+                              name_u=name_u,
+                              width=width,
+                              height=height,
+                              background=page.get('Background') == '1',
+                              part=part))
+
+    return pages
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#  Copyright 2014 Yassu
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import absolute_import
+
+import os
+import threading
+from collections import namedtuple
+
+from visio2img.batch import collect_jobs
+from visio2img.cache import file_digest
+from visio2img.incremental import export_incremental, remove_outputs
+
+WatchResult = namedtuple('WatchResult', 'job action filenames error')
+
+
+def get_stamp(filename):
+    """ Returns (mtime, size) of file, or None if it has gone """
+    try:
+        stat = os.stat(filename)
+        return (stat.st_mtime, stat.st_size)
+    except OSError:
+        return None
+
+
+class Watcher(object):
+    """ Polls visio files under paths and exports changed ones
+
+    Files are compared by mtime and size first, and then by the digest of
+    the content, so touched but unchanged files are not exported.  A file
+    is exported after it stays unchanged for a poll; a burst of saves is
+    exported once.  Images are written to the mirrored tree in output_dir,
+    and only changed pages of .vsdx files are exported (see
+    export_incremental()).  Images of removed files are removed.  A file
+    that failed to export is retried after it stays unchanged for another
+    poll.
+    """
+    def __init__(self, paths, output_dir, image_format='.png', pagenum=None,
+                 pagename=None, pool=None, native=False, interval=1.0):
+        self.paths = paths
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.pagenum = pagenum
+        self.pagename = pagename
+        self.pool = pool
+        self.native = native
+        self.interval = interval
+        self.states = {}  # filename -> (job, stamp, digest) of last export
+        self.pending = {}  # filename -> stamp at the last poll
+
+    def poll(self):
+        """ Exports files changed since the last poll; returns WatchResults """
+        try:
+            jobs = collect_jobs(self.paths, self.output_dir,
+                                self.image_format)
+        except IOError:
+            return []  # watched path has gone for now; try again later
+
+        results = []
+        for job in jobs:
+            stamp = get_stamp(job.visio_filename)
+            state = self.states.get(job.visio_filename)
+            if stamp is None or (state and state[1] == stamp):
+                self.pending.pop(job.visio_filename, None)
+                continue
+
+            if self.pending.get(job.visio_filename) != stamp:
+                self.pending[job.visio_filename] = stamp  # still saving?
+                continue
+
+            del self.pending[job.visio_filename]
+            digest = file_digest(job.visio_filename)
+            if state is None or state[2] != digest:
+                result = self.export(job)
+                results.append(result)
+                if result.error is not None:
+                    continue  # keep the last state to retry later
+
+            self.states[job.visio_filename] = (job, stamp, digest)
+
+        found = set(job.visio_filename for job in jobs)
+        for filename in sorted(set(self.states) - found):
+            job = self.states.pop(filename)[0]
+            results.append(WatchResult(job, 'removed',
+                                       remove_outputs(job.image_filename),
+                                       None))
+
+        return results
+
+    def export(self, job):
+        try:
+            output_dir = os.path.dirname(os.path.abspath(job.image_filename))
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+
+            result = export_incremental(job.visio_filename,
+                                        job.image_filename, self.pagenum,
+                                        self.pagename, pool=self.pool,
+                                        native=self.native)
+            return WatchResult(job, 'exported', result.exported, None)
+        except Exception as err:
+            return WatchResult(job, 'exported', [], err)
+
+    def run(self, stream, stop=None):
+        """ Polls until stop (threading.Event) is set """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            for result in self.poll():
+                print_result(result, stream)
+            stop.wait(self.interval)
+
+
+def print_result(result, stream):
+    """ Prints WatchResult """
+    if result.error is not None:
+        stream.write('failed: %s: %s\n' %
+                     (result.job.visio_filename, result.error))
+    elif result.action == 'removed':
+        stream.write('removed: %s\n' % result.job.visio_filename)
+    else:
+        stream.write('ok: %s -> %s (%d pages)\n' %
+                     (result.job.visio_filename, result.job.image_filename,
+                      len(result.filenames)))
+    stream.flush()